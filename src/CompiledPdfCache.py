@@ -0,0 +1,51 @@
+import json
+import os
+from typing import List, Optional, Tuple
+
+from src.HtmlResultCache import HtmlResultCache
+
+
+class CompiledPdfCache(HtmlResultCache):
+    """Cache of compiled PDFs and their page bounding boxes, keyed by the TeX source.
+
+    - Sits before rasterisation: keys cover only what TeX sees (the full file string with
+      the preamble, and the engine), so a different DPI, background or cropped-PDF request
+      reuses the PDF and skips TeX.
+    - Each entry is `<key>.pdf` plus a `<key>.json` holding the raw bounding box of every
+      page, so Ghostscript's bbox pass is skipped too.
+    - Same storage and LRU eviction as HtmlResultCache.
+
+    Controlled by env: LATEXBOT_PDF_CACHE_DIR (default build/pdf_cache),
+    LATEXBOT_PDF_CACHE_MB (default 64; 0 disables it).
+    """
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None):
+        root = root or os.environ.get("LATEXBOT_PDF_CACHE_DIR") or os.path.join("build", "pdf_cache")
+        if max_bytes is None:
+            try:
+                max_bytes = int(max(0.0, float(os.environ.get("LATEXBOT_PDF_CACHE_MB", "64"))) * 1024 * 1024)
+            except ValueError:
+                max_bytes = 64 * 1024 * 1024
+        super().__init__(root, max_bytes)
+
+    def get_pdf(self, key: str) -> Optional[Tuple[str, List[List[int]]]]:
+        """Return (path, page bounds) of the cached PDF for `key`, or None."""
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            with open(self._meta_path(key), "r", encoding="utf-8") as f:
+                return path, json.load(f)["pages"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put_pdf(self, key: str, path: str, pages: List[List[int]]) -> Optional[str]:
+        """Store the PDF at `path` with its page bounds; a missing file is not cached."""
+        try:
+            with open(path, "rb") as f:
+                return self.put(key, f, ext="pdf", pages=pages)
+        except OSError:
+            return None
+
+    def stats(self) -> dict:
+        return {"pdf_hits": self.hits, "pdf_misses": self.misses}
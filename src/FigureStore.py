@@ -0,0 +1,147 @@
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Optional, Set
+
+
+class FigureStore:
+    """Size-bounded store of content-hashed SVG figures shared by all HTML conversions.
+
+    - make4ht's `dvisvgm_hashes` extension names figures by a hash of their DVI page and
+      skips `dvisvgm` for any figure whose file already exists in the output directory.
+    - A figure's name is only known once TeX has run, so seed() can't pick exactly the
+      figures a run needs. Instead it hard-links the figures that earlier runs with the
+      same `key` (the document preamble) referenced, at most `max_seed` of them, most
+      recently used first. A conversion costs a bounded number of links however large
+      the store grows; figures outside that set are converted again and stored.
+    - harvest() adds the run's new figures to the store, records the ones its pages
+      reference under `key`, and removes the seeded ones the pages don't reference, so
+      they are not packaged.
+    - The least recently used figures are evicted once the store exceeds `max_bytes`.
+      The key -> figures index lives in memory; after a restart it fills up again.
+    """
+
+    HASHED_NAME = re.compile(r"(^|[-_.])[0-9a-f]{32,64}\.svg$")
+    _MAX_KEYS = 1024
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None, max_seed: Optional[int] = None):
+        self._root = root or os.environ.get("LATEXBOT_FIGURE_STORE_DIR") or os.path.join("build", "svg_store")
+        if max_bytes is None:
+            try:
+                max_bytes = int(max(0.0, float(os.environ.get("LATEXBOT_FIGURE_STORE_MB", "256"))) * 1024 * 1024)
+            except ValueError:
+                max_bytes = 256 * 1024 * 1024
+        self._max_bytes = max_bytes
+        if max_seed is None:
+            try:
+                max_seed = max(0, int(os.environ.get("LATEXBOT_FIGURE_SEED_MAX", "256")))
+            except ValueError:
+                max_seed = 256
+        self._max_seed = max_seed
+        # key -> figure names its runs referenced, least recently used first
+        self._used: "OrderedDict[str, OrderedDict[str, None]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.added = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_bytes > 0
+
+    def seed(self, workdir: str, key: str) -> Set[str]:
+        """Link the stored figures earlier runs with `key` used into `workdir`; returns the names that were placed."""
+        seeded: Set[str] = set()
+        if not self.enabled:
+            return seeded
+        with self._lock:
+            names = list(reversed(self._used.get(key, ())))[:self._max_seed]
+        for name in names:
+            dest = os.path.join(workdir, name)
+            if os.path.exists(dest):
+                continue  # kept from an earlier run of the same work directory
+            try:
+                os.link(os.path.join(self._root, name), dest)
+            except FileNotFoundError:
+                continue  # evicted meanwhile
+            except OSError:
+                # No hard links across filesystems: seeding by copy would cost more than it saves
+                return seeded
+            seeded.add(name)
+        return seeded
+
+    def harvest(self, workdir: str, seeded: Set[str], referenced: str, key: str):
+        """Store new figures from `workdir`, remember the referenced ones under `key` and drop unreferenced seeded ones."""
+        if not self.enabled:
+            return
+        os.makedirs(self._root, exist_ok=True)
+        added = False
+        with self._lock:
+            used = [name for name in os.listdir(workdir) if self.HASHED_NAME.search(name) and name in referenced]
+            self._remember(key, used)
+            for name in os.listdir(workdir):
+                if not self.HASHED_NAME.search(name):
+                    continue
+                path = os.path.join(workdir, name)
+                if name in seeded:
+                    if name in referenced:
+                        self.hits += 1
+                        self._touch(path)
+                    else:
+                        os.remove(path)
+                    continue
+                stored = os.path.join(self._root, name)
+                if os.path.exists(stored):
+                    continue
+                try:
+                    os.link(path, stored)
+                except OSError:
+                    shutil.copyfile(path, stored)
+                self.added += 1
+                added = True
+            if added:
+                self._evict()
+
+    def _remember(self, key: str, names: list):
+        if not names or not self._max_seed:
+            return
+        entry = self._used.pop(key, None) or OrderedDict()
+        for name in names:
+            entry.pop(name, None)
+            entry[name] = None
+        while len(entry) > self._max_seed:
+            entry.popitem(last=False)
+        self._used[key] = entry
+        while len(self._used) > self._MAX_KEYS:
+            self._used.popitem(last=False)
+
+    @staticmethod
+    def _touch(path: str):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self._root):
+            path = os.path.join(self._root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, path, st.st_size))
+            total += st.st_size
+        entries.sort()
+        while entries and total > self._max_bytes:
+            _, path, size = entries.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def stats(self) -> dict:
+        return {"figure_hits": self.hits, "figures_added": self.added}
@@ -1,20 +1,50 @@
 import base64
+import hashlib
+import http.client
 import json
 import os
+import threading
 import time
 import urllib.error
 import urllib.parse
 import urllib.request
-from typing import Optional
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional, Tuple
+
+
+class DeployCancelled(RuntimeError):
+    """Raised by deploy_dir when its cancel event is set."""
 
 
 class GitHubDeployer:
-    """Deploy a local directory to a GitHub repository branch path using the Contents API.
+    """Deploy a local directory to a GitHub repository branch path.
+
+    Two modes (`mode` argument or GITHUB_DEPLOY_MODE):
+    - "gitdata" (default): blobs are created concurrently over pooled keep-alive
+      connections, then one tree, one commit and a single ref update. Files up to
+      100 MB are supported.
+    - "contents": one Contents API PUT (and commit) per file; files <1 MB each.
+
+    `api_url` (or GITHUB_API_URL) points the deployer at GitHub Enterprise or a local
+    stand-in server.
 
-    This performs individual PUT requests per file. Suitable for small static sites (files <1 MB each).
+    Redeploys are incremental: git blob SHA-1s are computed locally and compared with
+    the remote tree, so only added or changed files are uploaded. With `mirror_deletes`
+    (or GITHUB_DEPLOY_MIRROR_DELETES) remote files missing locally are removed as well.
+    `last_report` describes the most recent deploy, including bytes and requests saved.
+
+    deploy_dir() reports progress through an optional callback and stops at the next
+    file once its optional `cancel_event` is set; in gitdata mode nothing is committed
+    until every blob has been uploaded, so a cancelled deploy leaves the branch untouched.
     """
 
-    def __init__(self, token: str, owner: str, repo: str, branch: str = "gh-pages", dir_prefix: str = ""):
+    MAX_BLOB_BYTES = 100 * 1024 * 1024
+
+    def __init__(self, token: str, owner: str, repo: str, branch: str = "gh-pages", dir_prefix: str = "",
+                 mode: Optional[str] = None, api_url: Optional[str] = None, workers: Optional[int] = None,
+                 mirror_deletes: Optional[bool] = None):
         if not token:
             raise ValueError("Missing GitHub token")
         if not owner or not repo:
@@ -24,9 +54,28 @@ class GitHubDeployer:
         self._repo = repo
         self._branch = branch or "gh-pages"
         self._dir_prefix = dir_prefix.strip("/")
+        self._mode = (mode or os.environ.get("GITHUB_DEPLOY_MODE") or "gitdata").strip().lower()
+        if self._mode not in ("gitdata", "contents"):
+            raise ValueError(f"Unknown GitHub deploy mode: {self._mode}")
+        self._api_url = (api_url or os.environ.get("GITHUB_API_URL") or "https://api.github.com").rstrip("/")
+        if workers is None:
+            try:
+                workers = int(os.environ.get("GITHUB_DEPLOY_WORKERS", "8"))
+            except ValueError:
+                workers = 8
+        self._workers = max(1, workers)
+        if mirror_deletes is None:
+            mirror_deletes = os.environ.get("GITHUB_DEPLOY_MIRROR_DELETES", "").lower() in ("1", "true", "yes", "on")
+        self._mirror_deletes = mirror_deletes
+        self.last_report: dict = {}
+        # One keep-alive connection per worker thread
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._request_count = 0
 
     def _api(self, path: str) -> str:
-        return f"https://api.github.com{path}"
+        return f"{self._api_url}{path}"
 
     def _headers(self) -> dict:
         return {
@@ -55,8 +104,11 @@ class GitHubDeployer:
             raise urllib.error.HTTPError(e.url, e.code, f"{e.reason} — {body}", e.hdrs, None)
         return None
 
-    def _put_file(self, repo_path: str, content_bytes: bytes, message: str):
+    def _put_file(self, repo_path: str, content_bytes: bytes, message: str) -> bool:
+        """Upload one file; returns False when the remote copy is already identical."""
         sha = self._get_sha_if_exists(repo_path)
+        if sha == self.git_blob_sha(content_bytes):
+            return False
         # Preserve path separators; GitHub expects slashes in the path portion
         url = self._api(f"/repos/{self._owner}/{self._repo}/contents/{urllib.parse.quote(repo_path, safe='/')}")
         payload = {
@@ -72,6 +124,7 @@ class GitHubDeployer:
             with urllib.request.urlopen(req) as resp:
                 # We ignore body except for errors
                 resp.read()
+            return True
         except urllib.error.HTTPError as e:
             # Include response body in error for diagnostics (e.g., missing branch, permissions)
             try:
@@ -91,24 +144,242 @@ class GitHubDeployer:
                 return False
             return False
 
-    def deploy_dir(self, local_dir: str, dest_slug: Optional[str] = None) -> str:
-        if not os.path.isdir(local_dir):
+    # --------------------- Git Data API ---------------------
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            parts = urllib.parse.urlsplit(self._api_url)
+            cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            conn = self._local.conn = cls(parts.hostname, parts.port, timeout=60)
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _close_connections(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _close_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _request(self, method: str, path: str, payload: Optional[dict] = None) -> dict:
+        """JSON request on this thread's pooled connection; raises HTTPError with the body on failure."""
+        url = self._api(path)
+        parts = urllib.parse.urlsplit(url)
+        target = parts.path + ("?" + parts.query if parts.query else "")
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {**self._headers(), "Connection": "keep-alive"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        with self._connections_lock:
+            self._request_count += 1
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, target, body=body, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                break
+            except (http.client.HTTPException, ConnectionError, TimeoutError):
+                # The server may drop idle keep-alive connections; reconnect once
+                self._close_connection()
+                if attempt:
+                    raise
+        if resp.status >= 400:
+            text = data.decode("utf-8", errors="replace")
+            raise urllib.error.HTTPError(url, resp.status, f"{resp.reason} — {text}", resp.headers, None)
+        return json.loads(data.decode("utf-8")) if data else {}
+
+    def _create_blob(self, content: bytes) -> str:
+        if len(content) > self.MAX_BLOB_BYTES:
+            raise ValueError("File too large for GitHub (limit 100 MB).")
+        blob = self._request("POST", f"/repos/{self._owner}/{self._repo}/git/blobs", {
+            "content": base64.b64encode(content).decode("ascii"),
+            "encoding": "base64",
+        })
+        return blob["sha"]
+
+    def _head(self) -> Tuple[str, str]:
+        """Return (commit sha, tree sha) of the branch head."""
+        try:
+            ref = self._request("GET", f"/repos/{self._owner}/{self._repo}/git/ref/heads/{urllib.parse.quote(self._branch, safe='/')}")
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise RuntimeError(f"Branch '{self._branch}' not found in {self._owner}/{self._repo}. Create it or set GITHUB_BRANCH.")
+            raise
+        commit_sha = ref["object"]["sha"]
+        commit = self._request("GET", f"/repos/{self._owner}/{self._repo}/git/commits/{commit_sha}")
+        return commit_sha, commit["tree"]["sha"]
+
+    @staticmethod
+    def git_blob_sha(content: bytes) -> str:
+        """SHA-1 git assigns to a blob with this content."""
+        return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+    def _remote_files(self, tree_sha: str, root_repo_path: str) -> Optional[dict]:
+        """Map of relative path -> blob sha under root_repo_path on the remote.
+
+        Returns {} when the path doesn't exist yet and None when the listing is incomplete.
+        """
+        for part in [p for p in root_repo_path.split("/") if p]:
+            tree = self._request("GET", f"/repos/{self._owner}/{self._repo}/git/trees/{tree_sha}")
+            sub = next((e for e in tree.get("tree", []) if e["path"] == part and e["type"] == "tree"), None)
+            if sub is None:
+                return {}
+            tree_sha = sub["sha"]
+        tree = self._request("GET", f"/repos/{self._owner}/{self._repo}/git/trees/{tree_sha}?recursive=1")
+        if tree.get("truncated"):
+            return None
+        return {e["path"]: e["sha"] for e in tree.get("tree", []) if e["type"] == "blob"}
+
+    def _upload_blobs(self, files: Iterator[Tuple[str, bytes]], root_repo_path: str, remote: Optional[dict], report: dict,
+                      progress: Optional[Callable[[dict], None]] = None, cancel_event: Optional[threading.Event] = None) -> list:
+        """Create blobs concurrently for new or changed files; returns their tree entries."""
+        entries = []
+
+        def finish(repo_path, future, size):
+            entries.append({"path": repo_path, "mode": "100644", "type": "blob", "sha": future.result()})
+            report["uploaded"] += 1
+            report["bytes_uploaded"] += size
+            self._notify(progress, report)
+
+        with ThreadPoolExecutor(max_workers=self._workers) as pool:
+            # Bounded look-ahead: at most a few files are held in memory at once
+            window = deque()
+            try:
+                for rel, content in files:
+                    self._check_cancel(cancel_event)
+                    report["files"] += 1
+                    report["seen"].add(rel)
+                    if remote and remote.get(rel) == self.git_blob_sha(content):
+                        report["unchanged"] += 1
+                        report["bytes_saved"] += len(content)
+                        self._notify(progress, report)
+                        continue
+                    repo_path = "/".join([p for p in [root_repo_path, rel] if p])
+                    window.append((repo_path, pool.submit(self._create_blob, content), len(content)))
+                    while len(window) > self._workers * 2:
+                        finish(*window.popleft())
+                while window:
+                    finish(*window.popleft())
+                    self._check_cancel(cancel_event)
+            finally:
+                # Don't start queued uploads after a failure or cancellation
+                for _, future, _ in window:
+                    future.cancel()
+        return entries
+
+    @staticmethod
+    def _check_cancel(cancel_event: Optional[threading.Event]):
+        if cancel_event is not None and cancel_event.is_set():
+            raise DeployCancelled("Deployment cancelled")
+
+    @staticmethod
+    def _notify(progress: Optional[Callable[[dict], None]], report: dict):
+        if progress is not None:
+            progress({k: v for k, v in report.items() if k != "seen"})
+
+    def _commit_tree(self, entries: list, message: str, head: Optional[Tuple[str, str]] = None, attempts: int = 3):
+        """Create one tree and one commit on top of the branch head, then move the ref."""
+        for attempt in range(attempts):
+            parent, base_tree = head if head and not attempt else self._head()
+            tree = self._request("POST", f"/repos/{self._owner}/{self._repo}/git/trees", {"base_tree": base_tree, "tree": entries})
+            commit = self._request("POST", f"/repos/{self._owner}/{self._repo}/git/commits", {
+                "message": message, "tree": tree["sha"], "parents": [parent],
+            })
+            try:
+                self._request("PATCH", f"/repos/{self._owner}/{self._repo}/git/refs/heads/{urllib.parse.quote(self._branch, safe='/')}",
+                              {"sha": commit["sha"], "force": False})
+                return
+            except urllib.error.HTTPError as e:
+                # 422: the branch moved meanwhile (not a fast-forward); rebuild on the new head
+                if e.code != 422 or attempt == attempts - 1:
+                    raise
+
+    def _deploy_gitdata(self, local_dir: str, root_repo_path: str, slug: str,
+                        progress: Optional[Callable[[dict], None]] = None, cancel_event: Optional[threading.Event] = None) -> dict:
+        report = {"files": 0, "uploaded": 0, "unchanged": 0, "deleted": 0,
+                  "bytes_uploaded": 0, "bytes_saved": 0, "seen": set()}
+        self._request_count = 0
+        try:
+            # Resolve the branch before uploading anything for a clear error on a missing branch
+            head = self._head()
+            remote = self._remote_files(head[1], root_repo_path)
+            entries = self._upload_blobs(self._iter_site_files(local_dir), root_repo_path, remote, report, progress, cancel_event)
+            if self._mirror_deletes and remote:
+                for rel in sorted(set(remote) - report["seen"]):
+                    entries.append({"path": f"{root_repo_path}/{rel}".lstrip("/"), "mode": "100644", "type": "blob", "sha": None})
+                    report["deleted"] += 1
+            if entries:
+                self._check_cancel(cancel_event)
+                self._commit_tree(entries, f"deploy: {slug} ({report['uploaded']} changed, {report['deleted']} deleted)", head=head)
+        finally:
+            self._close_connections()
+        del report["seen"]
+        report["requests"] = self._request_count
+        # Compared with uploading everything: one blob POST per unchanged file, plus
+        # the tree/commit/ref requests when nothing had to be committed at all
+        report["requests_saved"] = report["unchanged"] + (0 if entries else 3)
+        return report
+
+    @staticmethod
+    def _iter_site_files(local_path: str) -> Iterator[Tuple[str, bytes]]:
+        """Yield (relative posix path, content) for a site directory or a site ZIP archive."""
+        if os.path.isfile(local_path) and zipfile.is_zipfile(local_path):
+            with zipfile.ZipFile(local_path) as zf:
+                for info in zf.infolist():
+                    if not info.is_dir():
+                        yield info.filename, zf.read(info)
+            return
+        for root, _, files in os.walk(local_path):
+            for name in files:
+                full = os.path.join(root, name)
+                rel = os.path.relpath(full, local_path).replace("\\", "/")
+                with open(full, "rb") as f:
+                    yield rel, f.read()
+
+    def deploy_dir(self, local_dir: str, dest_slug: Optional[str] = None,
+                   progress: Optional[Callable[[dict], None]] = None, cancel_event: Optional[threading.Event] = None) -> str:
+        """Deploy a site directory (or a ZIP archive of it) under <dir_prefix>/<slug>/.
+
+        `progress` is called from the deploying thread with running counters
+        (files, uploaded, unchanged, bytes_uploaded, ...).
+        """
+        if not os.path.isdir(local_dir) and not (os.path.isfile(local_dir) and zipfile.is_zipfile(local_dir)):
             raise ValueError(f"Local directory not found: {local_dir}")
-        # Preflight branch check for clearer errors than a later 404
-        if not self._branch_exists():
-            raise RuntimeError(f"Branch '{self._branch}' not found in {self._owner}/{self._repo}. Create it or set GITHUB_BRANCH.")
         slug = dest_slug or time.strftime("site-%Y%m%d-%H%M%S")
         root_parts = [p for p in [self._dir_prefix, slug] if p]
         root_repo_path = "/".join(root_parts)
-        # Upload files
-        for root, _, files in os.walk(local_dir):
-            for name in files:
-                full = os.path.join(root, name)
-                rel = os.path.relpath(full, local_dir).replace("\\", "/")
-                repo_path = "/".join([p for p in [root_repo_path, rel] if p])
-                with open(full, "rb") as f:
-                    content = f.read()
-                self._put_file(repo_path, content, message=f"deploy: {slug} -> {repo_path}")
+        if self._mode == "gitdata":
+            self.last_report = self._deploy_gitdata(local_dir, root_repo_path, slug, progress, cancel_event)
+            return slug
+        # Preflight branch check for clearer errors than a later 404
+        if not self._branch_exists():
+            raise RuntimeError(f"Branch '{self._branch}' not found in {self._owner}/{self._repo}. Create it or set GITHUB_BRANCH.")
+        # Upload files; unchanged ones still cost the SHA lookup but skip the PUT and its commit
+        report = {"files": 0, "uploaded": 0, "unchanged": 0, "deleted": 0, "bytes_uploaded": 0, "bytes_saved": 0}
+        for rel, content in self._iter_site_files(local_dir):
+            # Each file is its own commit here, so a cancel keeps what was already pushed
+            self._check_cancel(cancel_event)
+            repo_path = "/".join([p for p in [root_repo_path, rel] if p])
+            report["files"] += 1
+            if self._put_file(repo_path, content, message=f"deploy: {slug} -> {repo_path}"):
+                report["uploaded"] += 1
+                report["bytes_uploaded"] += len(content)
+            else:
+                report["unchanged"] += 1
+                report["bytes_saved"] += len(content)
+            self._notify(progress, report)
+        report["requests"] = 1 + report["files"] + report["uploaded"]
+        report["requests_saved"] = report["unchanged"]
+        self.last_report = report
         return slug
 
     @staticmethod
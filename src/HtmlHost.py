@@ -1,23 +1,143 @@
 import asyncio
+import glob
+import gzip
+import hashlib
+import json
+import mimetypes
 import os
+import re
+import posixpath
+import struct
 import time
 import uuid
 import socket
+import zipfile
+import zlib
+from collections import OrderedDict
 from typing import Dict, Tuple, Optional
 
 from aiohttp import web
 
+from src.ThemeInjector import ThemeInjector
+
+try:
+    import brotli  # optional: enables .br variants for directory previews
+except ImportError:
+    brotli = None
+
+# Text assets worth precompressing / compressing on the fly
+_COMPRESSIBLE_EXTS = {".html", ".htm", ".xhtml", ".css", ".js", ".svg", ".xml", ".json", ".txt", ".mml"}
+# dvisvgm_hashes names figures by content hash, so they never change under the same name
+_HASHED_ASSET_RE = re.compile(r"(^|[-_.])[0-9a-f]{32,64}\.svg$")
+_IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+_REVALIDATE_CACHE = "no-cache"
+
+
+class _ZipSite:
+    """A generated site served straight out of its ZIP archive.
+
+    The central directory is parsed once at registration; each request seeks to
+    the member's local header and reads only that member's bytes.
+    """
+
+    _LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+
+    def __init__(self, zip_path: str):
+        self.path = os.path.abspath(zip_path)
+        with zipfile.ZipFile(self.path) as zf:
+            self.members: Dict[str, zipfile.ZipInfo] = {
+                info.filename: info for info in zf.infolist() if not info.is_dir()
+            }
+        # member name -> absolute offset of its compressed data (filled lazily)
+        self._data_offsets: Dict[str, int] = {}
+
+    def resolve(self, tail: str) -> Optional[str]:
+        tail = (tail or "index.html").replace("\\", "/")
+        # Absolute names and any ".." component never resolve, even if the archive has such a member
+        if tail.startswith("/") or re.match(r"[A-Za-z]:", tail) or ".." in tail.split("/"):
+            return None
+        name = posixpath.normpath(tail)
+        if name in ("", "."):
+            name = "index.html"
+        if name in self.members:
+            return name
+        index = posixpath.join(name, "index.html")
+        if index in self.members:
+            return index
+        return None
+
+    def _data_offset(self, f, name: str) -> int:
+        offset = self._data_offsets.get(name)
+        if offset is None:
+            info = self.members[name]
+            f.seek(info.header_offset)
+            header = self._LOCAL_HEADER.unpack(f.read(self._LOCAL_HEADER.size))
+            if header[0] != b"PK\x03\x04":
+                raise zipfile.BadZipFile(f"Bad local header for {name}")
+            name_len, extra_len = header[9], header[10]
+            offset = info.header_offset + self._LOCAL_HEADER.size + name_len + extra_len
+            self._data_offsets[name] = offset
+        return offset
+
+    def _read_raw(self, name: str) -> bytes:
+        with open(self.path, "rb") as f:
+            f.seek(self._data_offset(f, name))
+            return f.read(self.members[name].compress_size)
+
+    def read(self, name: str) -> bytes:
+        info = self.members[name]
+        raw = self._read_raw(name)
+        if info.compress_type == zipfile.ZIP_STORED:
+            return raw
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            return zlib.decompressobj(-zlib.MAX_WBITS).decompress(raw)
+        raise zipfile.BadZipFile(f"Unsupported compression for {name}")
+
+    def read_gzip(self, name: str) -> Optional[bytes]:
+        """Return a deflated member as a gzip stream without recompressing it.
+
+        A ZIP member's raw deflate data plus its CRC-32 and size is exactly the body
+        of a gzip file, so only the 10-byte header and 8-byte trailer are added.
+        """
+        info = self.members[name]
+        if info.compress_type != zipfile.ZIP_DEFLATED:
+            return None
+        header = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+        trailer = struct.pack("<2L", info.CRC, info.file_size & 0xFFFFFFFF)
+        return header + self._read_raw(name) + trailer
+
+    def etag(self, name: str) -> str:
+        info = self.members[name]
+        return f"{info.CRC:08x}-{info.file_size:x}"
+
 
 class HtmlHost:
     """Lightweight temporary static host for generated HTML sites.
 
     - Start an aiohttp server on a configured host/port.
-    - Register a directory to get a tokenized URL.
+    - Register a directory or a ZIP archive to get a tokenized URL.
     - Serves files under /site/{token}/... with index.html fallback.
-    - No automatic expiration; manual management via list/unregister/unregister_all.
+    - ZIP previews are served member-by-member without extracting the archive.
+    - A background sweeper expires previews after a TTL, keeps the total size under a
+      disk quota (least recently accessed first) and caps previews per user. Evicted
+      files are deleted and their tokens answer 410 Gone.
+    - Responses carry strong ETags and answer If-None-Match with 304; content-hashed
+      dvisvgm figures are marked immutable. Text assets are served gzip/brotli encoded
+      when the client accepts it (precomputed siblings for directories, the archive's
+      own deflate stream for ZIPs). Directory siblings are written in the executor when a
+      site is registered from the event loop; its first requests wait for them.
+    - Manual management via list/unregister/unregister_all.
+    - The registry is persisted to a small JSON file (HTML_PREVIEW_REGISTRY, default
+      build/html_previews.json) and loaded when the server starts (or on first use), so preview links survive
+      restarts; removed tokens are kept there too, so their links still answer 410. If the
+      file is missing or unreadable it is rebuilt from build/html_*, reusing each
+      preview's token from its `.token` sidecar when present.
+
+    Limits come from HTML_PREVIEW_TTL (seconds), HTML_PREVIEW_MAX_MB,
+    HTML_PREVIEW_MAX_PER_USER and HTML_SWEEP_INTERVAL; 0 disables a limit.
     """
 
-    def __init__(self, host: str = "0.0.0.0", port: int = 8080, base_url: Optional[str] = None):
+    def __init__(self, host: str = "0.0.0.0", port: int = 8080, base_url: Optional[str] = None, registry_path: Optional[str] = None):
         self._host = host
         self._port = port
         # Determine a sensible public-facing base URL for links
@@ -51,8 +171,39 @@ class HtmlHost:
         self._app: Optional[web.Application] = None
         self._runner: Optional[web.AppRunner] = None
         self._site: Optional[web.TCPSite] = None
-        # token -> directory path
+        self._sweeper: Optional[asyncio.Task] = None
+        # token -> directory (or ZIP archive) path
         self._map: Dict[str, str] = {}
+        # token -> central-directory index for ZIP-backed previews
+        self._zips: Dict[str, _ZipSite] = {}
+        # token -> {relative path -> {"etag", "encodings"}} for directory previews
+        self._assets: Dict[str, Dict[str, dict]] = {}
+        # token -> precompression still running in the executor
+        self._pending_assets: Dict[str, asyncio.Future] = {}
+        # token -> {"created", "last_access", "expires", "size", "user_id"}
+        self._meta: Dict[str, dict] = {}
+        # Recently removed tokens (bounded) so their links answer 410 instead of 404
+        self._gone: "OrderedDict[str, str]" = OrderedDict()
+        self._evictions: Dict[str, int] = {"ttl": 0, "quota": 0, "user_limit": 0}
+        self._ttl = self._env_number("HTML_PREVIEW_TTL", 24 * 3600)
+        self._max_bytes = int(self._env_number("HTML_PREVIEW_MAX_MB", 1024) * 1024 * 1024)
+        self._max_per_user = int(self._env_number("HTML_PREVIEW_MAX_PER_USER", 10))
+        self._sweep_interval = max(1.0, self._env_number("HTML_SWEEP_INTERVAL", 60))
+        self._registry_path = registry_path or os.environ.get("HTML_PREVIEW_REGISTRY") or os.path.join("build", "html_previews.json")
+        self._loaded = False
+        # Directory previews hold raw TeX4ht pages; the theme is applied as they are served
+        self._theme = ThemeInjector.from_env()
+        # last_access changes are flushed by the sweeper rather than on every request
+        self._dirty = False
+
+    _MAX_TOMBSTONES = 10000
+
+    @staticmethod
+    def _env_number(name: str, default: float) -> float:
+        try:
+            return max(0.0, float(os.environ.get(name, default)))
+        except ValueError:
+            return float(default)
 
     @property
     def base_url(self) -> str:
@@ -64,6 +215,8 @@ class HtmlHost:
     async def start(self):
         if self._app is not None:
             return
+        # Before any conversion writes build/html_*, so a rebuild only finds earlier sites
+        self._ensure_loaded()
         self._app = web.Application()
         self._app.add_routes([
             web.get("/site/{token}", self._handle_root),
@@ -74,8 +227,12 @@ class HtmlHost:
         await self._runner.setup()
         self._site = web.TCPSite(self._runner, self._host, self._port)
         await self._site.start()
+        self._sweeper = asyncio.create_task(self._sweep_loop())
 
     async def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            self._sweeper = None
         if self._site:
             await self._site.stop()
             self._site = None
@@ -83,65 +240,438 @@ class HtmlHost:
             await self._runner.cleanup()
             self._runner = None
         self._app = None
-    def register_dir(self, dir_path: str) -> str:
+
+    def register_dir(self, dir_path: str, user_id: Optional[int] = None, ttl: Optional[float] = None) -> str:
+        self._ensure_loaded(registering=dir_path)
         token = uuid.uuid4().hex
         self._map[token] = os.path.abspath(dir_path)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._assets[token] = self._precompress_dir(self._map[token], self._theme)
+        else:
+            # Compressing a large site would block the bot; requests wait for it in _site_assets
+            self._pending_assets[token] = loop.run_in_executor(None, self._precompress_dir, self._map[token], self._theme)
+        self._track(token, user_id, ttl)
+        return f"{self._base_url}/site/{token}/"
+
+    def register_zip(self, zip_path: str, user_id: Optional[int] = None, ttl: Optional[float] = None) -> str:
+        """Register a ZIP archive produced by convertToHtml; it is served without extraction."""
+        self._ensure_loaded(registering=zip_path)
+        site = _ZipSite(zip_path)
+        token = uuid.uuid4().hex
+        self._zips[token] = site
+        self._map[token] = site.path
+        self._track(token, user_id, ttl)
         return f"{self._base_url}/site/{token}/"
 
     def list_previews(self) -> Dict[str, str]:
         """Return a mapping of token -> directory path for all registered sites."""
+        self._ensure_loaded()
         return dict(self._map)
 
+    def stats(self) -> Dict[str, int]:
+        """Current preview count, total bytes and eviction counters by reason."""
+        self._ensure_loaded()
+        out = {
+            "previews": len(self._map),
+            "bytes": sum(m["size"] for m in self._meta.values()),
+        }
+        for reason, count in self._evictions.items():
+            out[f"evicted_{reason}"] = count
+        return out
+
     def unregister(self, token: str, delete_dir: bool = False) -> bool:
         """Unregister a single token, optionally deleting the directory."""
-        path = self._map.pop(token, None)
+        self._ensure_loaded()
+        path = self._forget(token, "removed")
         if not path:
             return False
-        if delete_dir and os.path.isdir(path):
-            try:
-                import shutil
-                shutil.rmtree(path, ignore_errors=True)
-            except Exception:
-                pass
+        if delete_dir:
+            self._delete_path(path)
+        self._save()
         return True
 
     def unregister_all(self, delete_dirs: bool = False) -> int:
         """Unregister all tokens; optionally delete their directories. Returns count removed."""
-        items = list(self._map.items())
-        self._map.clear()
+        self._ensure_loaded()
+        items = [(token, self._forget(token, "removed")) for token in list(self._map)]
         if delete_dirs:
             for _, path in items:
-                if os.path.isdir(path):
+                self._delete_path(path)
+        self._save()
+        return len(items)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Evict expired previews, then least recently accessed ones above the disk quota.
+
+        Returns the number of previews evicted.
+        """
+        self._ensure_loaded()
+        now = time.time() if now is None else now
+        evicted = 0
+        for token, meta in list(self._meta.items()):
+            if meta["expires"] and meta["expires"] <= now:
+                self._evict(token, "ttl")
+                evicted += 1
+        if self._max_bytes:
+            total = sum(m["size"] for m in self._meta.values())
+            for token in sorted(self._meta, key=lambda t: self._meta[t]["last_access"]):
+                if total <= self._max_bytes:
+                    break
+                total -= self._meta[token]["size"]
+                self._evict(token, "quota")
+                evicted += 1
+        if evicted or self._dirty:
+            self._save()
+        return evicted
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self._sweep_interval)
+            try:
+                # Sizes are recorded at registration, so a sweep is cheap enough for the loop
+                self.sweep()
+            except Exception:
+                pass
+
+    # ----------------------------- persistence -----------------------------
+    def _ensure_loaded(self, registering: Optional[str] = None):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self._registry_path, "r", encoding="utf-8") as f:
+                registry = json.load(f)
+            previews = registry["previews"]
+            gone = registry.get("gone") or {}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            self._rebuild(skip=registering)
+            return
+        if isinstance(gone, dict):
+            self._gone.update((token, str(reason)) for token, reason in list(gone.items())[-self._MAX_TOMBSTONES:])
+        for token, entry in previews.items():
+            path = entry.get("path")
+            if not path or not os.path.exists(path):
+                continue
+            self._map[token] = path
+            self._meta[token] = {k: entry.get(k) for k in ("created", "last_access", "expires", "size", "user_id")}
+            for key in ("created", "last_access", "expires", "size"):
+                self._meta[token][key] = self._meta[token][key] or 0
+
+    def _rebuild(self, skip: Optional[str] = None):
+        """Re-register kept sites found next to the registry file (build/html_*).
+
+        `skip` is the site being registered right now; it gets its own entry.
+        """
+        base = os.path.dirname(self._registry_path) or "."
+        skip = os.path.abspath(skip) if skip else None
+        for path in glob.glob(os.path.join(base, "html_*")):
+            if os.path.abspath(path) == skip:
+                continue
+            if path.endswith(".zip"):
+                if not zipfile.is_zipfile(path):
+                    continue
+            elif not os.path.isfile(os.path.join(path, "index.html")):
+                continue
+            token = None
+            try:
+                with open(self._sidecar_path(path), "r", encoding="utf-8") as f:
+                    token = f.read().strip() or None
+            except OSError:
+                pass
+            token = token or uuid.uuid4().hex
+            mtime = os.path.getmtime(path)
+            self._map[token] = os.path.abspath(path)
+            self._meta[token] = {
+                "created": mtime,
+                "last_access": mtime,
+                "expires": mtime + self._ttl if self._ttl else 0,
+                "size": self._path_size(path),
+                "user_id": None,
+            }
+        self._save()
+
+    def _save(self):
+        previews = {}
+        for token, path in self._map.items():
+            entry = dict(self._meta.get(token, {}))
+            entry["path"] = path
+            previews[token] = entry
+        tmp = self._registry_path + ".tmp"
+        try:
+            reg_dir = os.path.dirname(self._registry_path)
+            if reg_dir:
+                os.makedirs(reg_dir, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "previews": previews, "gone": self._gone}, f)
+            os.replace(tmp, self._registry_path)
+            self._dirty = False
+        except OSError:
+            pass
+
+    @staticmethod
+    def _sidecar_path(path: str) -> str:
+        # build/html_<session>(.zip) -> build/html_<session>.token
+        return os.path.splitext(path.rstrip("/\\"))[0] + ".token"
+
+    def _write_sidecar(self, token: str, path: str):
+        try:
+            with open(self._sidecar_path(path), "w", encoding="utf-8") as f:
+                f.write(token)
+        except OSError:
+            pass
+
+    def _track(self, token: str, user_id: Optional[int], ttl: Optional[float]):
+        now = time.time()
+        ttl = self._ttl if ttl is None else ttl
+        self._meta[token] = {
+            "created": now,
+            "last_access": now,
+            "expires": now + ttl if ttl else 0,
+            "size": self._path_size(self._map[token]),
+            "user_id": user_id,
+        }
+        self._write_sidecar(token, self._map[token])
+        if user_id is not None and self._max_per_user:
+            owned = sorted((t for t, m in self._meta.items() if m["user_id"] == user_id),
+                           key=lambda t: self._meta[t]["last_access"])
+            for old in owned[:max(0, len(owned) - self._max_per_user)]:
+                if old != token:
+                    self._evict(old, "user_limit")
+        if self._max_bytes:
+            self.sweep(now)
+        self._save()
+
+    def _evict(self, token: str, reason: str):
+        path = self._forget(token, reason)
+        if path:
+            self._evictions[reason] = self._evictions.get(reason, 0) + 1
+            self._delete_path(path)
+
+    def _forget(self, token: str, reason: str) -> Optional[str]:
+        path = self._map.pop(token, None)
+        self._zips.pop(token, None)
+        self._assets.pop(token, None)
+        self._pending_assets.pop(token, None)
+        self._meta.pop(token, None)
+        if path:
+            try:
+                os.remove(self._sidecar_path(path))
+            except OSError:
+                pass
+            self._gone[token] = reason
+            while len(self._gone) > self._MAX_TOMBSTONES:
+                self._gone.popitem(last=False)
+        return path
+
+    @staticmethod
+    def _path_size(path: str) -> int:
+        try:
+            if os.path.isfile(path):
+                return os.path.getsize(path)
+            total = 0
+            for root, _, files in os.walk(path):
+                for name in files:
                     try:
-                        import shutil
-                        shutil.rmtree(path, ignore_errors=True)
-                    except Exception:
+                        total += os.path.getsize(os.path.join(root, name))
+                    except OSError:
                         pass
-        return len(items)
+            return total
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _delete_path(path: str):
+        try:
+            if os.path.isdir(path):
+                import shutil
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.isfile(path):
+                os.remove(path)
+        except Exception:
+            pass
+
+    @staticmethod
+    def _precompress_dir(base: str, theme: Optional[ThemeInjector] = None) -> Dict[str, dict]:
+        """Write .gz (and .br when available) siblings for text assets and record strong ETags.
+
+        Variants and ETags of HTML pages describe the themed page when `theme` is set.
+        """
+        assets: Dict[str, dict] = {}
+        for root, _, files in os.walk(base):
+            for name in files:
+                if name.endswith((".gz", ".br")):
+                    continue
+                full = os.path.join(root, name)
+                rel = os.path.relpath(full, base).replace("\\", "/")
+                try:
+                    with open(full, "rb") as f:
+                        data = f.read()
+                except OSError:
+                    continue
+                if theme is not None and theme.applies(name):
+                    data = theme.apply(data)
+                encodings = []
+                if os.path.splitext(name)[1].lower() in _COMPRESSIBLE_EXTS and len(data) > 256:
+                    variants = [("gzip", ".gz", lambda d: gzip.compress(d, 9, mtime=0))]
+                    if brotli is not None:
+                        variants.insert(0, ("br", ".br", lambda d: brotli.compress(d)))
+                    for encoding, suffix, compress in variants:
+                        try:
+                            packed = compress(data)
+                            if len(packed) < len(data):
+                                with open(full + suffix, "wb") as f:
+                                    f.write(packed)
+                                encodings.append(encoding)
+                        except Exception:
+                            pass
+                assets[rel] = {"etag": hashlib.sha1(data).hexdigest(), "encodings": encodings}
+        return assets
+
+    def _themed(self, rel: str, data: bytes) -> bytes:
+        if self._theme is not None and self._theme.applies(rel):
+            return self._theme.apply(data)
+        return data
+
+    @staticmethod
+    def _accepted_encodings(request: web.Request) -> set:
+        accepted = set()
+        for part in request.headers.get("Accept-Encoding", "").split(","):
+            token, _, params = part.strip().partition(";")
+            if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                continue
+            if token:
+                accepted.add(token.strip().lower())
+        return accepted
+
+    @staticmethod
+    def _not_modified(request: web.Request, etag: str) -> bool:
+        header = request.headers.get("If-None-Match")
+        if not header:
+            return False
+        for candidate in header.split(","):
+            candidate = candidate.strip()
+            if candidate == "*":
+                return True
+            if candidate.startswith("W/"):
+                candidate = candidate[2:]
+            if candidate == etag:
+                return True
+        return False
+
+    @staticmethod
+    def _cache_headers(name: str, etag: str, encoding: Optional[str], compressible: bool) -> Dict[str, str]:
+        headers = {
+            "ETag": f'"{etag}-{encoding}"' if encoding else f'"{etag}"',
+            "Cache-Control": _IMMUTABLE_CACHE if _HASHED_ASSET_RE.search(posixpath.basename(name)) else _REVALIDATE_CACHE,
+        }
+        if compressible:
+            headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return headers
 
     async def _handle_root(self, request: web.Request):
-        token = request.match_info.get("token")
-        base = self._get_valid_dir(token)
-        if not base:
-            raise web.HTTPNotFound()
-        return web.FileResponse(os.path.join(base, "index.html"))
+        return await self._serve(request, "index.html")
 
     async def _handle_file(self, request: web.Request):
+        return await self._serve(request, request.match_info.get("tail") or "index.html")
+
+    async def _serve(self, request: web.Request, tail: str):
         token = request.match_info.get("token")
-        tail = request.match_info.get("tail") or "index.html"
         base = self._get_valid_dir(token)
-        if not base:
-            raise web.HTTPNotFound()
+        if base.endswith(".zip"):
+            site = self._zips.get(token)
+            if site is None:
+                # Registered before a restart: index the central directory on first use
+                try:
+                    site = self._zips[token] = _ZipSite(base)
+                except (OSError, zipfile.BadZipFile):
+                    raise web.HTTPNotFound()
+            return await self._serve_zip_member(request, site, tail)
         # Prevent path traversal
         full = os.path.abspath(os.path.join(base, tail))
         if not full.startswith(os.path.abspath(base)):
             raise web.HTTPForbidden()
         if not os.path.exists(full) or not os.path.isfile(full):
             raise web.HTTPNotFound()
-        return web.FileResponse(full)
+        rel = os.path.relpath(full, base).replace("\\", "/")
+        compressible = os.path.splitext(full)[1].lower() in _COMPRESSIBLE_EXTS
+        asset = (await self._site_assets(token, base)).get(rel)
+        if asset is None:
+            # File appeared after registration: hash it now (no precompressed variants)
+            with open(full, "rb") as f:
+                asset = {"etag": hashlib.sha1(self._themed(rel, f.read())).hexdigest(), "encodings": []}
+        accepted = self._accepted_encodings(request)
+        encoding = next((e for e in asset["encodings"] if e in accepted), None)
+        path = full + {"br": ".br", "gzip": ".gz"}[encoding] if encoding else full
+        headers = self._cache_headers(rel, asset["etag"], encoding, compressible)
+        if self._not_modified(request, headers["ETag"]):
+            headers.pop("Content-Encoding", None)
+            return web.Response(status=304, headers=headers)
+
+        def load():
+            with open(path, "rb") as f:
+                data = f.read()
+            # Precompressed variants were themed when they were written
+            return data if encoding else self._themed(rel, data)
+
+        data = await asyncio.get_running_loop().run_in_executor(None, load)
+        content_type = mimetypes.guess_type(full)[0] or "application/octet-stream"
+        return web.Response(body=data, content_type=content_type, headers=headers)
+
+    async def _site_assets(self, token: str, base: str) -> Dict[str, dict]:
+        assets = self._assets.get(token)
+        if assets is not None:
+            return assets
+        pending = self._pending_assets.get(token)
+        if pending is None:
+            # Registered before a restart: siblings exist already, recompute ETags once
+            pending = self._pending_assets[token] = asyncio.get_running_loop().run_in_executor(
+                None, self._precompress_dir, base, self._theme)
+        # Shielded: one cancelled request must not cancel the work other requests wait for
+        assets = await asyncio.shield(pending)
+        if self._pending_assets.get(token) is pending:
+            del self._pending_assets[token]
+            self._assets[token] = assets
+        return assets
+
+    async def _serve_zip_member(self, request: web.Request, site: _ZipSite, tail: str):
+        name = site.resolve(tail)
+        if not name:
+            raise web.HTTPNotFound()
+        compressible = posixpath.splitext(name)[1].lower() in _COMPRESSIBLE_EXTS
+        encoding = None
+        loader = site.read
+        if compressible and "gzip" in self._accepted_encodings(request) \
+                and site.members[name].compress_type == zipfile.ZIP_DEFLATED:
+            encoding, loader = "gzip", site.read_gzip
+        headers = self._cache_headers(name, site.etag(name), encoding, compressible)
+        if self._not_modified(request, headers["ETag"]):
+            headers.pop("Content-Encoding", None)
+            return web.Response(status=304, headers=headers)
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(None, loader, name)
+        except (OSError, zipfile.BadZipFile, zlib.error):
+            raise web.HTTPNotFound()
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        return web.Response(body=data, content_type=content_type, headers=headers)
 
-    def _get_valid_dir(self, token: str) -> Optional[str]:
+    def _get_valid_dir(self, token: str) -> str:
+        """Resolve a token for serving; raises 410 for expired/removed and 404 for unknown tokens."""
+        self._ensure_loaded()
         path = self._map.get(token)
         if not path:
-            return None
+            if token in self._gone:
+                raise web.HTTPGone()
+            raise web.HTTPNotFound()
+        meta = self._meta.get(token)
+        if meta:
+            now = time.time()
+            if meta["expires"] and meta["expires"] <= now:
+                self._evict(token, "ttl")
+                raise web.HTTPGone()
+            meta["last_access"] = now
+            self._dirty = True
         return path
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Optional
+
+
+class HtmlResultCache:
+    """Content-addressed cache of packaged TeX→HTML results.
+
+    - Keys are SHA-256 digests of everything that shapes the output (document,
+      format, make4ht arguments, theme settings).
+    - Each entry is the packaged archive (`<key>.zip`, `.odt` or `.epub`) plus a
+      `<key>.json` metadata file.
+    - Total size is bounded by `max_bytes`; least recently used entries are evicted
+      first (a hit touches the metadata file's mtime).
+    - Entries are never rewritten in place, so callers may hard-link them. Archives are
+      never touched either, so a link's mtime stays the caller's own.
+    """
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None):
+        self._root = root or os.environ.get("LATEXBOT_HTML_CACHE_DIR") or os.path.join("build", "tex2html_cache")
+        if max_bytes is None:
+            try:
+                max_bytes = int(max(0.0, float(os.environ.get("LATEXBOT_HTML_CACHE_MB", "256"))) * 1024 * 1024)
+            except ValueError:
+                max_bytes = 256 * 1024 * 1024
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_bytes > 0
+
+    @staticmethod
+    def key(*parts) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            data = part if isinstance(part, bytes) else json.dumps(part, sort_keys=True).encode("utf-8")
+            # Length prefix keeps ("ab", "c") and ("a", "bc") apart
+            digest.update(len(data).to_bytes(8, "big"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self._root, key + ".json")
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the path of the cached archive for `key`, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            try:
+                with open(self._meta_path(key), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                path = os.path.join(self._root, meta["file"])
+                os.stat(path)
+                os.utime(self._meta_path(key))
+            except (OSError, ValueError, KeyError):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return path
+
+    def put(self, key: str, stream, ext: str = "zip", **meta) -> Optional[str]:
+        """Store the contents of `stream` under `key` and return the cached path.
+
+        The stream is read from its current position and rewound afterwards.
+        """
+        if not self.enabled:
+            return None
+        os.makedirs(self._root, exist_ok=True)
+        name = f"{key}.{ext}"
+        path = os.path.join(self._root, name)
+        start = stream.tell()
+        fd, tmp = tempfile.mkstemp(dir=self._root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(stream, f, 1024 * 1024)
+            size = os.path.getsize(tmp)
+            meta.update({"file": name, "size": size, "created": time.time()})
+            with self._lock:
+                os.replace(tmp, path)
+                with open(self._meta_path(key), "w", encoding="utf-8") as f:
+                    json.dump(meta, f)
+                self._evict()
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return None
+        finally:
+            stream.seek(start)
+        return path if os.path.exists(path) else None
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self._root):
+            if not name.endswith(".json"):
+                continue
+            meta_path = os.path.join(self._root, name)
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                path = os.path.join(self._root, meta["file"])
+                size = os.path.getsize(path)
+                used = os.path.getmtime(meta_path)
+            except (OSError, ValueError, KeyError):
+                # Half-written or orphaned entry
+                self._remove(meta_path, None)
+                continue
+            entries.append((used, meta_path, path, size))
+            total += size
+        entries.sort()
+        while entries and total > self._max_bytes:
+            _, meta_path, path, size = entries.pop(0)
+            self._remove(meta_path, path)
+            total -= size
+
+    @staticmethod
+    def _remove(meta_path: str, path: Optional[str]):
+        for p in (meta_path, path):
+            if p:
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def materialize(path: str, dest: str):
+        """Place a cached archive at `dest`, hard-linking when the filesystem allows it."""
+        try:
+            if os.path.exists(dest):
+                os.remove(dest)
+            os.link(path, dest)
+        except OSError:
+            shutil.copyfile(path, dest)
+
+    def stats(self) -> dict:
+        return {"html_hits": self.hits, "html_misses": self.misses}
@@ -11,6 +11,7 @@ import html
 from tqdm.notebook import tqdm
 
 from src.LatexConverter import LatexConverter
+from src.RenderClient import RenderClient
 from src.PreambleManager import PreambleManager
 from src.ResourceManager import ResourceManager
 from src.InlineQueryResponseDispatcher import InlineQueryResponseDispatcher
@@ -30,7 +31,7 @@ class InLaTeXbot():
         self._userOptionsManager = UserOptionsManager()
         self._usersManager = UsersManager()
         self._preambleManager = PreambleManager(self._resourceManager)
-        self._latexConverter = LatexConverter(self._preambleManager, self._userOptionsManager)
+        self._latexConverter = RenderClient.from_env() or LatexConverter(self._preambleManager, self._userOptionsManager)
         self._inlineQueryResponseDispatcher = InlineQueryResponseDispatcher(updater.bot, self._latexConverter, self._resourceManager, self._userOptionsManager, devnullChatId)
         self._messageQueryResponseDispatcher = MessageQueryResponseDispatcher(updater.bot, self._latexConverter, self._resourceManager)
         self._devnullChatId = devnullChatId
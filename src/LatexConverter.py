@@ -2,22 +2,95 @@ from subprocess import check_output, CalledProcessError, STDOUT, TimeoutExpired
 
 from src.PreambleManager import PreambleManager
 from src.LoggingServer import LoggingServer
+from src.ZipPackager import ZipPackager
+from src.HtmlResultCache import HtmlResultCache
+from src.CompiledPdfCache import CompiledPdfCache
+from src.FigureStore import FigureStore
+from src.ThemeInjector import ThemeInjector
+from src.RenderBatcher import RenderBatcher
+from src.SingleFlight import SingleFlight
 import io
 import re
 import shutil
 import os
 import glob
+import hashlib
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
 class LatexConverter():
 
     logger = LoggingServer.getInstance()
+    _requestLogLock = threading.Lock()
+    _htmlWorkLocks = {}
+    _htmlWorkLocksGuard = threading.Lock()
+    RETAINED_PDF_DIR = os.path.join("build", "retained_pdfs")
+    # Counters a batched expression must see at zero, as in its own document
+    BATCH_RESET_COUNTERS = ("equation", "figure", "table", "footnote", "section", "subsection", "subsubsection")
+    # TeX/TeX4ht auxiliaries a draft make4ht pass reads from the previous run
+    HTML_AUX_EXTS = (".aux", ".toc", ".lof", ".lot", ".out", ".bbl", ".4ct", ".4tc", ".xref", ".idv", ".lg", ".tmp", ".dvi", ".log")
     
     def __init__(self, preambleManager, userOptionsManager):
          self._preambleManager = preambleManager
          self._userOptionsManager = userOptionsManager
+         self._htmlCache = HtmlResultCache()
+         self._figureStore = FigureStore()
+         self._pdfCache = CompiledPdfCache()
+         # LATEXBOT_MICROBATCH=1 compiles concurrent renders that share a preamble and DPI together
+         microbatch = os.environ.get("LATEXBOT_MICROBATCH", "").lower() in ("1", "true", "yes", "on")
+         self._batcher = RenderBatcher(self._render_batch) if microbatch else None
+         # Compiled PDFs kept for keepPdf renders: sessionId -> is_full_document
+         self._retainedPdfs = {}
+         self._retainedPdfsLock = threading.Lock()
+         # Identical renders in flight at the same time share one compile
+         self._inFlight = SingleFlight()
+
+    def cacheStats(self):
+        """Hit/miss counters of the converter's result caches."""
+        return {**self._htmlCache.stats(), **self._figureStore.stats(), **self._pdfCache.stats(), "inflight_shared": self._inFlight.shared}
+
+    def _record_request(self, kind: str, userId, expression: str, **extra):
+        """Append a compact JSON line describing a render request.
+
+        Enabled by LATEXBOT_REQUEST_LOG=path/to/requests.jsonl; the file is the
+        input format of src/TraceReplay.py. Failures never affect rendering.
+        """
+        path = os.environ.get("LATEXBOT_REQUEST_LOG")
+        if not path:
+            return
+        record = {"t": round(time.time(), 3), "kind": kind, "user": userId, "expr": expression}
+        record.update(extra)
+        try:
+            log_dir = os.path.dirname(path)
+            if log_dir:
+                os.makedirs(log_dir, exist_ok=True)
+            line = json.dumps(record, ensure_ascii=False) + "\n"
+            with self._requestLogLock:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        except Exception:
+            pass
 
     def extractBoundingBox(self, dpi, pathToPdf):
+        return self._padded_bbox(dpi, self._page_bounds(pathToPdf)[0])
+
+    def extractPageBoundingBoxes(self, dpi, pathToPdf):
+        """Bounding boxes of every page; a page without content yields its ValueError instead."""
+        return self._padded_page_bboxes(dpi, self._page_bounds(pathToPdf))
+
+    def _padded_page_bboxes(self, dpi, pages):
+        boxes = []
+        for bounds in pages:
+            try:
+                boxes.append(self._padded_bbox(dpi, bounds))
+            except ValueError as err:
+                boxes.append(err)
+        return boxes
+
+    def _page_bounds(self, pathToPdf):
         try:
             gs = self._get_gs_executable()
             bbox = check_output([gs, "-q", "-dBATCH", "-dNOPAUSE", "-sDEVICE=bbox", pathToPdf],
@@ -27,10 +100,16 @@ class LatexConverter():
         except FileNotFoundError:
             raise ValueError("Ghostscript not found. Please install Ghostscript and ensure 'gs', 'gswin64c' or 'gswin32c' is on PATH.")
         try:
-            bounds = [int(_) for _ in bbox[bbox.index(":")+2:bbox.index("\n")].split(" ")]
+            # One "%%BoundingBox: llx lly urx ury" line per page
+            pages = [[int(_) for _ in line[line.index(":")+2:].split(" ")]
+                     for line in bbox.splitlines() if line.startswith("%%BoundingBox:")]
         except ValueError:
             raise ValueError("Could not parse bounding box! Empty expression?")
+        if not pages:
+            raise ValueError("Could not parse bounding box! Empty expression?")
+        return pages
 
+    def _padded_bbox(self, dpi, bounds):
         if bounds[0] == bounds[2] or bounds[1] == bounds[3]:
             self.logger.warn("Expression had zero width/height bbox!")
             raise ValueError("Empty expression!")
@@ -87,10 +166,11 @@ class LatexConverter():
             msg = "LaTeX engine timed out while compiling PDF. Try simplifying the input or increase LATEXBOT_PDFLATEX_TIMEOUT."
             raise ValueError(msg)
     
-    def cropPdf(self, sessionId): # TODO: this is intersecting with the png part
+    def cropPdf(self, sessionId, page=None): # TODO: this is intersecting with the png part
+        pages = [f"-dFirstPage={page}", f"-dLastPage={page}"] if page else []
         try:
             gs = self._get_gs_executable()
-            bbox = check_output([gs, "-q", "-dBATCH", "-dNOPAUSE", "-sDEVICE=bbox", f"build/expression_file_{sessionId}.pdf"], 
+            bbox = check_output([gs, "-q", "-dBATCH", "-dNOPAUSE", "-sDEVICE=bbox", *pages, f"build/expression_file_{sessionId}.pdf"],
                                 stderr=STDOUT).decode("ascii")
         except FileNotFoundError:
             raise ValueError("Ghostscript not found. Please install Ghostscript and ensure it is on PATH.")
@@ -111,101 +191,367 @@ class LatexConverter():
         in_pdf = f"build/expression_file_{sessionId}.pdf"
         # Set exact page size and translate content so the expression sits at origin
         try:
-            check_output([gs, "-o", out_pdf, "-sDEVICE=pdfwrite",
+            check_output([gs, "-o", out_pdf, "-sDEVICE=pdfwrite", *pages,
                           f"-dDEVICEWIDTHPOINTS={width_pts}", f"-dDEVICEHEIGHTPOINTS={height_pts}", "-dFIXEDMEDIA",
                           "-c", f"<</PageOffset [{offset_x} {offset_y}]>> setpagedevice",
                           "-f", in_pdf], stderr=STDOUT)
         except FileNotFoundError:
             raise ValueError("Ghostscript not found. Please install Ghostscript and ensure it is on PATH.")
             
-    def convertPdfToPng(self, dpi, sessionId, bbox):
+    def convertPdfToPng(self, dpi, sessionId, bbox, page=1, imageId=None):
         gs = self._get_gs_executable()
-        out_png = f"build/expression_{sessionId}.png"
+        out_png = f"build/expression_{imageId or sessionId}.png"
         in_pdf = f"build/expression_file_{sessionId}.pdf"
         width, height, tx, ty = bbox
         # Default to white background to avoid black/transparent appearance in some viewers.
         transparent = os.environ.get("LATEXBOT_TRANSPARENT", "").lower() in ("1", "true", "yes", "on")
         device = "pngalpha" if transparent else "png16m"
-        args = [gs, "-o", out_png, f"-r{dpi}", f"-g{int(width)}x{int(height)}", "-dLastPage=1",
+        args = [gs, "-o", out_png, f"-r{dpi}", f"-g{int(width)}x{int(height)}", f"-dFirstPage={page}", f"-dLastPage={page}",
                 "-sDEVICE=" + device,
                 "-dTextAlphaBits=4", "-dGraphicsAlphaBits=4",
                 "-c", f"<</Install {{{int(tx)} {int(ty)} translate}}>> setpagedevice",
                 "-f", in_pdf]
         if not transparent:
             # White background for non-alpha device
-            args.insert(6, "-dBackgroundColor=16#FFFFFF")
+            args.insert(7, "-dBackgroundColor=16#FFFFFF")
         try:
             check_output(args, stderr=STDOUT)
         except FileNotFoundError:
             raise ValueError("Ghostscript not found. Please install Ghostscript and ensure it is on PATH.")
 
-    def convertExpression(self, expression, userId, sessionId, returnPdf = False):
+    def _get_preamble(self, userId):
+        try:
+            preamble = self._preambleManager.getPreambleFromDatabase(userId)
+            self.logger.debug("Preamble for userId %d found", userId)
+        except KeyError:
+            self.logger.debug("Preamble for userId %d not found, using default preamble", userId)
+            preamble = self._preambleManager.getDefaultPreamble()
+        return preamble
+
+    def _build_file_string(self, expression, userId):
+        if r"\documentclass" in expression:
+            return expression
+        preamble = self._get_preamble(userId)
+        # Ensure UTF-8 support if user preamble lacks it
+        needs_utf8 = ("inputenc" not in preamble) and ("fontspec" not in preamble)
+        if needs_utf8 and ("usepackage[T1]{fontenc}" not in preamble):
+            preamble = preamble + "\n\\usepackage[utf8]{inputenc}"
+        return preamble+"\n\\begin{document}\n"+expression+"\n\\end{document}"
+
+    def _compile(self, fileString, sessionId):
+        os.makedirs("build", exist_ok=True)
+        # Always write LaTeX in UTF-8 to avoid inputenc errors with smart quotes, emojis, etc.
+        with open("build/expression_file_%s.tex"%sessionId, "w+", encoding="utf-8") as f:
+            f.write(fileString)
+        try:
+            self.pdflatex("build/expression_file_%s.tex"%sessionId)
+        except FileNotFoundError:
+            raise ValueError("pdflatex not found. Please install a LaTeX distribution (TeX Live or MiKTeX) and ensure 'pdflatex' is on PATH.")
 
+    def _compile_pages(self, fileString, sessionId):
+        """Place the compiled PDF of fileString at build/expression_file_<sessionId>.pdf; returns its page bounds.
 
+        A PDF already compiled from the same source comes from the PDF cache, so
+        re-renders at another DPI or background, or with the PDF attached, skip TeX.
+        """
+        pdf = "build/expression_file_%s.pdf"%sessionId
+        key = self._pdfCache.key(fileString, os.environ.get("LATEXBOT_TEX_ENGINE", "pdflatex"))
+        cached = self._pdfCache.get_pdf(key)
+        if cached:
+            path, pages = cached
+            try:
+                os.makedirs("build", exist_ok=True)
+                self._pdfCache.materialize(path, pdf)
+                return pages
+            except OSError:
+                # Evicted in the meantime
+                pass
+        self._compile(fileString, sessionId)
+        pages = self._page_bounds(pdf)
+        self._pdfCache.put_pdf(key, pdf, pages)
+        return pages
+
+    def _render_page(self, dpi, sessionId, bbox, returnPdf, is_full_document, page=1, keepPdf=False, imageId=None):
+        bbox = self.correctBoundingBoxAspectRaito(dpi, bbox)
+        self.convertPdfToPng(dpi, sessionId, bbox, page, imageId)
+
+        with open("build/expression_%s.png"%(imageId or sessionId), "rb") as f:
+            imageBinaryStream = io.BytesIO(f.read())
+
+        if returnPdf:
+            if is_full_document:
+                # Preserve full document layout and margins
+                with open("build/expression_file_%s.pdf"%sessionId, "rb") as f:
+                    pdfBinaryStream = io.BytesIO(f.read())
+            else:
+                self.cropPdf(sessionId, page)
+                with open("build/expression_file_cropped_%s.pdf"%sessionId, "rb") as f:
+                    pdfBinaryStream = io.BytesIO(f.read())
+            return imageBinaryStream, pdfBinaryStream
+        elif keepPdf:
+            return imageBinaryStream, self._retain_pdf(sessionId, page, is_full_document)
+        else:
+            return imageBinaryStream
+
+    def _retain_pdf(self, sessionId, page, is_full_document):
+        """Keep the compiled PDF past cleanup; returns the handle retainedPdf() takes."""
+        with self._retainedPdfsLock:
+            self._expire_retained_pdfs()
+            if sessionId not in self._retainedPdfs:
+                os.makedirs(self.RETAINED_PDF_DIR, exist_ok=True)
+                # A copy, not a link: the build PDF may be a link to a CompiledPdfCache entry, and
+                # the retention clock (this file's mtime) must not move that entry's LRU time
+                shutil.copyfile("build/expression_file_%s.pdf"%sessionId,
+                                os.path.join(self.RETAINED_PDF_DIR, f"{sessionId}.pdf"))
+            self._retainedPdfs[sessionId] = is_full_document
+        return sessionId, page
+
+    def _expire_retained_pdfs(self):
+        # Files carry their age, so PDFs left behind by an earlier run expire too
+        try:
+            ttl = float(os.environ.get("LATEXBOT_PDF_RETAIN_SECONDS", "900"))
+        except ValueError:
+            ttl = 900.0
+        now = time.time()
+        try:
+            names = os.listdir(self.RETAINED_PDF_DIR)
+        except OSError:
+            names = []
+        for name in names:
+            path = os.path.join(self.RETAINED_PDF_DIR, name)
+            try:
+                if os.path.getmtime(path) + ttl <= now:
+                    os.remove(path)
+            except OSError:
+                pass
+        for sessionId in list(self._retainedPdfs):
+            if not os.path.exists(os.path.join(self.RETAINED_PDF_DIR, f"{sessionId}.pdf")):
+                del self._retainedPdfs[sessionId]
 
+    def retainedPdf(self, handle):
+        """The PDF of a keepPdf render, cropped as returnPdf would have returned it.
 
-        if r"\documentclass" in expression:
-            fileString = expression
+        Raises ValueError once the PDF has expired (LATEXBOT_PDF_RETAIN_SECONDS, default 900).
+        """
+        sessionId, page = handle
+        path = os.path.join(self.RETAINED_PDF_DIR, f"{sessionId}.pdf")
+        with self._retainedPdfsLock:
+            self._expire_retained_pdfs()
+            is_full_document = self._retainedPdfs.get(sessionId)
+        if is_full_document is None or not os.path.exists(path):
+            raise ValueError("This PDF has expired. Render the expression again to get it.")
+        if is_full_document:
+            # Full documents keep their layout and margins
+            with open(path, "rb") as f:
+                return io.BytesIO(f.read())
+        work = f"{sessionId}_pdf{page}"
+        os.makedirs("build", exist_ok=True)
+        shutil.copyfile(path, "build/expression_file_%s.pdf"%work)
+        try:
+            self.cropPdf(work, page)
+            with open("build/expression_file_cropped_%s.pdf"%work, "rb") as f:
+                return io.BytesIO(f.read())
+        finally:
+            self._cleanup(work)
+
+    def _cleanup(self, sessionId):
+        # Cross-platform cleanup
+        try:
+            for f in glob.glob(os.path.join("build", f"*_{sessionId}.*")):
+                try:
+                    os.remove(f)
+                except FileNotFoundError:
+                    pass
+        except Exception:
+            pass
+
+    def convertExpression(self, expression, userId, sessionId, returnPdf = False, keepPdf = False):
+        """Render an expression to PNG, optionally with its cropped PDF.
+
+        With keepPdf the PDF is not produced yet: the result is (image, handle) and the
+        compiled PDF is kept so retainedPdf(handle) can crop it if it is ever asked for.
+        """
+        self._record_request("expr", userId, expression, pdf=bool(returnPdf))
+        preamble = self._get_preamble(userId)
+        dpi = self._userOptionsManager.getDpiOption(userId)
+        if self._batcher and r"\documentclass" not in expression:
+            # Per user: \gdef, \global and friends escape any grouping, so users never share a compile
+            render = lambda: self._batcher.submit((userId, preamble, dpi), (expression, userId, returnPdf, keepPdf), sessionId)
         else:
+            render = lambda: self._convert_single(expression, userId, sessionId, returnPdf, keepPdf)
+        # Everything that shapes the output, so only truly identical requests are merged
+        key = (expression, preamble, dpi, bool(returnPdf), bool(keepPdf), os.environ.get("LATEXBOT_TEX_ENGINE", ""),
+               os.environ.get("LATEXBOT_TRANSPARENT", ""), os.environ.get("LATEXBOT_PDF_MARGIN_PT", ""))
+        return self._inFlight.do(key, render, self._clone_result)
+
+    @staticmethod
+    def _clone_result(result):
+        # Each caller gets its own streams; PDF handles are plain tuples and can be shared
+        if isinstance(result, io.BytesIO):
+            return io.BytesIO(result.getvalue())
+        if isinstance(result, tuple):
+            return tuple(LatexConverter._clone_result(part) for part in result)
+        return result
+
+    def convertExpressionProgressive(self, expression, userId, sessionId, onPreview, previewDpi=None, returnPdf=False, keepPdf=False):
+        """Like convertExpression, but first hands a quick low-DPI PNG stream to `onPreview`.
+
+        Both images are rasterised from the same compiled PDF, so TeX runs once. The
+        preview is skipped when the user's DPI is not above `previewDpi`
+        (LATEXBOT_PREVIEW_DPI, default 150).
+        """
+        self._record_request("expr", userId, expression, pdf=bool(returnPdf))
+        if previewDpi is None:
             try:
-                preamble = self._preambleManager.getPreambleFromDatabase(userId)
-                self.logger.debug("Preamble for userId %d found", userId)
-            except KeyError:
-                self.logger.debug("Preamble for userId %d not found, using default preamble", userId)
-                preamble = self._preambleManager.getDefaultPreamble()
-            finally:
-                # Ensure UTF-8 support if user preamble lacks it
-                needs_utf8 = ("inputenc" not in preamble) and ("fontspec" not in preamble)
-                if needs_utf8 and ("usepackage[T1]{fontenc}" not in preamble):
-                    preamble = preamble + "\n\\usepackage[utf8]{inputenc}"
-                fileString = preamble+"\n\\begin{document}\n"+expression+"\n\\end{document}"
+                previewDpi = int(os.environ.get("LATEXBOT_PREVIEW_DPI", "150"))
+            except ValueError:
+                previewDpi = 150
+        fileString = self._build_file_string(expression, userId)
+        dpi = self._userOptionsManager.getDpiOption(userId)
+        is_full_document = r"\documentclass" in expression
 
-        os.makedirs("build", exist_ok=True)
-        # Always write LaTeX in UTF-8 to avoid inputenc errors with smart quotes, emojis, etc.
-        with open("build/expression_file_%s.tex"%sessionId, "w+", encoding="utf-8") as f:
-            f.write(fileString)
-        
+        try:
+            bounds = self._compile_pages(fileString, sessionId)[0]
+            if previewDpi < dpi:
+                preview = self._render_page(previewDpi, sessionId, self._padded_bbox(previewDpi, bounds), False, is_full_document)
+                try:
+                    onPreview(preview)
+                except Exception as err:
+                    self.logger.warn("Preview callback failed: %s", err)
+            result = self._render_page(dpi, sessionId, self._padded_bbox(dpi, bounds), returnPdf, is_full_document, keepPdf=keepPdf)
+            self.logger.debug("Generated progressive image for %s", expression)
+            return result
+        finally:
+            self._cleanup(sessionId)
+
+    def convertPages(self, expression, userId, sessionId, firstPage=1, lastPage=None, keepPdf=False):
+        """Render pages firstPage..lastPage (default: to the end) of an expression, one PNG per page.
+
+        Returns a list of (page, result) pairs, at most LATEXBOT_MAX_PAGES (default 10) of
+        them; result is what convertExpression would return for that page, or the
+        ValueError of an empty page. TeX runs once, then every page is rasterised by its
+        own Ghostscript process, LATEXBOT_PAGE_WORKERS (default: CPU count) at a time.
+        """
+        self._record_request("expr", userId, expression, pdf=False, pages=[firstPage, lastPage])
+        if firstPage < 1 or (lastPage is not None and lastPage < firstPage):
+            raise ValueError("Invalid page range.")
+        try:
+            maxPages = int(os.environ.get("LATEXBOT_MAX_PAGES", "10"))
+        except ValueError:
+            maxPages = 10
+        try:
+            workers = int(os.environ.get("LATEXBOT_PAGE_WORKERS", "0")) or os.cpu_count() or 4
+        except ValueError:
+            workers = os.cpu_count() or 4
+        fileString = self._build_file_string(expression, userId)
         dpi = self._userOptionsManager.getDpiOption(userId)
-        
+        is_full_document = r"\documentclass" in expression
+
+        def render(page):
+            try:
+                bbox = self._padded_bbox(dpi, list(bounds[page - 1]))
+            except ValueError as err:
+                return err
+            return self._render_page(dpi, sessionId, bbox, False, is_full_document, page, keepPdf, imageId=f"p{page}_{sessionId}")
+
         try:
+            bounds = self._compile_pages(fileString, sessionId)
+            if firstPage > len(bounds):
+                raise ValueError("The document has only %d page(s)." % len(bounds))
+            last = len(bounds) if lastPage is None else min(lastPage, len(bounds))
+            pages = list(range(firstPage, last + 1))[:max(1, maxPages)]
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pages)))) as pool:
+                results = list(pool.map(render, pages))
+            self.logger.debug("Generated %d page images", len(pages))
+            return list(zip(pages, results))
+        finally:
+            self._cleanup(sessionId)
+
+    def _render_batch(self, items, sessionId):
+        """Render (expression, userId, returnPdf, keepPdf) items that share one preamble and DPI."""
+        if len(items) >= 2:
             try:
-                self.pdflatex("build/expression_file_%s.tex"%sessionId)
-            except FileNotFoundError:
-                raise ValueError("pdflatex not found. Please install a LaTeX distribution (TeX Live or MiKTeX) and ensure 'pdflatex' is on PATH.")
-                
-            bbox = self.extractBoundingBox(dpi, "build/expression_file_%s.pdf"%sessionId)
-            bbox = self.correctBoundingBoxAspectRaito(dpi, bbox)
-            self.convertPdfToPng(dpi, sessionId, bbox)
-            
+                return self._convert_pages([item[0] for item in items], items[0][1], sessionId,
+                                           [item[2] for item in items], [item[3] for item in items])
+            except ValueError as err:
+                self.logger.debug("Batched render failed, rendering one by one: %s", err)
+        results = []
+        for i, (expression, userId, returnPdf, keepPdf) in enumerate(items):
+            try:
+                results.append(self._convert_single(expression, userId, f"{sessionId}_{i}" if len(items) > 1 else sessionId, returnPdf, keepPdf))
+            except ValueError as err:
+                results.append(err)
+        return results
+
+    def _convert_single(self, expression, userId, sessionId, returnPdf, keepPdf=False):
+        fileString = self._build_file_string(expression, userId)
+        dpi = self._userOptionsManager.getDpiOption(userId)
+
+        try:
+            bbox = self._padded_bbox(dpi, self._compile_pages(fileString, sessionId)[0])
+            result = self._render_page(dpi, sessionId, bbox, returnPdf, r"\documentclass" in expression, keepPdf=keepPdf)
             self.logger.debug("Generated image for %s", expression)
-            
-            with open("build/expression_%s.png"%sessionId, "rb") as f:
-                imageBinaryStream = io.BytesIO(f.read())
-
-            if returnPdf:
-                is_full_document = (r"\documentclass" in expression)
-                if is_full_document:
-                    # Preserve full document layout and margins
-                    with open("build/expression_file_%s.pdf"%sessionId, "rb") as f:
-                        pdfBinaryStream = io.BytesIO(f.read())
-                else:
-                    self.cropPdf(sessionId)
-                    with open("build/expression_file_cropped_%s.pdf"%sessionId, "rb") as f:
-                        pdfBinaryStream = io.BytesIO(f.read())
-                return imageBinaryStream, pdfBinaryStream
-            else:
-                return imageBinaryStream
-                
+            return result
         finally:
-            # Cross-platform cleanup
+            self._cleanup(sessionId)
+
+    def convertExpressions(self, expressions, userId, sessionId, returnPdf = False, keepPdf = False):
+        """Render several expressions with a single LaTeX run, one page per expression.
+
+        Returns a list aligned with `expressions`: each item is what convertExpression
+        would return for it, or the ValueError raised while rendering it. If the batched
+        compile fails (one bad expression breaks the whole document), every expression
+        is rendered on its own so the others still succeed.
+        """
+        for expression in expressions:
+            self._record_request("expr", userId, expression, pdf=bool(returnPdf))
+        results = [None] * len(expressions)
+        # Full documents carry their own preamble and can't share a compile
+        batchable = [i for i, e in enumerate(expressions) if r"\documentclass" not in e]
+        if len(batchable) >= 2:
             try:
-                for f in glob.glob(os.path.join("build", f"*_{sessionId}.*")):
-                    try:
-                        os.remove(f)
-                    except FileNotFoundError:
-                        pass
-            except Exception:
-                pass
+                pages = self._convert_pages([expressions[i] for i in batchable], userId, sessionId, returnPdf, keepPdf)
+                for i, result in zip(batchable, pages):
+                    results[i] = result
+            except ValueError as err:
+                self.logger.debug("Batched render failed, rendering one by one: %s", err)
+        for i, expression in enumerate(expressions):
+            if results[i] is None:
+                try:
+                    results[i] = self._convert_single(expression, userId, f"{sessionId}_{i}", returnPdf, keepPdf)
+                except ValueError as err:
+                    results[i] = err
+        return results
+
+    def _convert_pages(self, expressions, userId, sessionId, returnPdf, keepPdf=False):
+        # returnPdf and keepPdf may be given per expression
+        wantPdf = returnPdf if isinstance(returnPdf, list) else [returnPdf] * len(expressions)
+        keep = keepPdf if isinstance(keepPdf, list) else [keepPdf] * len(expressions)
+        fileString = self._build_file_string("\n\\clearpage\n".join(self._batch_slot(e) for e in expressions), userId)
+        dpi = self._userOptionsManager.getDpiOption(userId)
+        try:
+            boxes = self._padded_page_bboxes(dpi, self._compile_pages(fileString, sessionId))
+            if len(boxes) != len(expressions):
+                # Every slot fills at least one page, so page i is slot i exactly when the counts match;
+                # otherwise an expression spilled over a page break or ended the document early
+                raise ValueError("Batched render produced %d pages for %d expressions" % (len(boxes), len(expressions)))
+            results = []
+            for page, (bbox, pdf, keepPage) in enumerate(zip(boxes, wantPdf, keep), start=1):
+                results.append(bbox if isinstance(bbox, ValueError) else self._render_page(dpi, sessionId, bbox, pdf, False, page, keepPage))
+            self.logger.debug("Generated %d images in one batch", len(expressions))
+            return results
+        finally:
+            self._cleanup(sessionId)
+
+    def _batch_slot(self, expression):
+        """One expression of a batched document, isolated from the expressions around it.
+
+        Local definitions (\\def, \\renewcommand, \\everymath, ...) end with the group and the
+        standard counters restart, so the page looks as if the expression was rendered alone.
+        The invisible \\null makes even an empty slot ship a page.
+        """
+        reset = "".join("\\ifcsname c@%s\\endcsname\\setcounter{%s}{0}\\fi" % (c, c) for c in self.BATCH_RESET_COUNTERS)
+        return "\\begingroup" + reset + "\\null\n" + expression + "\n\\par\\endgroup"
 
     def _get_gs_executable(self):
         # Try common Ghostscript executables across platforms
@@ -236,8 +582,23 @@ class LatexConverter():
             return path
         return None
 
-    def _run_tex_to_html(self, tex_path: str, workdir: str, timeout: int = 30, html_format: str | None = None, make4ht_args: list[str] | None = None):
+    def resolveHtmlFormat(self, html_format: str | None = None) -> str:
+        """Return the effective TeX4ht output format for a request."""
+        # Determine desired output format (for make4ht). Default from env if not provided.
+        if not html_format:
+            html_format = os.environ.get("LATEXBOT_HTML_FORMAT", "html5").strip()
+        # Basic allowlist of common formats
+        allowed_formats = {"html5", "html5+mathjax", "xhtml", "odt", "epub"}
+        if html_format not in allowed_formats:
+            # Fall back to html5 if unsupported, but keep informative message
+            self.logger.warn("Unsupported HTML format '%s' requested; falling back to 'html5'", html_format)
+            html_format = "html5"
+        return html_format
+
+    def _run_tex_to_html(self, tex_path: str, workdir: str, timeout: int = 30, html_format: str | None = None, make4ht_args: list[str] | None = None,
+                         draft: bool = False):
         """Run TeX→HTML using htlatex (preferred) or make4ht in the given workdir.
+        With `draft`, make4ht runs a single LaTeX pass and reuses the auxiliary files already in workdir.
         Raises ValueError with a helpful message on failure.
         """
         # Allow overriding timeout via environment for heavy docs (e.g., TikZ)
@@ -251,15 +612,7 @@ class LatexConverter():
         if not exe:
             raise ValueError("htlatex/make4ht not found. Please install TeX Live and ensure 'htlatex' (or 'make4ht') is on PATH.")
 
-        # Determine desired output format (for make4ht). Default from env if not provided.
-        if not html_format:
-            html_format = os.environ.get("LATEXBOT_HTML_FORMAT", "html5").strip()
-        # Basic allowlist of common formats
-        allowed_formats = {"html5", "html5+mathjax", "xhtml", "odt", "epub"}
-        if html_format not in allowed_formats:
-            # Fall back to html5 if unsupported, but keep informative message
-            self.logger.warn("Unsupported HTML format '%s' requested; falling back to 'html5'", html_format)
-            html_format = "html5"
+        html_format = self.resolveHtmlFormat(html_format)
 
         exe_name = os.path.basename(exe).lower() if exe else ""
         try:
@@ -284,6 +637,8 @@ class LatexConverter():
                         else:
                             # treat as extension token (e.g., 'mathjax')
                             user_exts.append(str(a))
+                if draft and "-m" not in opt_args and "--mode" not in opt_args:
+                    opt_args = ["-m", "draft"] + opt_args
                 # Add options before filename
                 if opt_args:
                     cmd.extend(opt_args)
@@ -342,123 +697,154 @@ class LatexConverter():
         except TimeoutExpired:
             raise ValueError("htlatex/make4ht timed out while converting to HTML.")
 
-    def _maybe_inject_theme(self, html_path: str, base_fmt: str | None = None):
-        """Optionally inject a dark/light theme CSS into the generated HTML.
-
-        Controlled by env:
-        - LATEXBOT_HTML_THEME=dark|light|system (default: system → no forced override)
-        - LATEXBOT_HTML_THEME_CSS=path/to/custom.css (optional, overrides built-in CSS)
-        """
-        try:
-            theme = os.environ.get("LATEXBOT_HTML_THEME", "system").strip().lower()
-        except Exception:
-            theme = "system"
-        if theme not in ("dark", "light"):
-            return  # no override requested
-        # Only inject for HTML outputs
-        if not html_path.lower().endswith(".html"):
-            return
-
-        custom_css = None
-        css_path = os.environ.get("LATEXBOT_HTML_THEME_CSS")
-        if css_path and os.path.isfile(css_path):
-            try:
-                with open(css_path, "r", encoding="utf-8", errors="ignore") as f:
-                    custom_css = f.read()
-            except Exception:
-                custom_css = None
-
-        # Built-in minimal dark/light overrides
-        if not custom_css:
-            if theme == "dark":
-                custom_css = (
-                    ":root{color-scheme:dark;}\n"
-                    "body{background:#0b0c10 !important;color:#e5e7eb !important;}\n"
-                    "html{background:#0b0c10 !important;}\n"
-                    "a{color:#93c5fd !important;}\n"
-                    "pre,code{background:#111827 !important;color:#e5e7eb !important;}\n"
-                    "table{border-color:#374151 !important;}\n"
-                    "img{background:transparent !important;}\n"
-                )
-            else:  # light
-                custom_css = (
-                    ":root{color-scheme:light;}\n"
-                    "body{background:#ffffff !important;color:#111827 !important;}\n"
-                    "html{background:#ffffff !important;}\n"
-                    "a{color:#1d4ed8 !important;}\n"
-                    "pre,code{background:#f3f4f6 !important;color:#111827 !important;}\n"
-                    "table{border-color:#e5e7eb !important;}\n"
-                    "img{background:transparent !important;}\n"
-                )
-
-        style_tag = (
-            "<!-- injected by InLaTeX bot: theme override -->\n"
-            "<style id=\"inlatexbot-theme\">\n" + custom_css + "\n</style>\n"
-        )
-
-        try:
-            with open(html_path, "r", encoding="utf-8", errors="ignore") as f:
-                html = f.read()
-            # Add a body class to increase selector specificity, then insert before </head>
-            lower = html.lower()
-            idx = lower.rfind("</head>")
-            # Ensure body has an override class for more specificity
-            body_class = "inlatexbot-dark" if theme == "dark" else "inlatexbot-light"
-            if "<body" in lower:
-                # Naive injection of class attribute (safe for TeX4ht simple bodies)
-                def _inject_class(tag: str, klass: str, s: str) -> str:
-                    i = s.lower().find("<body")
-                    if i == -1:
-                        return s
-                    j = s.find('>', i)
-                    if j == -1:
-                        return s
-                    head = s[i:j]
-                    if "class=" in head.lower():
-                        return s  # don’t overwrite existing classes to avoid breakage
-                    new_head = head + f' class="{klass}"'
-                    return s[:i] + new_head + s[j:]
-                html = _inject_class("body", body_class, html)
-            lower = html.lower()
-            idx = lower.rfind("</head>")
-            if idx != -1:
-                new_html = html[:idx] + style_tag + html[idx:]
-            else:
-                new_html = style_tag + html
-            with open(html_path, "w", encoding="utf-8", errors="ignore") as f:
-                f.write(new_html)
-        except Exception:
-            # Non-fatal if injection fails
-            pass
-
-    def convertToHtml(self, expression: str, userId: int, sessionId: str, html_format: str | None = None, make4ht_args: list[str] | None = None):
+    def convertToHtml(self, expression: str, userId: int, sessionId: str, html_format: str | None = None, make4ht_args: list[str] | None = None,
+                      preview_path: str | None = None):
         """Convert LaTeX input to an HTML website using TeX Live (htlatex/make4ht).
 
-        Returns: BytesIO of a ZIP archive containing index.html and any assets.
+        Identical requests are answered from the HTML result cache without running TeX4ht.
+        If `preview_path` is given, the archive is also placed there (hard-linked from the
+        cache when possible) for HtmlHost to serve.
+
+        Returns: a binary stream with a ZIP archive containing index.html and any assets,
+        or the produced document itself for the ``odt``/``epub`` formats.
         """
+        self._record_request("html", userId, expression, fmt=html_format, args=make4ht_args or [])
         # Build a full document if needed (reuse user's preamble)
         if r"\documentclass" in expression:
             fileString = expression
         else:
+            fileString = self._get_preamble(userId)+"\n\\begin{document}\n"+expression+"\n\\end{document}"
+
+        html_format = self.resolveHtmlFormat(html_format)
+        ext = html_format if html_format in ("odt", "epub") else "zip"
+        cache_key = self._htmlCache.key(fileString, html_format, make4ht_args or [],
+                                        self._get_htlatex_executable(), self._html_theme_fingerprint())
+        cached = self._htmlCache.get(cache_key)
+        if cached:
+            try:
+                result = ZipPackager().passthrough(cached)
+            except OSError:
+                result = None  # evicted in the meantime; rebuild
+            if result is not None:
+                self.logger.debug("HTML result cache hit for userId %d", userId)
+                self._place_html_preview(result, cached, preview_path)
+                return result
+
+        result, draft = self._build_html(fileString, userId, sessionId, html_format, make4ht_args)
+        # A draft build also depends on the auxiliaries of the user's previous run, which the key does not cover
+        stored = None if draft else self._htmlCache.put(cache_key, result, ext=ext, fmt=html_format)
+        self._place_html_preview(result, stored, preview_path)
+        return result
+
+    def _place_html_preview(self, result, cached_path: str | None, preview_path: str | None):
+        if not preview_path:
+            return
+        try:
+            if cached_path:
+                HtmlResultCache.materialize(cached_path, preview_path)
+            else:
+                with open(preview_path, "wb") as f:
+                    shutil.copyfileobj(result, f)
+        except OSError as e:
+            self.logger.warn("Failed to write HTML preview archive: %s", e)
+        finally:
+            result.seek(0)
+
+    def _html_theme_fingerprint(self):
+        """Digest of the theme CSS that ThemeInjector injects, so theme or CSS changes miss the result cache."""
+        theme = ThemeInjector.from_env()
+        return hashlib.sha256(theme.style_tag).hexdigest() if theme else None
+
+    def _build_html(self, fileString: str, userId, sessionId: str, html_format: str, make4ht_args: list[str] | None):
+        """Run TeX4ht for `fileString`; returns the packaged result and whether it was a draft build."""
+        incremental = os.environ.get("LATEXBOT_HTML_INCREMENTAL", "").lower() in ("1", "true", "yes", "on")
+        if not incremental:
+            return self._build_html_in(os.path.join("build", f"html_{sessionId}"), fileString, html_format, make4ht_args), False
+
+        # Per-user persistent work directory: TeX4ht auxiliaries (.aux, .4ct/.4tc, .idv)
+        # and dvisvgm figures survive between runs of the same user
+        workdir = os.path.join("build", f"htmlwork_{userId}")
+        state = {
+            "preamble": hashlib.sha256(fileString.split("\\begin{document}", 1)[0].encode("utf-8")).hexdigest(),
+            "format": html_format,
+            "args": make4ht_args or [],
+            "exe": self._get_htlatex_executable(),
+        }
+        state_path = os.path.join(workdir, ".inlatexbot_state.json")
+        with self._html_work_lock(userId):
             try:
-                preamble = self._preambleManager.getPreambleFromDatabase(userId)
-                self.logger.debug("Preamble for userId %d found", userId)
-            except KeyError:
-                self.logger.debug("Preamble for userId %d not found, using default preamble", userId)
-                preamble = self._preambleManager.getDefaultPreamble()
-            finally:
-                fileString = preamble+"\n\\begin{document}\n"+expression+"\n\\end{document}"
-
-        workdir = os.path.join("build", f"html_{sessionId}")
+                with open(state_path, "r", encoding="utf-8") as f:
+                    draft = json.load(f) == state
+            except (OSError, ValueError):
+                draft = False
+            if not draft:
+                # Preamble or options changed: auxiliaries are no longer trustworthy
+                self.logger.debug("Clean HTML build for userId %s", userId)
+                shutil.rmtree(workdir, ignore_errors=True)
+            os.makedirs(workdir, exist_ok=True)
+            # A failed run leaves no state, so the next one starts clean
+            if os.path.exists(state_path):
+                os.remove(state_path)
+            self._clear_html_outputs(workdir)
+            result = self._build_html_in(workdir, fileString, html_format, make4ht_args, draft=draft, persistent=True)
+            with open(state_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            return result, draft
+
+    def _clear_html_outputs(self, workdir: str):
+        """Remove the pages, images and containers of the previous run; auxiliaries and figures stay."""
+        for name in os.listdir(workdir):
+            path = os.path.join(workdir, name)
+            if os.path.isfile(path) and not name.endswith(self.HTML_AUX_EXTS + (".svg",)):
+                os.remove(path)
+
+    def _is_html_aux(self, arcname: str) -> bool:
+        return arcname.endswith(self.HTML_AUX_EXTS + (".tex",))
+
+    def _html_work_lock(self, userId) -> threading.Lock:
+        with self._htmlWorkLocksGuard:
+            return self._htmlWorkLocks.setdefault(userId, threading.Lock())
+
+    @staticmethod
+    def _read_pages(workdir: str) -> str:
+        """Concatenated HTML/CSS of a generated site, for checking which figures it references."""
+        pages = []
+        for name in os.listdir(workdir):
+            if name.endswith((".html", ".css")):
+                with open(os.path.join(workdir, name), "r", encoding="utf-8", errors="ignore") as f:
+                    pages.append(f.read())
+        return "".join(pages)
+
+    def _prune_stale_svgs(self, workdir: str, since: float, referenced: str):
+        """Drop SVG figures kept from earlier runs that the new pages no longer reference."""
+        for name in os.listdir(workdir):
+            path = os.path.join(workdir, name)
+            if name.endswith(".svg") and name not in referenced and os.path.getmtime(path) < since:
+                os.remove(path)
+
+    def _build_html_in(self, workdir: str, fileString: str, html_format: str, make4ht_args: list[str] | None,
+                       draft: bool = False, persistent: bool = False):
+        started = time.time()
         os.makedirs(workdir, exist_ok=True)
         tex_base = "document"
         tex_path = os.path.join(workdir, tex_base + ".tex")
         with open(tex_path, "w", encoding="utf-8") as f:
             f.write(fileString)
 
+        # dvisvgm only runs for HTML targets; reuse figures other conversions already produced
+        # Figures depend on the preamble (fonts, packages), so runs that share it share figures
+        figure_key = hashlib.sha256(fileString.split("\\begin{document}", 1)[0].encode("utf-8")).hexdigest()
+        seeded = self._figureStore.seed(workdir, figure_key) if html_format.split("+")[0] in ("html5", "xhtml") else set()
         try:
             # Run converter
-            self._run_tex_to_html(tex_path, workdir, html_format=html_format, make4ht_args=make4ht_args)
+            self._run_tex_to_html(tex_path, workdir, html_format=html_format, make4ht_args=make4ht_args, draft=draft)
+
+            # ODT/EPUB are already ZIP containers; hand them back instead of re-packaging
+            if html_format in ("odt", "epub"):
+                container = os.path.join(workdir, tex_base + "." + html_format)
+                if not os.path.exists(container):
+                    raise ValueError(f"{html_format.upper()} output not found after conversion.")
+                return ZipPackager().passthrough(container)
 
             # Determine produced HTML file (htlatex uses the base name)
             produced_html = os.path.join(workdir, tex_base + ".html")
@@ -483,29 +869,20 @@ class LatexConverter():
                     except Exception:
                         index_html = produced_html  # keep original name
 
-            # Optionally inject a theme override (dark/light)
-            try:
-                self._maybe_inject_theme(index_html)
-            except Exception:
-                pass
+            referenced = self._read_pages(workdir)
+            self._figureStore.harvest(workdir, seeded, referenced, figure_key)
+            if persistent:
+                self._prune_stale_svgs(workdir, started, referenced)
 
-            # Package directory into a ZIP in-memory
-            import zipfile, io as _io
-            zip_stream = _io.BytesIO()
-            with zipfile.ZipFile(zip_stream, "w", zipfile.ZIP_DEFLATED) as zf:
-                for root, _, files in os.walk(workdir):
-                    for name in files:
-                        full = os.path.join(root, name)
-                        # Put files at archive root
-                        arcname = os.path.relpath(full, workdir)
-                        zf.write(full, arcname)
-            zip_stream.seek(0)
-            return zip_stream
+            # Package directory into a ZIP (stores images as-is, spools large sites to disk);
+            # an optional theme override (dark/light) is spliced into the pages on the way
+            # A persistent workdir also holds the auxiliaries the next draft run reads; they are not part of the site
+            return ZipPackager(transform=ThemeInjector.from_env()).package(workdir, skip=self._is_html_aux if persistent else None)
         finally:
             # Clean working directory unless debugging is requested
             try:
                 keep = os.environ.get("LATEXBOT_KEEP_HTML_TEMP", "").lower() in ("1", "true", "yes", "on")
-                if not keep:
+                if not keep and not persistent:
                     shutil.rmtree(workdir, ignore_errors=True)
             except Exception:
                 pass
@@ -0,0 +1,73 @@
+from typing import List
+
+
+class LatexSegmenter:
+    """Split a chat message into the LaTeX snippets it contains.
+
+    Recognised segments, in message order:
+    - ```latex fenced blocks (the code inside the fence, kept whole)
+    - display math: $$...$$ and \\[...\\]
+    - inline math: $...$ and \\(...\\)
+
+    Escaped dollars (\\$) are literal text, and an unterminated delimiter ends the scan.
+    Math segments keep their delimiters so each one can be rendered as-is.
+    """
+
+    _FENCE = "```"
+    _PAIRS = (("$$", "$$"), ("\\[", "\\]"), ("\\(", "\\)"), ("$", "$"))
+
+    @classmethod
+    def extract(cls, text: str) -> List[str]:
+        segments = []
+        i, n = 0, len(text)
+        while i < n:
+            # Jump straight to the next character that can open a segment
+            j = cls._next_opener(text, i)
+            if j == -1:
+                break
+            if text.startswith(cls._FENCE, j):
+                end = text.find(cls._FENCE, j + 3)
+                if end == -1:
+                    break
+                block = text[j + 3:end]
+                lang, _, code = block.partition("\n")
+                if lang.strip().lower() in ("latex", "tex"):
+                    code = code.strip()
+                    if code:
+                        segments.append(code)
+                i = end + 3
+                continue
+            if text.startswith("\\$", j):
+                i = j + 2
+                continue
+            for opener, closer in cls._PAIRS:
+                if text.startswith(opener, j):
+                    end = cls._find_closer(text, closer, j + len(opener))
+                    if end == -1:
+                        return segments
+                    if text[j + len(opener):end].strip():
+                        segments.append(text[j:end + len(closer)])
+                    i = end + len(closer)
+                    break
+            else:
+                # A backslash that doesn't open math, e.g. \frac
+                i = j + 1
+        return segments
+
+    @staticmethod
+    def _next_opener(text: str, start: int) -> int:
+        candidates = [p for p in (text.find("$", start), text.find("\\", start), text.find("```", start)) if p != -1]
+        return min(candidates) if candidates else -1
+
+    @staticmethod
+    def _find_closer(text: str, closer: str, start: int) -> int:
+        pos = start
+        while True:
+            end = text.find(closer, pos)
+            if end == -1:
+                return -1
+            # Skip escaped dollars inside inline math
+            if closer.startswith("$") and end > 0 and text[end - 1] == "\\":
+                pos = end + 1
+                continue
+            return end
@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+
+class RateLimiter:
+    """Token buckets that cap render load per user, per guild and globally.
+
+    - Each limit is "burst/per_minute": a bucket holds up to `burst` tokens and refills
+      at `per_minute` tokens a minute. An empty or "off" value disables that level.
+    - A request takes `cost` tokens from its user, guild (if any) and global bucket at
+      once, or from none of them; see cost() for the weights.
+    - Buckets that have refilled completely are forgotten, so idle users cost nothing.
+
+    Controlled by env: LATEXBOT_RATE_USER (default 10/20), LATEXBOT_RATE_GUILD (default 40/120),
+    LATEXBOT_RATE_GLOBAL (default 100/600), LATEXBOT_RATE_COST_DOCUMENT (default 3),
+    LATEXBOT_RATE_COST_HTML (default 5).
+    """
+
+    _DEFAULTS = {"user": "10/20", "guild": "40/120", "global": "100/600"}
+
+    def __init__(self, limits: Optional[Dict[str, Optional[Tuple[float, float]]]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        if limits is None:
+            limits = {level: self.parse_limit(os.environ.get(f"LATEXBOT_RATE_{level.upper()}", default))
+                      for level, default in self._DEFAULTS.items()}
+        # level -> (burst, tokens per second)
+        self._limits = {}
+        for level, limit in limits.items():
+            if limit:
+                burst, per_minute = limit
+                self._limits[level] = (burst, per_minute / 60)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_prune = clock()
+        # (level, id) -> (tokens, last update)
+        self._buckets: Dict[Tuple[str, object], Tuple[float, float]] = {}
+        self.document_cost = self._env_cost("LATEXBOT_RATE_COST_DOCUMENT", 3)
+        self.html_cost = self._env_cost("LATEXBOT_RATE_COST_HTML", 5)
+
+    @staticmethod
+    def parse_limit(value: Optional[str]) -> Optional[Tuple[float, float]]:
+        value = (value or "").strip().lower()
+        if not value or value in ("off", "0", "none"):
+            return None
+        try:
+            burst, _, per_minute = value.partition("/")
+            burst, per_minute = float(burst), float(per_minute or burst)
+        except ValueError:
+            raise ValueError(f"Invalid rate limit {value!r}; expected burst/per_minute, e.g. 10/20")
+        if burst <= 0 or per_minute <= 0:
+            return None
+        return burst, per_minute
+
+    @staticmethod
+    def _env_cost(name: str, default: float) -> float:
+        try:
+            return max(0.0, float(os.environ.get(name, default)))
+        except ValueError:
+            return float(default)
+
+    def cost(self, expression: str = "", html: bool = False) -> float:
+        """Tokens a render takes: TeX4ht conversions and full documents outweigh inline math."""
+        if html:
+            return self.html_cost
+        if r"\documentclass" in expression:
+            return self.document_cost
+        return 1.0
+
+    def acquire(self, user_id, guild_id=None, cost: float = 1.0) -> float:
+        """Take `cost` tokens; returns 0 on success, else the seconds until the request would fit."""
+        keys = [("user", user_id), ("guild", guild_id), ("global", None)]
+        keys = [key for key in keys if key[0] in self._limits and (key[0] != "guild" or guild_id is not None)]
+        with self._lock:
+            now = self._clock()
+            levels = []
+            wait = 0.0
+            for key in keys:
+                burst, rate = self._limits[key[0]]
+                tokens, last = self._buckets.get(key, (burst, now))
+                tokens = min(burst, tokens + (now - last) * rate)
+                levels.append((key, tokens))
+                # A request costing more than the burst only has to wait for a full bucket
+                needed = min(cost, burst)
+                if tokens < needed:
+                    wait = max(wait, (needed - tokens) / rate)
+            if wait > 0:
+                return wait
+            for key, tokens in levels:
+                self._buckets[key] = (tokens - min(cost, self._limits[key[0]][0]), now)
+            if now - self._last_prune > 60:
+                self._prune(now)
+            return 0.0
+
+    def _prune(self, now: float):
+        self._last_prune = now
+        for key, (tokens, last) in list(self._buckets.items()):
+            burst, rate = self._limits[key[0]]
+            if tokens + (now - last) * rate >= burst:
+                del self._buckets[key]
@@ -0,0 +1,97 @@
+import os
+import threading
+from typing import Callable, Hashable, Optional
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.results = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class RenderBatcher:
+    """Coalesce concurrent renders that share a preamble and DPI into one multi-page compile.
+
+    - The first request for a key leads a batch. When no compile is running it starts at
+      once, so an idle bot pays no extra latency.
+    - Under load the leader keeps the batch open for a window that grows with the number
+      of compiles in flight (capped at `max_window` seconds), or until `max_batch` requests
+      have joined. Requests arriving meanwhile with the same key join it.
+    - `render(items, sessionId)` runs the batch and returns one result (or exception) per
+      item; each waiting caller gets its own entry back.
+
+    Controlled by env: LATEXBOT_MICROBATCH_WINDOW_MS (default 25), LATEXBOT_MICROBATCH_MAX (default 16).
+    """
+
+    def __init__(self, render: Callable[[list, str], list], max_window: Optional[float] = None, max_batch: Optional[int] = None):
+        if max_window is None:
+            try:
+                max_window = max(0.0, float(os.environ.get("LATEXBOT_MICROBATCH_WINDOW_MS", "25"))) / 1000
+            except ValueError:
+                max_window = 0.025
+        if max_batch is None:
+            try:
+                max_batch = max(1, int(os.environ.get("LATEXBOT_MICROBATCH_MAX", "16")))
+            except ValueError:
+                max_batch = 16
+        self._render = render
+        self._max_window = max_window
+        self._max_batch = max_batch
+        self._lock = threading.Lock()
+        self._open = {}
+        self._active = 0
+        self.batches = 0
+        self.batched = 0
+
+    def _window(self) -> float:
+        # Each compile in flight stretches the window by a quarter of the maximum
+        return min(self._max_window, self._max_window * self._active / 4)
+
+    def submit(self, key: Hashable, item, sessionId: str):
+        """Render `item` with whatever batch forms for `key`; returns its result or raises its error."""
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = _Batch()
+                window = self._window()
+                if window > 0:
+                    self._open[key] = batch
+            index = len(batch.items)
+            batch.items.append(item)
+            if not leader and len(batch.items) >= self._max_batch:
+                del self._open[key]
+                batch.full.set()
+
+        if leader:
+            if window > 0:
+                batch.full.wait(window)
+                with self._lock:
+                    if self._open.get(key) is batch:
+                        del self._open[key]
+            self._run(batch, sessionId)
+        else:
+            batch.done.wait()
+        result = batch.results[index]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _run(self, batch: _Batch, sessionId: str):
+        with self._lock:
+            self._active += 1
+            self.batches += 1
+            self.batched += len(batch.items)
+        try:
+            batch.results = self._render(batch.items, sessionId)
+        except Exception as err:
+            batch.results = [err] * len(batch.items)
+        finally:
+            with self._lock:
+                self._active -= 1
+            batch.done.set()
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "batched_renders": self.batched}
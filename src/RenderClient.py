@@ -0,0 +1,141 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+from typing import Optional, Tuple
+
+from src.RenderDaemon import decode_value, error_from, read_frame, write_frame
+
+
+class RenderClient:
+    """Stand-in for LatexConverter that sends every render to a RenderDaemon.
+
+    - Offers the converter methods the frontends use, with the same arguments and results.
+    - Keeps one connection per thread (and per process, so forked Telegram responders
+      never share a socket) and reconnects once if a kept-alive connection went stale.
+      A request that timed out waiting for its answer is never sent again: the daemon
+      may still be rendering it.
+    - HTML previews are written to `preview_path` on this machine, where HtmlHost runs.
+
+    Enabled in the frontends by LATEXBOT_RENDER_DAEMON=host:port
+    (and LATEXBOT_RENDER_DAEMON_TOKEN when the daemon requires one).
+    """
+
+    def __init__(self, address: str, token: Optional[str] = None, timeout: Optional[float] = None):
+        host, _, port = address.rpartition(":")
+        if not host or not port.isdigit():
+            raise ValueError(f"Render daemon address must be host:port, got {address!r}")
+        self._address = (host.strip("[]"), int(port))
+        self._token = token if token is not None else (os.environ.get("LATEXBOT_RENDER_DAEMON_TOKEN") or None)
+        if timeout is None:
+            try:
+                timeout = float(os.environ.get("LATEXBOT_RENDER_DAEMON_TIMEOUT", "300"))
+            except ValueError:
+                timeout = 300.0
+        self._timeout = timeout
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls) -> Optional["RenderClient"]:
+        address = os.environ.get("LATEXBOT_RENDER_DAEMON")
+        return cls(address) if address else None
+
+    def _connection(self, fresh: bool = False) -> Tuple[socket.socket, bool]:
+        """This thread's connection, and whether it was kept alive from an earlier request."""
+        if fresh:
+            self._drop_connection()
+        sock = getattr(self._local, "sock", None)
+        if sock is not None and self._local.pid == os.getpid():
+            return sock, True
+        sock = socket.create_connection(self._address, timeout=self._timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.sock = sock
+        self._local.pid = os.getpid()
+        return sock, False
+
+    def _drop_connection(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        # A socket inherited from the parent process is the parent's to close
+        if sock is not None and self._local.pid == os.getpid():
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _call(self, method: str, *args, on_preview=None, **kwargs):
+        request = {"method": method, "args": list(args), "kwargs": kwargs}
+        if self._token:
+            request["token"] = self._token
+        for attempt in (0, 1):
+            answered = False
+            sock, reused = self._connection(fresh=attempt > 0)
+            try:
+                write_frame(sock, request)
+                while True:
+                    frame = read_frame(sock)
+                    if frame is None:
+                        raise ConnectionError("Render daemon closed the connection")
+                    answered = True
+                    header, parts = frame
+                    if header.get("event") != "preview":
+                        break
+                    if on_preview:
+                        on_preview(parts[0])
+                break
+            except socket.timeout:
+                # The daemon may still be rendering; sending the request again would compile it twice
+                self._drop_connection()
+                raise
+            except (ConnectionError, OSError):
+                self._drop_connection()
+                # Retry only if the daemon had already closed the kept-alive socket, so it never saw the request
+                if attempt or answered or not reused:
+                    raise
+        if "error" in header:
+            raise error_from(header["error"], header.get("message", ""))
+        return decode_value(header.get("result"), parts)
+
+    # ----------------------------- converter API -----------------------------
+    def convertExpression(self, expression, userId, sessionId, returnPdf=False, keepPdf=False):
+        return self._call("convertExpression", expression, userId, sessionId, returnPdf=returnPdf, keepPdf=keepPdf)
+
+    def convertExpressions(self, expressions, userId, sessionId, returnPdf=False, keepPdf=False):
+        return self._call("convertExpressions", list(expressions), userId, sessionId, returnPdf=returnPdf, keepPdf=keepPdf)
+
+    def convertExpressionProgressive(self, expression, userId, sessionId, onPreview, previewDpi=None, returnPdf=False, keepPdf=False):
+        return self._call("convertExpressionProgressive", expression, userId, sessionId, on_preview=onPreview,
+                          previewDpi=previewDpi, returnPdf=returnPdf, keepPdf=keepPdf)
+
+    def convertPages(self, expression, userId, sessionId, firstPage=1, lastPage=None, keepPdf=False):
+        return self._call("convertPages", expression, userId, sessionId, firstPage=firstPage, lastPage=lastPage, keepPdf=keepPdf)
+
+    def retainedPdf(self, handle):
+        return self._call("retainedPdf", list(handle))
+
+    def resolveHtmlFormat(self, html_format=None):
+        return self._call("resolveHtmlFormat", html_format)
+
+    def cacheStats(self):
+        return self._call("cacheStats")
+
+    def convertToHtml(self, expression, userId, sessionId, html_format=None, make4ht_args=None, preview_path=None):
+        stream = self._call("convertToHtml", expression, userId, sessionId, html_format=html_format, make4ht_args=make4ht_args)
+        if preview_path:
+            directory = os.path.dirname(preview_path) or "."
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    shutil.copyfileobj(stream, f, 1024 * 1024)
+                os.replace(tmp, preview_path)
+            except OSError:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+            finally:
+                stream.seek(0)
+        return stream
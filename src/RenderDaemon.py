@@ -0,0 +1,230 @@
+import argparse
+import hmac
+import io
+import json
+import os
+import socket
+import socketserver
+import struct
+import tempfile
+from typing import List, Optional, Tuple
+
+from src.LoggingServer import LoggingServer
+
+# Wire format, both directions: a frame is a 4-byte big-endian header length, a UTF-8
+# JSON header, then header["parts"] binary parts, each an 8-byte length and the bytes.
+_HEADER = struct.Struct(">I")
+_PART = struct.Struct(">Q")
+_CHUNK = 1024 * 1024
+# Received parts above this size are spooled to disk instead of memory
+_SPOOL_BYTES = 16 * 1024 * 1024
+
+
+def _stream_size(stream) -> int:
+    start = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell() - start
+    stream.seek(start)
+    return size
+
+
+def write_frame(sock: socket.socket, header: dict, parts: Optional[list] = None):
+    """Send a header and binary streams; streams are sent from their current position in chunks."""
+    parts = parts or []
+    data = json.dumps(dict(header, parts=len(parts))).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(data)) + data)
+    for stream in parts:
+        sock.sendall(_PART.pack(_stream_size(stream)))
+        while True:
+            chunk = stream.read(_CHUNK)
+            if not chunk:
+                break
+            sock.sendall(chunk)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(min(size - len(buf), _CHUNK))
+        if not chunk:
+            raise ConnectionError("Connection closed mid-frame")
+        buf += chunk
+    return bytes(buf)
+
+
+def read_frame(sock: socket.socket) -> Optional[Tuple[dict, List]]:
+    """Receive one frame; returns (header, streams), or None when the peer closed cleanly."""
+    first = sock.recv(_HEADER.size)
+    if not first:
+        return None
+    if len(first) < _HEADER.size:
+        first += _recv_exact(sock, _HEADER.size - len(first))
+    header = json.loads(_recv_exact(sock, _HEADER.unpack(first)[0]).decode("utf-8"))
+    parts = []
+    for _ in range(int(header.get("parts", 0))):
+        size = _PART.unpack(_recv_exact(sock, _PART.size))[0]
+        stream = io.BytesIO() if size <= _SPOOL_BYTES else tempfile.TemporaryFile()
+        remaining = size
+        while remaining:
+            chunk = sock.recv(min(remaining, _CHUNK))
+            if not chunk:
+                raise ConnectionError("Connection closed mid-frame")
+            stream.write(chunk)
+            remaining -= len(chunk)
+        stream.seek(0)
+        parts.append(stream)
+    return header, parts
+
+
+def encode_value(value, parts: list):
+    """JSON-safe form of a converter result; binary streams are moved into `parts`."""
+    if hasattr(value, "read"):
+        parts.append(value)
+        return {"$stream": len(parts) - 1}
+    if isinstance(value, Exception):
+        return {"$error": type(value).__name__, "message": str(value)}
+    if isinstance(value, tuple):
+        return {"$tuple": [encode_value(v, parts) for v in value]}
+    if isinstance(value, list):
+        return [encode_value(v, parts) for v in value]
+    if isinstance(value, dict):
+        return {k: encode_value(v, parts) for k, v in value.items()}
+    return value
+
+
+def decode_value(value, parts: list):
+    if isinstance(value, list):
+        return [decode_value(v, parts) for v in value]
+    if isinstance(value, dict):
+        if "$stream" in value:
+            return parts[value["$stream"]]
+        if "$error" in value:
+            return error_from(value["$error"], value.get("message", ""))
+        if "$tuple" in value:
+            return tuple(decode_value(v, parts) for v in value["$tuple"])
+        return {k: decode_value(v, parts) for k, v in value.items()}
+    return value
+
+
+def error_from(name: str, message: str) -> Exception:
+    # ValueError means "the input can't be rendered" to every frontend; keep it distinct
+    return ValueError(message) if name == "ValueError" else RuntimeError(f"{name}: {message}")
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        daemon = self.server.daemon
+        while True:
+            try:
+                frame = read_frame(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+            if frame is None:
+                return
+            try:
+                daemon.respond(self.request, frame[0])
+            except (ConnectionError, OSError):
+                return
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class RenderDaemon:
+    """Serve a LatexConverter to any number of frontends over a TCP socket.
+
+    - Each connection carries one request at a time and stays open for the next; every
+      connection gets its own thread, so clients render concurrently and share the
+      converter's caches, retained PDFs and micro-batching.
+    - Requests name a converter method from METHODS plus its arguments; results come back
+      with PNG/PDF/ZIP payloads streamed as binary parts. Progressive renders send a
+      preview frame before the result.
+    - With a token (LATEXBOT_RENDER_DAEMON_TOKEN) requests without it are refused; set one
+      whenever the daemon listens on anything but localhost.
+
+    Run with `python -m src.RenderDaemon --host 0.0.0.0 --port 8765`.
+    """
+
+    METHODS = ("convertExpression", "convertExpressions", "convertExpressionProgressive", "convertPages", "retainedPdf",
+               "convertToHtml", "resolveHtmlFormat", "cacheStats")
+
+    logger = LoggingServer.getInstance()
+
+    def __init__(self, converter, host: str = "127.0.0.1", port: int = 8765, token: Optional[str] = None):
+        self._converter = converter
+        self._token = token if token is not None else (os.environ.get("LATEXBOT_RENDER_DAEMON_TOKEN") or None)
+        self._server = _Server((host, port), _Handler)
+        self._server.daemon = self
+
+    @property
+    def address(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def serve_forever(self):
+        self.logger.debug("Render daemon listening on %s", self.address)
+        self._server.serve_forever()
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def respond(self, sock: socket.socket, request: dict):
+        try:
+            result = self._call(sock, request)
+        except ValueError as err:
+            write_frame(sock, {"error": "ValueError", "message": str(err)})
+            return
+        except PermissionError as err:
+            write_frame(sock, {"error": "PermissionError", "message": str(err)})
+            return
+        except Exception as err:
+            self.logger.warn("Render daemon request %s failed: %s", request.get("method"), err)
+            write_frame(sock, {"error": type(err).__name__, "message": str(err)})
+            return
+        parts: list = []
+        encoded = encode_value(result, parts)
+        write_frame(sock, {"result": encoded}, parts)
+
+    def _call(self, sock: socket.socket, request: dict):
+        if self._token and not hmac.compare_digest(str(request.get("token") or ""), self._token):
+            raise PermissionError("Invalid render daemon token")
+        method = request.get("method")
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown render daemon method {method!r}")
+        args = list(request.get("args") or [])
+        kwargs = dict(request.get("kwargs") or {})
+        if method == "convertExpressionProgressive":
+            # The preview goes out on this connection before the final result
+            args.insert(3, lambda stream: write_frame(sock, {"event": "preview"}, [stream]))
+        if method == "convertToHtml":
+            # Preview files live on the frontend's machine; the client places them
+            kwargs.pop("preview_path", None)
+        return getattr(self._converter, method)(*args, **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve LaTeX renders to the Discord and Telegram frontends.")
+    parser.add_argument("--host", default=os.environ.get("LATEXBOT_RENDER_DAEMON_HOST", "127.0.0.1"), help="address to listen on")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("LATEXBOT_RENDER_DAEMON_PORT", "8765")), help="TCP port")
+    args = parser.parse_args(argv)
+
+    from src.LatexConverter import LatexConverter
+    from src.PreambleManager import PreambleManager
+    from src.ResourceManager import ResourceManager
+    from src.UserOptionsManager import UserOptionsManager
+
+    converter = LatexConverter(PreambleManager(ResourceManager()), UserOptionsManager())
+    daemon = RenderDaemon(converter, host=args.host, port=args.port)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
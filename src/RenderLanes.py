@@ -0,0 +1,103 @@
+import asyncio
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+
+class RenderLanes:
+    """Run blocking renders off the event loop in priority lanes with their own caps.
+
+    - Lanes in priority order: "interactive" (math snippets), "document" (full documents,
+      TikZ) and "html" (TeX4ht conversions). A free worker always takes the oldest job of
+      the highest-priority lane that is under its cap, so a formula queued behind a pile
+      of conversions starts next.
+    - The heavy lanes never take the last `reserved` workers, so an interactive render
+      always finds a worker without waiting for a long conversion to finish.
+    - Jobs whose caller stopped waiting (cancelled tasks) are dropped before they start.
+
+    Controlled by env: LATEXBOT_RENDER_WORKERS (default: CPU count),
+    LATEXBOT_LANE_INTERACTIVE / LATEXBOT_LANE_DOCUMENT / LATEXBOT_LANE_HTML (per-lane caps).
+    """
+
+    LANES = ("interactive", "document", "html")
+
+    def __init__(self, workers: Optional[int] = None, caps: Optional[Dict[str, int]] = None, reserved: Optional[int] = None):
+        if workers is None:
+            workers = self._env_int("LATEXBOT_RENDER_WORKERS", os.cpu_count() or 4)
+        self._workers = max(1, workers)
+        self._reserved = min(1, self._workers - 1) if reserved is None else max(0, min(reserved, self._workers - 1))
+        defaults = {
+            "interactive": max(1, self._workers - 1),
+            "document": max(1, self._workers // 2),
+            "html": max(1, self._workers // 4),
+        }
+        caps = caps or {}
+        self._caps = {lane: max(1, caps.get(lane) or self._env_int(f"LATEXBOT_LANE_{lane.upper()}", defaults[lane]))
+                      for lane in self.LANES}
+        self._queues = {lane: deque() for lane in self.LANES}
+        self._running = {lane: 0 for lane in self.LANES}
+        self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="render")
+
+    @staticmethod
+    def _env_int(name: str, default: int) -> int:
+        try:
+            return int(os.environ.get(name, default))
+        except ValueError:
+            return default
+
+    @staticmethod
+    def lane_for(expression: str = "", html: bool = False) -> str:
+        if html:
+            return "html"
+        if r"\documentclass" in expression or "tikzpicture" in expression:
+            return "document"
+        return "interactive"
+
+    async def run(self, lane: str, func: Callable, *args):
+        """Run `func(*args)` on a worker once `lane` gets one; returns its result."""
+        future = asyncio.get_running_loop().create_future()
+        self._queues[lane].append((func, args, future))
+        self._dispatch()
+        return await future
+
+    def stats(self) -> dict:
+        return {lane: {"running": self._running[lane], "queued": len(self._queues[lane]), "cap": self._caps[lane]}
+                for lane in self.LANES}
+
+    def _next(self):
+        busy = sum(self._running.values())
+        if busy >= self._workers:
+            return None
+        for lane in self.LANES:
+            queue = self._queues[lane]
+            while queue and queue[0][2].cancelled():
+                queue.popleft()
+            if not queue or self._running[lane] >= self._caps[lane]:
+                continue
+            if lane != "interactive" and busy >= self._workers - self._reserved:
+                continue
+            return lane, queue.popleft()
+        return None
+
+    def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            lane, (func, args, future) = job
+            self._running[lane] += 1
+            work = loop.run_in_executor(self._executor, func, *args)
+            work.add_done_callback(lambda done, lane=lane, future=future: self._finished(lane, future, done))
+
+    def _finished(self, lane: str, future: asyncio.Future, done: asyncio.Future):
+        self._running[lane] -= 1
+        if not future.cancelled():
+            if done.cancelled():
+                future.cancel()
+            elif done.exception() is not None:
+                future.set_exception(done.exception())
+            else:
+                future.set_result(done.result())
+        self._dispatch()
@@ -0,0 +1,48 @@
+import threading
+from typing import Callable, Hashable
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Let concurrent callers asking for the same key share one computation.
+
+    - The first caller for a key runs the work; callers arriving while it runs wait for it
+      and get its result passed through `clone` (so each gets its own copy of mutable
+      results such as streams), or its exception.
+    - Nothing is kept once the work finishes: later callers start a new computation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable, clone: Callable = lambda result: result):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+        if leader:
+            try:
+                call.result = fn()
+                return call.result
+            except BaseException as err:
+                call.error = err
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return clone(call.result)
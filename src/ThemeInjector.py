@@ -0,0 +1,166 @@
+import os
+import threading
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+
+class ThemeInjector:
+    """Add a theme override `<style>` to generated HTML pages while they stream past.
+
+    Controlled by env:
+    - LATEXBOT_HTML_THEME=dark|light|<name>|system (default: system → no forced override)
+    - LATEXBOT_HTML_THEME_CSS=path/to/custom.css (optional, overrides the theme's CSS)
+
+    The CSS comes from LATEXBOT_HTML_THEME_CSS, else `resources/html_styles/<theme>.css`
+    when that file is non-empty, else the built-in dark/light rules. It is read once per
+    (theme, path) and cached for the life of the process.
+    """
+
+    STYLES_DIR = os.path.join("resources", "html_styles")
+
+    _BUILTIN_CSS = {
+        "dark": (
+            ":root{color-scheme:dark;}\n"
+            "body{background:#0b0c10 !important;color:#e5e7eb !important;}\n"
+            "html{background:#0b0c10 !important;}\n"
+            "a{color:#93c5fd !important;}\n"
+            "pre,code{background:#111827 !important;color:#e5e7eb !important;}\n"
+            "table{border-color:#374151 !important;}\n"
+            "img{background:transparent !important;}\n"
+        ),
+        "light": (
+            ":root{color-scheme:light;}\n"
+            "body{background:#ffffff !important;color:#111827 !important;}\n"
+            "html{background:#ffffff !important;}\n"
+            "a{color:#1d4ed8 !important;}\n"
+            "pre,code{background:#f3f4f6 !important;color:#111827 !important;}\n"
+            "table{border-color:#e5e7eb !important;}\n"
+            "img{background:transparent !important;}\n"
+        ),
+    }
+
+    _css_cache: Dict[Tuple[str, Optional[str]], Optional[str]] = {}
+    _css_lock = threading.Lock()
+
+    def __init__(self, theme: str, css: str):
+        self.theme = theme
+        self.style_tag = (
+            "<!-- injected by InLaTeX bot: theme override -->\n"
+            "<style id=\"inlatexbot-theme\">\n" + css + "\n</style>\n"
+        ).encode("utf-8")
+        self.body_class = f' class="inlatexbot-{theme}"'.encode("utf-8")
+
+    @classmethod
+    def from_env(cls) -> Optional["ThemeInjector"]:
+        """Return the injector configured by the environment, or None when no theme is forced."""
+        theme = os.environ.get("LATEXBOT_HTML_THEME", "system").strip().lower()
+        if not theme or theme == "system":
+            return None
+        css = cls._load_css(theme, os.environ.get("LATEXBOT_HTML_THEME_CSS") or None)
+        return cls(theme, css) if css else None
+
+    @classmethod
+    def _load_css(cls, theme: str, css_path: Optional[str]) -> Optional[str]:
+        key = (theme, css_path)
+        with cls._css_lock:
+            if key in cls._css_cache:
+                return cls._css_cache[key]
+            css = None
+            for path in (css_path, os.path.join(cls.STYLES_DIR, os.path.basename(theme) + ".css")):
+                if path and os.path.isfile(path):
+                    try:
+                        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                            css = f.read().strip() or None
+                    except OSError:
+                        css = None
+                    if css:
+                        break
+            css = css or cls._BUILTIN_CSS.get(theme)
+            cls._css_cache[key] = css
+            return css
+
+    @staticmethod
+    def applies(name: str) -> bool:
+        return name.lower().endswith((".html", ".htm"))
+
+    def transform_chunks(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Yield `chunks` with the style tag and body class spliced in."""
+        state = _ThemeStream(self)
+        for chunk in chunks:
+            out = state.feed(chunk)
+            if out:
+                yield out
+        out = state.close()
+        if out:
+            yield out
+
+    def apply(self, data: bytes) -> bytes:
+        return b"".join(self.transform_chunks([data]))
+
+
+class _ThemeStream:
+    """Incremental splicer; only a few bytes around a split marker are ever held back."""
+
+    _HEAD_END = b"</head>"
+    _BODY = b"<body"
+    _MAX_TAG = 4096  # give up on a <body ...> tag that never closes
+
+    def __init__(self, injector: ThemeInjector):
+        self._injector = injector
+        self._state = "head"
+        self._buf = b""
+
+    def feed(self, chunk: bytes) -> bytes:
+        self._buf += chunk
+        out = []
+        while True:
+            if self._state == "head":
+                low = self._buf.lower()
+                end = low.find(self._HEAD_END)
+                body = low.find(self._BODY)
+                cut = min(i for i in (end, body) if i != -1) if end != -1 or body != -1 else -1
+                if cut == -1:
+                    self._keep(out, len(self._HEAD_END) - 1)
+                    break
+                # Style goes before </head>, or before <body> for pages without a head
+                out.append(self._buf[:cut])
+                out.append(self._injector.style_tag)
+                self._buf = self._buf[cut:]
+                self._state = "body"
+            elif self._state == "body":
+                start = self._buf.lower().find(self._BODY)
+                if start == -1:
+                    self._keep(out, len(self._BODY) - 1)
+                    break
+                close = self._buf.find(b">", start)
+                if close == -1:
+                    if len(self._buf) - start > self._MAX_TAG:
+                        self._state = "done"
+                        continue
+                    out.append(self._buf[:start])
+                    self._buf = self._buf[start:]
+                    break
+                tag = self._buf[start:close]
+                out.append(self._buf[:start])
+                # Don't overwrite existing classes to avoid breakage
+                out.append(tag if b"class=" in tag.lower() else tag + self._injector.body_class)
+                self._buf = self._buf[close:]
+                self._state = "done"
+            else:
+                out.append(self._buf)
+                self._buf = b""
+                break
+        return b"".join(out)
+
+    def _keep(self, out: list, tail: int):
+        # Hold back just enough bytes to recognise a marker split across chunks
+        split = max(0, len(self._buf) - tail)
+        out.append(self._buf[:split])
+        self._buf = self._buf[split:]
+
+    def close(self) -> bytes:
+        rest = self._buf
+        self._buf = b""
+        if self._state == "head":
+            # No head or body at all: a trailing <style> still applies
+            return rest + self._injector.style_tag
+        return rest
@@ -0,0 +1,220 @@
+import argparse
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+
+class TraceReplay:
+    """Replay a recorded stream of render requests against a LatexConverter.
+
+    - Reads either the compact request log written when LATEXBOT_REQUEST_LOG is set
+      (one JSON object per line) or the regular log/inlatexbot.log.
+    - Re-issues every request with its original inter-arrival gap, divided by `speedup`
+      (speedup <= 0 sends the whole trace as fast as the workers allow).
+    - Reports throughput, latency percentiles (measured from the scheduled arrival, so
+      queueing is included) and cache effectiveness.
+    """
+
+    # 11:04:05.123 [DEBUG] message
+    _LOG_LINE = re.compile(r"^(\d{2}):(\d{2}):(\d{2})\.(\d{3}) \[(\w+)\] (.*)$")
+    _INLINE_QUERY = re.compile(r"^Received inline query: (.*), id: (\S+), from user: (-?\d+)$", re.DOTALL)
+    _MESSAGE = re.compile(r"^Received message: (.*), id: (\S+), from: (-?\d+)$", re.DOTALL)
+
+    def __init__(self, converter, speedup: float = 1.0, workers: int = 8,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self._converter = converter
+        self._speedup = speedup
+        self._workers = max(1, int(workers))
+        self._clock = clock
+        self._sleep = sleep
+
+    # ----------------------------- loading -----------------------------
+    @staticmethod
+    def load(path: str) -> List[dict]:
+        """Load a trace, detecting the compact JSON format by its first non-empty line."""
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                if line.strip():
+                    if line.lstrip().startswith("{"):
+                        return TraceReplay.load_request_log(path)
+                    break
+        return TraceReplay.load_bot_log(path)
+
+    @staticmethod
+    def load_request_log(path: str) -> List[dict]:
+        records = []
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # tolerate a truncated last line
+                if "t" in rec and "expr" in rec:
+                    records.append(rec)
+        records.sort(key=lambda r: r["t"])
+        return records
+
+    @staticmethod
+    def load_bot_log(path: str) -> List[dict]:
+        """Extract received expressions from log/inlatexbot.log.
+
+        The log only stores a 12-hour wall clock (no date), so timestamps are made
+        monotonic by adding 12h whenever the clock goes backwards. Multi-line
+        expressions continue on lines without a timestamp prefix.
+        """
+        entries = []
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            for raw in f:
+                line = raw.rstrip("\n")
+                m = TraceReplay._LOG_LINE.match(line)
+                if m:
+                    hh, mm, ss, ms = (int(m.group(i)) for i in range(1, 5))
+                    seconds = (hh % 12) * 3600 + mm * 60 + ss + ms / 1000.0
+                    entries.append([seconds, m.group(6)])
+                elif entries:
+                    entries[-1][1] += "\n" + line
+
+        records = []
+        offset = 0.0
+        previous = None
+        for seconds, message in entries:
+            if previous is not None and seconds + offset < previous:
+                offset += 12 * 3600
+            previous = seconds + offset
+            m = TraceReplay._INLINE_QUERY.match(message)
+            if m:
+                records.append({"t": previous, "kind": "expr", "user": int(m.group(3)), "expr": m.group(1), "pdf": False})
+                continue
+            m = TraceReplay._MESSAGE.match(message)
+            if m:
+                records.append({"t": previous, "kind": "expr", "user": int(m.group(3)), "expr": m.group(1), "pdf": True})
+        return records
+
+    # ----------------------------- replay -----------------------------
+    def replay(self, records: List[dict], limit: Optional[int] = None) -> Dict[str, object]:
+        if limit:
+            records = records[:limit]
+        if not records:
+            return {"requests": 0}
+
+        latencies: List[float] = []
+        errors = 0
+        lock = threading.Lock()
+        cache_before = self._cache_stats()
+
+        def run(index: int, rec: dict, scheduled: float):
+            nonlocal errors
+            ok = True
+            try:
+                self._issue(index, rec)
+            except Exception:
+                ok = False
+            elapsed = self._clock() - scheduled
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors += 1
+
+        t0 = records[0]["t"]
+        start = self._clock()
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            for index, rec in enumerate(records):
+                if self._speedup > 0:
+                    scheduled = start + (rec["t"] - t0) / self._speedup
+                    delay = scheduled - self._clock()
+                    if delay > 0:
+                        self._sleep(delay)
+                else:
+                    scheduled = self._clock()
+                executor.submit(run, index, rec, scheduled)
+        wall = max(self._clock() - start, 1e-9)
+
+        seen = set()
+        repeats = 0
+        for rec in records:
+            key = (rec.get("kind"), rec.get("user"), rec.get("expr"), rec.get("fmt"))
+            if key in seen:
+                repeats += 1
+            seen.add(key)
+
+        report: Dict[str, object] = {
+            "requests": len(records),
+            "errors": errors,
+            "wall_seconds": round(wall, 3),
+            "throughput_rps": round(len(records) / wall, 3),
+            "trace_seconds": round(records[-1]["t"] - t0, 3),
+            "repeat_ratio": round(repeats / len(records), 4),
+        }
+        latencies.sort()
+        for name, q in (("p50", 0.50), ("p90", 0.90), ("p99", 0.99)):
+            report[f"latency_{name}_ms"] = round(self._percentile(latencies, q) * 1000, 1)
+        report["latency_max_ms"] = round(latencies[-1] * 1000, 1)
+
+        cache_after = self._cache_stats()
+        if cache_after is not None:
+            before = cache_before or {}
+            report["cache"] = {k: v - before.get(k, 0) for k, v in cache_after.items() if isinstance(v, (int, float))}
+        return report
+
+    def _issue(self, index: int, rec: dict):
+        session_id = f"replay_{index}"
+        user = rec.get("user", 0)
+        if rec.get("kind") == "html":
+            self._converter.convertToHtml(rec["expr"], user, session_id,
+                                          html_format=rec.get("fmt"), make4ht_args=rec.get("args") or None)
+        else:
+            self._converter.convertExpression(rec["expr"], user, session_id, returnPdf=bool(rec.get("pdf")))
+
+    def _cache_stats(self) -> Optional[dict]:
+        stats = getattr(self._converter, "cacheStats", None)
+        if not callable(stats):
+            return None
+        try:
+            return dict(stats())
+        except Exception:
+            return None
+
+    @staticmethod
+    def _percentile(sorted_values: List[float], q: float) -> float:
+        if not sorted_values:
+            return 0.0
+        idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+        return sorted_values[idx]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded LaTeX render requests against LatexConverter.")
+    parser.add_argument("logs", nargs="+", help="log/inlatexbot.log files (oldest first) or a LATEXBOT_REQUEST_LOG file")
+    parser.add_argument("--speedup", type=float, default=1.0, help="divide inter-arrival gaps by this factor; 0 = no delays")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent render workers")
+    parser.add_argument("--limit", type=int, default=None, help="replay only the first N requests")
+    args = parser.parse_args(argv)
+
+    from src.LatexConverter import LatexConverter
+    from src.PreambleManager import PreambleManager
+    from src.ResourceManager import ResourceManager
+    from src.UserOptionsManager import UserOptionsManager
+
+    records: List[dict] = []
+    for path in args.logs:
+        loaded = TraceReplay.load(path)
+        if records and loaded and loaded[0]["t"] < records[-1]["t"]:
+            # Rotated bot logs restart their clock; keep the files in the given order
+            shift = records[-1]["t"] - loaded[0]["t"]
+            for rec in loaded:
+                rec["t"] += shift
+        records.extend(loaded)
+
+    converter = LatexConverter(PreambleManager(ResourceManager()), UserOptionsManager())
+    report = TraceReplay(converter, speedup=args.speedup, workers=args.workers).replay(records, limit=args.limit)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
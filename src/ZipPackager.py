@@ -0,0 +1,191 @@
+import io
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+
+class _ZipWriter:
+    """Minimal append-only ZIP writer that accepts members compressed elsewhere.
+
+    zipfile.ZipFile always compresses inside write(); writing the headers ourselves
+    lets members be deflated on worker threads and written in archive order.
+    The output starts in memory and moves to a temporary file once it grows past
+    `spool_threshold` bytes.
+    """
+
+    _LOCAL = struct.Struct("<4s5H3L2H")
+    _CENTRAL = struct.Struct("<4s6H3L5H2L")
+    _END = struct.Struct("<4s4H2LH")
+    _LIMIT = 0xFFFFFFFF  # no ZIP64 support; generated sites are far below this
+
+    def __init__(self, spool_threshold: int):
+        self.fp = io.BytesIO()
+        self._spool_threshold = spool_threshold
+        self._central = []
+
+    def add(self, name: str, method: int, crc: int, size: int, chunks, compressed_size: int, mtime: float):
+        offset = self.fp.tell()
+        if max(offset, size, compressed_size) > self._LIMIT or len(self._central) >= 0xFFFF:
+            raise ValueError("Generated site is too large to package as a ZIP archive.")
+        raw_name = name.encode("utf-8")
+        flags = 0x800 if not name.isascii() else 0
+        dos_time, dos_date = self._dos_datetime(mtime)
+        self.fp.write(self._LOCAL.pack(b"PK\x03\x04", 20, flags, method, dos_time, dos_date,
+                                       crc, compressed_size, size, len(raw_name), 0))
+        self.fp.write(raw_name)
+        for chunk in chunks:
+            self.fp.write(chunk)
+        self._central.append((raw_name, flags, method, dos_time, dos_date, crc, compressed_size, size, offset))
+        self._maybe_spool()
+
+    def close(self):
+        start = self.fp.tell()
+        for raw_name, flags, method, dos_time, dos_date, crc, csize, size, offset in self._central:
+            self.fp.write(self._CENTRAL.pack(b"PK\x01\x02", (3 << 8) | 20, 20, flags, method, dos_time, dos_date,
+                                             crc, csize, size, len(raw_name), 0, 0, 0, 0,
+                                             0o100644 << 16, offset))
+            self.fp.write(raw_name)
+        end = self.fp.tell()
+        count = len(self._central)
+        self.fp.write(self._END.pack(b"PK\x05\x06", 0, 0, count, count, end - start, start, 0))
+        self.fp.seek(0)
+        return self.fp
+
+    def _maybe_spool(self):
+        if isinstance(self.fp, io.BytesIO) and self.fp.tell() > self._spool_threshold:
+            spooled = tempfile.TemporaryFile()
+            spooled.write(self.fp.getbuffer())
+            self.fp = spooled
+
+    @staticmethod
+    def _dos_datetime(mtime: float):
+        t = time.localtime(mtime)
+        year = min(max(t.tm_year, 1980), 2107)
+        return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class ZipPackager:
+    """Package a conversion work directory into a ZIP archive.
+
+    - Already-compressed payloads (images, fonts, ODT/EPUB containers, ...) are stored as-is.
+    - Text members above `parallel_threshold` bytes are deflated concurrently on a thread
+      pool (zlib releases the GIL); smaller ones are deflated inline.
+    - Members are streamed into the archive in directory order; the archive lives in
+      memory until it exceeds `spool_threshold` bytes and then moves to a temp file.
+    - An optional `transform` (with `applies(name)` and `transform_chunks(chunks)`)
+      rewrites matching members on the fly, e.g. to inject a theme into HTML pages.
+
+    Both package() and passthrough() return a binary file object positioned at 0
+    (BytesIO or a temporary file).
+    """
+
+    STORED_EXTS = {
+        ".png", ".jpg", ".jpeg", ".gif", ".webp", ".ico",
+        ".zip", ".gz", ".br", ".bz2", ".xz", ".7z",
+        ".odt", ".ods", ".odp", ".epub", ".docx", ".xlsx", ".pptx",
+        ".woff", ".woff2", ".pdf", ".mp3", ".mp4", ".ogg",
+    }
+
+    def __init__(self, spool_threshold: Optional[int] = None, parallel_threshold: int = 256 * 1024,
+                 workers: Optional[int] = None, level: int = 6, transform=None):
+        if spool_threshold is None:
+            try:
+                spool_threshold = int(float(os.environ.get("LATEXBOT_ZIP_SPOOL_MB", "16")) * 1024 * 1024)
+            except ValueError:
+                spool_threshold = 16 * 1024 * 1024
+        if workers is None:
+            try:
+                workers = int(os.environ.get("LATEXBOT_ZIP_WORKERS", "0"))
+            except ValueError:
+                workers = 0
+            workers = workers or min(4, os.cpu_count() or 1)
+        self._spool_threshold = spool_threshold
+        self._parallel_threshold = parallel_threshold
+        self._workers = max(1, workers)
+        self._level = level
+        # Optional streaming rewrite of selected members (see ThemeInjector)
+        self._transform = transform
+
+    def package(self, root: str, skip=None):
+        """Package every file under `root`, except members for which `skip(arcname)` is true."""
+        entries = []
+        for dirpath, dirnames, files in os.walk(root):
+            dirnames.sort()
+            for name in sorted(files):
+                full = os.path.join(dirpath, name)
+                # Put files at archive root
+                arcname = os.path.relpath(full, root).replace("\\", "/")
+                if skip is None or not skip(arcname):
+                    entries.append((arcname, full))
+
+        writer = _ZipWriter(self._spool_threshold)
+        with ThreadPoolExecutor(max_workers=self._workers) as pool:
+            # Bounded look-ahead keeps at most a few compressed members in memory
+            window = deque()
+            for arcname, full in entries:
+                future = None
+                if self._should_deflate(arcname) and os.path.getsize(full) >= self._parallel_threshold:
+                    future = pool.submit(self._deflate_file, full, arcname)
+                window.append((arcname, full, future))
+                while len(window) > self._workers * 2:
+                    self._write(writer, *window.popleft())
+            while window:
+                self._write(writer, *window.popleft())
+        return writer.close()
+
+    def passthrough(self, path: str):
+        """Return an already-packaged container (ODT/EPUB) as a stream, spooled like package()."""
+        if os.path.getsize(path) > self._spool_threshold:
+            stream = tempfile.TemporaryFile()
+        else:
+            stream = io.BytesIO()
+        with open(path, "rb") as f:
+            shutil.copyfileobj(f, stream, 1024 * 1024)
+        stream.seek(0)
+        return stream
+
+    def _should_deflate(self, arcname: str) -> bool:
+        return os.path.splitext(arcname)[1].lower() not in self.STORED_EXTS
+
+    def _chunks(self, path: str, arcname: str):
+        with open(path, "rb") as f:
+            chunks = iter(lambda: f.read(1024 * 1024), b"")
+            if self._transform is not None and self._transform.applies(arcname):
+                chunks = self._transform.transform_chunks(chunks)
+            yield from chunks
+
+    def _deflate_file(self, path: str, arcname: str):
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        crc, size, payload = 0, 0, []
+        for chunk in self._chunks(path, arcname):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            payload.append(compressor.compress(chunk))
+        payload.append(compressor.flush())
+        return crc, size, b"".join(payload)
+
+    def _write(self, writer: _ZipWriter, arcname: str, full: str, future):
+        mtime = os.path.getmtime(full)
+        payload = None
+        if future is not None:
+            crc, size, payload = future.result()
+        elif self._should_deflate(arcname):
+            crc, size, payload = self._deflate_file(full, arcname)
+        if payload is not None and len(payload) < size:
+            writer.add(arcname, zipfile.ZIP_DEFLATED, crc, size, [payload], len(payload), mtime)
+            return
+        if payload is None:
+            # Checksum first, then stream the bytes without holding the file in memory
+            crc, size = 0, 0
+            for chunk in self._chunks(full, arcname):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+        # Tiny or random files can grow when deflated; those are stored as well
+        writer.add(arcname, zipfile.ZIP_STORED, crc, size, self._chunks(full, arcname), size, mtime)
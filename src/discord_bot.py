@@ -1,6 +1,12 @@
 import os
 import asyncio
+import hashlib
+import io
+import json
 import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 import discord
@@ -14,7 +20,11 @@ from src.UserOptionsManager import UserOptionsManager
 from src.UsersManager import UsersManager
 from src.LoggingServer import LoggingServer
 from src.HtmlHost import HtmlHost
-from src.GitHubDeployer import GitHubDeployer
+from src.GitHubDeployer import DeployCancelled, GitHubDeployer
+from src.LatexSegmenter import LatexSegmenter
+from src.RateLimiter import RateLimiter
+from src.RenderClient import RenderClient
+from src.RenderLanes import RenderLanes
 
 
 class PreambleModal(discord.ui.Modal, title="Set Custom LaTeX Preamble"):
@@ -96,19 +106,20 @@ class OverleafModal(discord.ui.Modal, title="Overleaf-like LaTeX Editor"):
         self.logger = LoggingServer.getInstance()
 
     async def on_submit(self, interaction: discord.Interaction):
-        # Render like normal DM code handling: return PNG + PDF
+        notice = _cooldown_notice(interaction.user.id, interaction.guild_id, bot.rate_limiter.cost(str(self.code.value)))
+        if notice:
+            await interaction.response.send_message(notice, ephemeral=True)
+            return
+        # Render like normal DM code handling: return PNG, PDF on request
         await interaction.response.defer(thinking=True)
         try:
             user_id = interaction.user.id
             session_id = f"{interaction.id}_{user_id}"
-            image_stream, pdf_stream = bot.converter.convertExpression(str(self.code.value), user_id, session_id, returnPdf=True)
+            code = str(self.code.value)
+            image_stream, pdf_handle = await bot.lanes.run(
+                RenderLanes.lane_for(code), lambda: bot.converter.convertExpression(code, user_id, session_id, keepPdf=True))
             image_stream.seek(0)
-            pdf_stream.seek(0)
-            files = [
-                discord.File(fp=image_stream, filename="expression.png"),
-                discord.File(fp=pdf_stream, filename="expression.pdf")
-            ]
-            await interaction.followup.send(files=files)
+            await interaction.followup.send(file=discord.File(fp=image_stream, filename="expression.png"), view=PdfButtonView([pdf_handle]))
         except ValueError as err:
             await interaction.followup.send(f"Syntax error or processing issue:\n{err}", ephemeral=True)
         except Exception as err:
@@ -132,6 +143,10 @@ class Tex2HtmlModal(discord.ui.Modal, title="LaTeX → HTML Converter"):
         self.make4ht_args = make4ht_args or []
 
     async def on_submit(self, interaction: discord.Interaction):
+        notice = _cooldown_notice(interaction.user.id, interaction.guild_id, bot.rate_limiter.cost(html=True))
+        if notice:
+            await interaction.response.send_message(notice, ephemeral=True)
+            return
         await interaction.response.defer(thinking=True)
         try:
             user_id = interaction.user.id
@@ -141,36 +156,29 @@ class Tex2HtmlModal(discord.ui.Modal, title="LaTeX → HTML Converter"):
                 await interaction.followup.send("Converting to HTML using TeX4ht… this may take a few seconds ⏳", ephemeral=True)
             except Exception:
                 pass
-            # If HtmlHost is running, keep temp dir so we can host it
-            prev_keep = os.environ.get("LATEXBOT_KEEP_HTML_TEMP")
-            restore_keep = False
-            if getattr(bot, "html_host", None) and bot.html_host and bot.html_host.is_running():
-                os.environ["LATEXBOT_KEEP_HTML_TEMP"] = "1"
-                restore_keep = True
-            try:
-                zip_stream = bot.converter.convertToHtml(str(self.code.value), user_id, session_id, html_format=self.html_format, make4ht_args=self.make4ht_args)
-            finally:
-                # Restore env var if we changed it
-                if restore_keep:
-                    if prev_keep is None:
-                        try:
-                            del os.environ["LATEXBOT_KEEP_HTML_TEMP"]
-                        except KeyError:
-                            pass
-                    else:
-                        os.environ["LATEXBOT_KEEP_HTML_TEMP"] = prev_keep
+            fmt = bot.converter.resolveHtmlFormat(self.html_format)
+            # If hosting available, keep the ZIP as the preview (served without extraction);
+            # the converter links it from its result cache
+            hosting = fmt not in ("odt", "epub") and getattr(bot, "html_host", None) and bot.html_host and bot.html_host.is_running()
+            zip_path = os.path.join("build", f"html_{session_id}.zip") if hosting else None
+            code = str(self.code.value)
+            # TeX4ht runs in its own lane so it never holds up quick renders
+            zip_stream = await bot.lanes.run("html", lambda: bot.converter.convertToHtml(
+                code, user_id, session_id, html_format=self.html_format, make4ht_args=self.make4ht_args, preview_path=zip_path))
             zip_stream.seek(0)
-            file = discord.File(fp=zip_stream, filename="latex_website.zip")
-            # If hosting available, register directory and include preview link
+            if fmt in ("odt", "epub"):
+                # Documents are returned as-is; there is no website to preview
+                file = discord.File(fp=zip_stream, filename=f"document.{fmt}")
+                await interaction.followup.send(content=f"Here is your document as {fmt.upper()}.", file=file)
+                return
             preview = None
-            if getattr(bot, "html_host", None) and bot.html_host and bot.html_host.is_running():
+            if zip_path:
                 try:
-                    workdir = os.path.join("build", f"html_{session_id}")
-                    if os.path.isdir(workdir):
-                        preview = bot.html_host.register_dir(workdir)
+                    preview = bot.html_host.register_zip(zip_path, user_id=user_id)
                 except Exception as e:
                     self.logger.warn("Failed to register HTML preview: %s", e)
                     preview = None
+            file = discord.File(fp=zip_stream, filename="latex_website.zip")
             content_msg = "Here is your website as a ZIP (extract and open index.html)."
             if preview:
                 content_msg += f"\nPreview URL: {preview}"
@@ -182,6 +190,107 @@ class Tex2HtmlModal(discord.ui.Modal, title="LaTeX → HTML Converter"):
             await interaction.followup.send(f"Unexpected error during HTML conversion. {type(err).__name__}: {err}", ephemeral=True)
 
 
+# Discord accepts at most 10 attachments per message
+MAX_ATTACHMENTS = 10
+
+
+class PdfButtonView(discord.ui.View):
+    """"Get PDF" buttons for renders whose compiled PDF is kept for a while instead of uploaded."""
+
+    def __init__(self, handles: list, labels: Optional[list] = None):
+        try:
+            timeout = float(os.environ.get("LATEXBOT_PDF_RETAIN_SECONDS", "900"))
+        except ValueError:
+            timeout = 900.0
+        super().__init__(timeout=timeout)
+        for i, handle in enumerate(handles):
+            label = labels[i] if labels else "Get PDF"
+            button = discord.ui.Button(label=label, style=discord.ButtonStyle.secondary)
+            button.callback = self._sender(handle, "expression.pdf" if len(handles) == 1 else f"expression_{i + 1}.pdf")
+            self.add_item(button)
+
+    @staticmethod
+    def _sender(handle, filename: str):
+        async def send_pdf(interaction: discord.Interaction):
+            await interaction.response.defer(thinking=True)
+            try:
+                # Cropping runs only now, for the users who want the PDF
+                pdf_stream = await bot.lanes.run("interactive", bot.converter.retainedPdf, handle)
+            except ValueError as err:
+                await interaction.followup.send(str(err), ephemeral=True)
+                return
+            await interaction.followup.send(file=discord.File(fp=pdf_stream, filename=filename))
+        return send_pdf
+
+
+def _render_reply(sources: list, rendered: dict):
+    """Reply text, PNG files and "Get PDF" buttons for rendered sources."""
+    shown = sources[:MAX_ATTACHMENTS]
+    results = [rendered[s] for s in shown]
+    ok = [(i, r) for i, r in enumerate(results, start=1) if not isinstance(r, Exception)]
+    files = []
+    for i, (png, _) in ok:
+        stem = "expression" if len(shown) == 1 else f"expression_{i}"
+        files.append(discord.File(fp=io.BytesIO(png), filename=f"{stem}.png"))
+    view = None
+    if ok:
+        view = PdfButtonView([handle for _, (_, handle) in ok], None if len(shown) == 1 else [f"PDF {i}" for i, _ in ok])
+    if len(shown) == 1:
+        notes = [f"Syntax error or processing issue:\n{r}" for r in results if isinstance(r, Exception)]
+    else:
+        notes = [f"Formula {i}: {r}" for i, r in enumerate(results, start=1) if isinstance(r, Exception)]
+    if len(sources) > MAX_ATTACHMENTS:
+        notes.append(f"Only the first {MAX_ATTACHMENTS} formulas were rendered.")
+    return "\n".join(notes) or None, files, view
+
+
+def _parse_pages(spec: str):
+    """(first, last) for a /latex pages option: "3", "2-5", "4-" or "all"; last is None for "to the end"."""
+    spec = spec.strip().lower()
+    if spec == "all":
+        return 1, None
+    m = re.fullmatch(r"(\d+)\s*(?:(-)\s*(\d*))?", spec)
+    if not m or int(m.group(1)) < 1 or (m.group(3) and int(m.group(3)) < int(m.group(1))):
+        raise ValueError("Pages must look like 3, 2-5, 4- or all.")
+    first = int(m.group(1))
+    if not m.group(2):
+        return first, first
+    return first, int(m.group(3)) if m.group(3) else None
+
+
+def _pages_reply(pages: list, last: Optional[int], full_document: bool):
+    """Reply text, PNG files and "Get PDF" buttons for the (page, result) pairs of a page render."""
+    pages = pages[:MAX_ATTACHMENTS]
+    ok = [(page, r) for page, r in pages if not isinstance(r, Exception)]
+    files = [discord.File(fp=image, filename=f"page_{page}.png") for page, (image, _) in ok]
+    view = None
+    if ok and full_document:
+        # A full document's PDF is the whole document, whichever page it is asked from
+        view = PdfButtonView([ok[0][1][1]])
+    elif ok:
+        view = PdfButtonView([handle for _, (_, handle) in ok], [f"PDF p{page}" for page, _ in ok])
+    notes = [f"Page {page}: {r}" for page, r in pages if isinstance(r, Exception)]
+    if pages and len(pages) >= MAX_ATTACHMENTS and (last is None or last > pages[-1][0]):
+        notes.append(f"At most {MAX_ATTACHMENTS} pages are rendered per request; ask for later pages with the pages option.")
+    return "\n".join(notes) or None, files, view
+
+
+PREVIEW_NOTE = "Preview — full quality on the way…"
+
+
+def _cooldown_notice(user_id: int, guild_id: Optional[int], cost: float) -> Optional[str]:
+    """Take `cost` render tokens for the request; returns a cooldown reply when it is over its limits."""
+    wait = bot.rate_limiter.acquire(user_id, guild_id, cost)
+    if wait <= 0:
+        return None
+    return f"You're rendering faster than the rate limit allows. Try again in {int(wait) + 1}s ⏳"
+
+
+def _progressive_enabled() -> bool:
+    # Send a quick low-DPI PNG first, then swap in the full render (single formulas only)
+    return os.environ.get("LATEXBOT_PROGRESSIVE", "").lower() in ("1", "true", "yes", "on")
+
+
 class InLatexDiscordBot(commands.Bot):
     def __init__(self):
         intents = discord.Intents.default()
@@ -197,17 +306,82 @@ class InLatexDiscordBot(commands.Bot):
         self.uom = UserOptionsManager()
         self.um = UsersManager()
         self.pm = PreambleManager(self.rm)
-        self.converter = LatexConverter(self.pm, self.uom)
+        # LATEXBOT_RENDER_DAEMON=host:port renders on a shared RenderDaemon instead of in-process
+        self.converter = RenderClient.from_env() or LatexConverter(self.pm, self.uom)
+        # GitHub deploys run off the event loop; the pool size caps concurrent deploys
+        try:
+            deploy_concurrency = max(1, int(os.environ.get("GITHUB_DEPLOY_CONCURRENCY", "2")))
+        except ValueError:
+            deploy_concurrency = 2
+        self.deploy_executor = ThreadPoolExecutor(max_workers=deploy_concurrency, thread_name_prefix="deploy")
+        # Per-user, per-guild and global render budgets (LATEXBOT_RATE_*)
+        self.rate_limiter = RateLimiter()
+        # Render workers shared by all commands, with priority for quick math renders
+        self.lanes = RenderLanes()
+        # Chat renders we replied to, so edits of the source message can update the reply in place:
+        # message id -> {"reply", "sources", "rendered", "edits", "bytes"}; oldest entries are forgotten first
+        try:
+            self.edit_debounce = max(0, int(os.environ.get("DISCORD_EDIT_DEBOUNCE_MS", "1500"))) / 1000
+        except ValueError:
+            self.edit_debounce = 1.5
+        try:
+            self.max_tracked_replies = max(0, int(os.environ.get("DISCORD_EDIT_TRACK_MAX", "200")))
+        except ValueError:
+            self.max_tracked_replies = 200
+        try:
+            # Each tracked reply keeps its PNGs (up to MAX_ATTACHMENTS) so unchanged formulas are not recompiled
+            self.max_tracked_bytes = max(0, int(float(os.environ.get("DISCORD_EDIT_TRACK_MB", "32")) * 1024 * 1024))
+        except ValueError:
+            self.max_tracked_bytes = 32 * 1024 * 1024
+        self._rendered_replies: OrderedDict = OrderedDict()
+        self._edit_tasks: dict = {}
 
     async def setup_hook(self) -> None:
-        guild_id = os.environ.get("DISCORD_GUILD_ID")
-        # Always sync global so commands appear in DMs and all guilds (global propagation may take up to ~1 hour)
+        # Only push command trees that changed since the last successful sync (use /resync to force)
+        for line in await self.sync_commands():
+            self.logger.debug("%s", line)
+
+    def _command_tree_hash(self, guild: Optional[discord.abc.Snowflake] = None) -> str:
+        # Everything Discord stores for a command: names, options, choices, descriptions, permissions
+        payload = sorted((cmd.to_dict(self.tree) for cmd in self.tree.get_commands(guild=guild)),
+                         key=lambda c: (c.get("type", 1), c["name"]))
+        data = json.dumps({"application_id": self.application_id, "commands": payload}, sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _sync_state_path() -> str:
+        return os.environ.get("DISCORD_COMMAND_SYNC_STATE") or os.path.join("resources", "command_sync.json")
+
+    def _load_sync_state(self) -> dict:
         try:
-            global_cmds = await self.tree.sync()
-            self.logger.debug("Synced %d global application commands.", len(global_cmds))
-        except Exception as e:
-            self.logger.warn("Global command sync failed: %s", e)
-
+            with open(self._sync_state_path(), "r", encoding="utf-8") as f:
+                state = json.load(f)
+            return state if isinstance(state, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_sync_state(self, state: dict):
+        path = self._sync_state_path()
+        try:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f, indent=2, sort_keys=True)
+            os.replace(tmp, path)
+        except OSError as e:
+            self.logger.warn("Could not save command sync state: %s", e)
+
+    async def sync_commands(self, force: bool = False) -> list:
+        """Sync the global tree (and the DISCORD_GUILD_ID tree) when its hash differs from the last successful sync.
+
+        Returns one human-readable line per scope.
+        """
+        state = self._load_sync_state()
+        results = []
+        # Global sync so commands appear in DMs and all guilds (global propagation may take up to ~1 hour)
+        scopes = [("global", "Global", None)]
+        guild_id = os.environ.get("DISCORD_GUILD_ID")
         # If a guild is specified, also copy and sync to that guild for instant availability
         if guild_id and guild_id.isdigit():
             guild = discord.Object(id=int(guild_id))
@@ -217,17 +391,30 @@ class InLatexDiscordBot(commands.Bot):
             except Exception:
                 # It's fine if this fails due to duplication
                 pass
+            scopes.append((f"guild:{guild_id}", f"Guild {guild_id}", guild))
+        for key, label, guild in scopes:
+            digest = self._command_tree_hash(guild)
+            if not force and state.get(key) == digest:
+                results.append(f"{label} commands unchanged; sync skipped")
+                continue
             try:
-                guild_cmds = await self.tree.sync(guild=guild)
-                self.logger.debug("Synced %d guild application commands to guild %s.", len(guild_cmds), guild_id)
+                synced = await self.tree.sync(guild=guild)
             except Exception as e:
-                self.logger.warn("Guild command sync failed for guild %s: %s", guild_id, e)
+                results.append(f"{label} sync failed: {type(e).__name__}: {e}")
+                continue
+            state[key] = digest
+            self._save_sync_state(state)
+            results.append(f"{label} commands synced: {len(synced)}")
+        return results
 
     async def on_ready(self):
         self.logger.debug("Discord bot logged in as %s", self.user.name)
         # Ensure dirs/files exist
         os.makedirs("build", exist_ok=True)
         os.makedirs("log", exist_ok=True)
+        # on_ready fires again on reconnect; keep the running host (and its preview links)
+        if getattr(self, "html_host", None) and self.html_host.is_running():
+            return
         # Initialize and start HTML host if configured
         try:
             host = os.environ.get("HTML_HOST", "127.0.0.1")
@@ -240,17 +427,17 @@ class InLatexDiscordBot(commands.Bot):
             self.logger.warn("HtmlHost not started: %s", e)
             self.html_host = None
 
-    async def on_message(self, message: discord.Message):
-        # Ignore our own messages and other bots
-        if message.author.bot:
-            return
-        # Always allow DMs; for guild messages require message content intent env toggle
-        in_dm = message.guild is None
-        enable_guild_msgs = os.environ.get("DISCORD_ENABLE_MESSAGE_CONTENT", "").lower() in ("1", "true", "yes", "on")
+    @staticmethod
+    def _message_sources(content: str) -> list:
+        """The LaTeX sources a chat message asks to render, in message order (empty if none)."""
+        content_stripped = content.strip()
+        # Several formulas in one message are rendered in one batch
+        if "\\documentclass" not in content_stripped:
+            segments = LatexSegmenter.extract(content)
+            if len(segments) >= 2:
+                return segments
 
         # Heuristics to detect LaTeX content
-        content = message.content or ""
-        content_stripped = content.strip()
         has_latex_markers = (
             "\\documentclass" in content_stripped or
             content_stripped.startswith("$") or
@@ -284,47 +471,199 @@ class InLatexDiscordBot(commands.Bot):
                     content_for_render = "$" + content_stripped.strip("$") + "$"
                 has_latex_markers = True
 
-        # Only proceed if allowed and markers found
-        if (in_dm or enable_guild_msgs) and has_latex_markers and content_for_render:
+        return [content_for_render] if has_latex_markers and content_for_render else []
+
+    @staticmethod
+    def _sources_lane(sources: list) -> str:
+        lanes = {RenderLanes.lane_for(s) for s in sources[:MAX_ATTACHMENTS]}
+        return "document" if "document" in lanes else "interactive"
+
+    def _render_sources(self, sources: list, user_id: int, session_id: str, cached: dict) -> dict:
+        """Render the sources not already in `cached`; maps source -> (png bytes, PDF handle) or its ValueError."""
+        sources = sources[:MAX_ATTACHMENTS]
+        rendered = {s: cached[s] for s in sources if s in cached}
+        todo = [s for s in dict.fromkeys(sources) if s not in rendered]
+        if len(todo) == 1:
             try:
-                user_id = message.author.id
-                session_id = f"{message.id}_{user_id}"
-                wait_msg = None
-                async with message.channel.typing():
-                    # Let user know we're working
-                    try:
-                        wait_msg = await message.reply("Rendering your LaTeX… please wait ⏳")
-                    except Exception:
-                        pass
-                    image_stream, pdf_stream = self.converter.convertExpression(content_for_render, user_id, session_id, returnPdf=True)
-                    image_stream.seek(0)
-                    pdf_stream.seek(0)
-                    files = [
-                        discord.File(fp=image_stream, filename="expression.png"),
-                        discord.File(fp=pdf_stream, filename="expression.pdf")
-                    ]
-                # Send result and remove wait message if possible
-                await message.reply(files=files)
-                if wait_msg:
-                    try:
-                        await wait_msg.delete()
-                    except Exception:
-                        pass
+                results = [self.converter.convertExpression(todo[0], user_id, session_id, keepPdf=True)]
             except ValueError as err:
+                results = [err]
+        else:
+            results = self.converter.convertExpressions(todo, user_id, session_id, keepPdf=True) if todo else []
+        for source, result in zip(todo, results):
+            rendered[source] = result if isinstance(result, Exception) else (result[0].getvalue(), result[1])
+        return rendered
+
+    async def _render_preview_first(self, source: str, user_id: int, session_id: str, show_preview):
+        """Render `source` progressively; `show_preview(file)` gets the low-DPI PNG as soon as it exists.
+
+        Returns ({source: (png bytes, PDF handle) or its ValueError}, the message show_preview returned or None).
+        """
+        loop = asyncio.get_running_loop()
+        sent = []
+
+        def on_preview(stream):
+            # Called on the render thread; the upload runs on the loop while the full render continues
+            sent.append(asyncio.run_coroutine_threadsafe(show_preview(discord.File(fp=stream, filename="preview.png")), loop))
+
+        try:
+            image_stream, pdf_handle = await self.lanes.run(
+                RenderLanes.lane_for(source), lambda: self.converter.convertExpressionProgressive(source, user_id, session_id, on_preview, keepPdf=True))
+            rendered = {source: (image_stream.getvalue(), pdf_handle)}
+        except ValueError as err:
+            rendered = {source: err}
+        preview = None
+        if sent:
+            try:
+                preview = await asyncio.wrap_future(sent[0])
+            except Exception as err:
+                self.logger.debug("Preview not sent: %s", err)
+        return rendered, preview
+
+    def _remember_reply(self, message_id: int, reply: discord.Message, sources: list, rendered: dict):
+        if self.max_tracked_replies <= 0:
+            return
+        entry = self._rendered_replies.pop(message_id, None) or {"edits": 0}
+        entry.update(reply=reply, sources=sources, rendered=rendered,
+                     bytes=sum(len(r[0]) for r in rendered.values() if not isinstance(r, Exception)))
+        self._rendered_replies[message_id] = entry
+        tracked = sum(e["bytes"] for e in self._rendered_replies.values())
+        while self._rendered_replies and (len(self._rendered_replies) > self.max_tracked_replies
+                                          or tracked > self.max_tracked_bytes):
+            _, oldest = self._rendered_replies.popitem(last=False)
+            tracked -= oldest["bytes"]
+
+    async def _reply_with_render(self, message: discord.Message, sources: list):
+        user_id = message.author.id
+        session_id = f"{message.id}_{user_id}"
+        notice = _cooldown_notice(user_id, message.guild.id if message.guild else None,
+                                  sum(self.rate_limiter.cost(s) for s in sources[:MAX_ATTACHMENTS]))
+        if notice:
+            try:
+                await message.reply(notice, delete_after=30)
+            except Exception:
+                pass
+            return
+        wait_msg = None
+        try:
+            async with message.channel.typing():
+                # Let user know we're working
                 try:
-                    await message.reply(f"Syntax error or processing issue:\n{err}")
+                    wait_msg = await message.reply("Rendering your LaTeX… please wait ⏳")
                 except Exception:
                     pass
-            except Exception as err:
-                self.logger.warn("Unhandled exception in message render: %s", str(err))
+                preview = None
+                if _progressive_enabled() and len(sources) == 1:
+                    async def show_preview(file):
+                        if wait_msg:
+                            return await wait_msg.edit(content=PREVIEW_NOTE, attachments=[file])
+                        return await message.reply(content=PREVIEW_NOTE, file=file)
+                    rendered, preview = await self._render_preview_first(sources[0], user_id, session_id, show_preview)
+                else:
+                    # Off the event loop, so concurrent renders can share a compile
+                    rendered = await self.lanes.run(self._sources_lane(sources), self._render_sources, sources, user_id, session_id, {})
+            content, files, view = _render_reply(sources, rendered)
+            if preview:
+                # The preview message becomes the result
+                reply = await preview.edit(content=content, attachments=files, view=view)
+                # Message.edit returns a new object, so the wait message is recognised by id
+                if wait_msg and preview.id == wait_msg.id:
+                    wait_msg = None
+            else:
+                reply = await message.reply(content=content, files=files, view=view)
+            self._remember_reply(message.id, reply, sources, rendered)
+        except Exception as err:
+            self.logger.warn("Unhandled exception in message render: %s", str(err))
+            try:
+                await message.reply(f"Unexpected error during rendering. {type(err).__name__}: {err}")
+            except Exception:
+                pass
+        finally:
+            # Remove wait message if possible
+            if wait_msg:
                 try:
-                    await message.reply(f"Unexpected error during rendering. {type(err).__name__}: {err}")
+                    await wait_msg.delete()
                 except Exception:
                     pass
 
+    async def on_message(self, message: discord.Message):
+        # Ignore our own messages and other bots
+        if message.author.bot:
+            return
+        # Always allow DMs; for guild messages require message content intent env toggle
+        in_dm = message.guild is None
+        enable_guild_msgs = os.environ.get("DISCORD_ENABLE_MESSAGE_CONTENT", "").lower() in ("1", "true", "yes", "on")
+
+        # Only proceed if allowed and LaTeX found
+        if in_dm or enable_guild_msgs:
+            sources = self._message_sources(message.content or "")
+            if sources:
+                await self._reply_with_render(message, sources)
+
         # Keep command processing working
         await self.process_commands(message)
 
+    async def on_message_edit(self, before: discord.Message, after: discord.Message):
+        # Only messages we rendered are re-rendered; embed unfurls also fire edits without a content change
+        if after.author.bot or after.id not in self._rendered_replies or before.content == after.content:
+            return
+        # Debounce: a newer edit replaces the pending re-render, even one whose render already started
+        pending = self._edit_tasks.pop(after.id, None)
+        if pending:
+            pending.cancel()
+        self._edit_tasks[after.id] = asyncio.create_task(self._rerender_after_edit(after))
+
+    def _is_latest_edit(self, message_id: int) -> bool:
+        return self._edit_tasks.get(message_id) is asyncio.current_task()
+
+    async def _rerender_after_edit(self, message: discord.Message):
+        try:
+            await asyncio.sleep(self.edit_debounce)
+            await self._apply_edit(message)
+        finally:
+            # The task stays registered while it renders, so a newer edit can still cancel it
+            if self._is_latest_edit(message.id):
+                del self._edit_tasks[message.id]
+
+    async def _apply_edit(self, message: discord.Message):
+        entry = self._rendered_replies.get(message.id)
+        if not entry:
+            return
+        sources = self._message_sources(message.content or "")
+        if sources == entry["sources"]:
+            # Only the prose around the LaTeX changed
+            return
+        user_id = message.author.id
+        entry["edits"] += 1
+        try:
+            # Only formulas that need a new render count against the limits
+            fresh = [s for s in dict.fromkeys(sources[:MAX_ATTACHMENTS]) if s not in entry["rendered"]]
+            notice = _cooldown_notice(user_id, message.guild.id if message.guild else None,
+                                      sum(self.rate_limiter.cost(s) for s in fresh)) if fresh else None
+            if notice:
+                # Keep the old render; the next edit tries again
+                await entry["reply"].edit(content=notice)
+                return
+            if not sources:
+                await entry["reply"].edit(content="No LaTeX left to render in the edited message.", attachments=[], view=None)
+                entry.update(sources=[], rendered={}, bytes=0)
+                return
+            async with message.channel.typing():
+                # Unchanged formulas reuse their earlier render
+                rendered = await self.lanes.run(self._sources_lane(sources), self._render_sources, sources, user_id,
+                                                f"{message.id}_{user_id}_{entry['edits']}", entry["rendered"])
+            if not self._is_latest_edit(message.id):
+                # A newer edit took over while this render ran; never show stale formulas
+                return
+            content, files, view = _render_reply(sources, rendered)
+            await entry["reply"].edit(content=content, attachments=files, view=view)
+            self._remember_reply(message.id, entry["reply"], sources, rendered)
+        except discord.NotFound:
+            # Our reply was deleted; stop tracking the message
+            self._rendered_replies.pop(message.id, None)
+        except Exception as err:
+            self.logger.warn("Unhandled exception in edit re-render: %s", str(err))
+
 
 bot = InLatexDiscordBot()
 
@@ -354,21 +693,54 @@ async def start_cmd(interaction: discord.Interaction):
     await interaction.followup.send(guide, ephemeral=True)
 
 
-@bot.tree.command(name="latex", description="Render a LaTeX expression to image (and PDF)")
-@app_commands.describe(code="Your LaTeX expression. Use $...$ for math.")
-async def latex_cmd(interaction: discord.Interaction, code: str):
+@bot.tree.command(name="latex", description="Render a LaTeX expression to image (PDF on request)")
+@app_commands.describe(code="Your LaTeX expression. Use $...$ for math.",
+                       pages="Pages of a multi-page document to render: 3, 2-5, 4- or all (up to 10)")
+async def latex_cmd(interaction: discord.Interaction, code: str, pages: str | None = None):
+    page_range = None
+    if pages:
+        try:
+            page_range = _parse_pages(pages)
+        except ValueError as err:
+            await interaction.response.send_message(str(err), ephemeral=True)
+            return
+    notice = _cooldown_notice(interaction.user.id, interaction.guild_id, bot.rate_limiter.cost(code))
+    if notice:
+        await interaction.response.send_message(notice, ephemeral=True)
+        return
     await interaction.response.defer(thinking=True)
     user_id = interaction.user.id
     session_id = f"{interaction.id}_{user_id}"
     try:
-        image_stream, pdf_stream = bot.converter.convertExpression(code, user_id, session_id, returnPdf=True)
+        preview = None
+        if page_range:
+            first, last = page_range
+            rendered = await bot.lanes.run(
+                "document", lambda: bot.converter.convertPages(code, user_id, session_id, first, last, keepPdf=True))
+            content, files, view = _pages_reply(rendered, last, r"\documentclass" in code)
+            if not files:
+                await interaction.followup.send(content or "Nothing to render.", ephemeral=True)
+            else:
+                await interaction.followup.send(content=content, files=files, view=view)
+            return
+        if _progressive_enabled():
+            rendered, preview = await bot._render_preview_first(
+                code, user_id, session_id, lambda file: interaction.followup.send(content=PREVIEW_NOTE, file=file, wait=True))
+            if isinstance(rendered[code], Exception):
+                raise rendered[code]
+            png, pdf_handle = rendered[code]
+            image_stream = io.BytesIO(png)
+        else:
+            image_stream, pdf_handle = await bot.lanes.run(
+                RenderLanes.lane_for(code), lambda: bot.converter.convertExpression(code, user_id, session_id, keepPdf=True))
         image_stream.seek(0)
-        pdf_stream.seek(0)
-        files = [
-            discord.File(fp=image_stream, filename="expression.png"),
-            discord.File(fp=pdf_stream, filename="expression.pdf")
-        ]
-        await interaction.followup.send(files=files)
+        files = [discord.File(fp=image_stream, filename="expression.png")]
+        # The PDF is cropped and uploaded only if someone asks for it
+        view = PdfButtonView([pdf_handle])
+        if preview:
+            await preview.edit(content=None, attachments=files, view=view)
+        else:
+            await interaction.followup.send(files=files, view=view)
     except ValueError as err:
         await interaction.followup.send(f"Syntax error or processing issue:\n{err}", ephemeral=True)
     except Exception as err:
@@ -545,26 +917,7 @@ async def diagnose_cmd(interaction: discord.Interaction):
 @bot.tree.command(name="resync", description="Force re-sync of application commands (global + optional guild)")
 async def resync_cmd(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
-    results = []
-    # Global sync
-    try:
-        global_cmds = await bot.tree.sync()
-        results.append(f"Global commands synced: {len(global_cmds)}")
-    except Exception as e:
-        results.append(f"Global sync failed: {type(e).__name__}: {e}")
-    # Guild sync if configured
-    guild_id = os.environ.get("DISCORD_GUILD_ID")
-    if guild_id and guild_id.isdigit():
-        try:
-            guild = discord.Object(id=int(guild_id))
-            try:
-                bot.tree.copy_global_to(guild=guild)
-            except Exception:
-                pass
-            guild_cmds = await bot.tree.sync(guild=guild)
-            results.append(f"Guild {guild_id} commands synced: {len(guild_cmds)}")
-        except Exception as e:
-            results.append(f"Guild sync failed for {guild_id}: {type(e).__name__}: {e}")
+    results = await bot.sync_commands(force=True)
     await interaction.followup.send("\n".join(results), ephemeral=True)
 
 
@@ -579,11 +932,14 @@ async def htmlpreviews_cmd(interaction: discord.Interaction):
         await interaction.followup.send("HtmlHost is not running.", ephemeral=True)
         return
     items = host.list_previews()
+    stats = host.stats()
+    evictions = f"Evicted so far: {stats['evicted_ttl']} expired, {stats['evicted_quota']} over quota, {stats['evicted_user_limit']} over per-user limit."
     if not items:
-        await interaction.followup.send("No previews are currently hosted.", ephemeral=True)
+        await interaction.followup.send("No previews are currently hosted.\n" + evictions, ephemeral=True)
         return
     lines = [f"{token} -> {path}" for token, path in items.items()]
-    await interaction.followup.send("Hosted previews:\n" + "\n".join(lines), ephemeral=True)
+    summary = f"{stats['previews']} previews, {stats['bytes'] / (1024 * 1024):.1f} MB on disk. " + evictions
+    await interaction.followup.send("Hosted previews:\n" + "\n".join(lines) + "\n" + summary, ephemeral=True)
 
 
 @_guild_scope_if_set
@@ -616,6 +972,29 @@ async def htmlkillall_cmd(interaction: discord.Interaction):
 
 # --------------------- GitHub Deployment Command ---------------------
 
+class DeployCancelView(discord.ui.View):
+    def __init__(self, user_id: int, cancel_event: threading.Event):
+        super().__init__(timeout=None)
+        self.user_id = user_id
+        self.cancel_event = cancel_event
+
+    @discord.ui.button(label="Cancel deploy", style=discord.ButtonStyle.danger)
+    async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if interaction.user.id != self.user_id:
+            await interaction.response.send_message("Only the user who started this deploy can cancel it.", ephemeral=True)
+            return
+        self.cancel_event.set()
+        button.disabled = True
+        await interaction.response.edit_message(content="Cancelling deployment…", view=self)
+
+
+def _deploy_progress_text(progress: dict) -> str:
+    if not progress:
+        return "Deployment queued… ⏳"
+    return (f"Deploying… {progress['files']} files checked, {progress['uploaded']} uploaded"
+            f" ({progress['bytes_uploaded'] // 1024} KB), {progress['unchanged']} unchanged ⏳")
+
+
 @_guild_scope_if_set
 @bot.tree.command(name="deployhtml", description="Deploy last generated HTML site to GitHub Pages and return the URL")
 @app_commands.describe(slug="Optional folder name under the repo (defaults to timestamp)")
@@ -626,12 +1005,13 @@ async def deployhtml_cmd(interaction: discord.Interaction, slug: str | None = No
         user_id = interaction.user.id
         session_id = f"{interaction.id}_{user_id}"
         workdir = os.path.join("build", f"html_{session_id}")
-        # If that specific folder doesn't exist, fall back to newest html_* folder
+        # If that specific site doesn't exist, fall back to the newest html_* folder or ZIP
         if not os.path.isdir(workdir):
             import glob
-            candidates = sorted(glob.glob(os.path.join("build", "html_*")), key=os.path.getmtime, reverse=True)
+            candidates = [p for p in glob.glob(os.path.join("build", "html_*")) if os.path.isdir(p) or p.endswith(".zip")]
+            candidates.sort(key=os.path.getmtime, reverse=True)
             workdir = candidates[0] if candidates else None
-        if not workdir or not os.path.isdir(workdir):
+        if not workdir or not os.path.exists(workdir):
             await interaction.followup.send("No generated HTML site found. Run /tex2html first.", ephemeral=True)
             return
 
@@ -647,11 +1027,48 @@ async def deployhtml_cmd(interaction: discord.Interaction, slug: str | None = No
             return
 
         deployer = GitHubDeployer(token=token, owner=owner, repo=repo, branch=branch, dir_prefix=dir_prefix)
-        slug_used = deployer.deploy_dir(workdir, dest_slug=slug)
-        url = GitHubDeployer.compute_pages_url(owner, repo, pages_base, slug_used)
-        await interaction.followup.send(f"Deployed to GitHub: {url}", ephemeral=True)
     except Exception as e:
         await interaction.followup.send(f"GitHub deployment failed: {type(e).__name__}: {e}", ephemeral=True)
+        return
+
+    # Run the upload as a background job and keep the followup message updated
+    cancel_event = threading.Event()
+    progress: dict = {}
+    view = DeployCancelView(interaction.user.id, cancel_event)
+    status = await interaction.followup.send(_deploy_progress_text(progress), view=view, ephemeral=True, wait=True)
+    job = asyncio.get_running_loop().run_in_executor(
+        bot.deploy_executor,
+        lambda: deployer.deploy_dir(workdir, dest_slug=slug, progress=progress.update, cancel_event=cancel_event))
+    try:
+        interval = max(1.0, float(os.environ.get("GITHUB_DEPLOY_PROGRESS_INTERVAL", "3")))
+    except ValueError:
+        interval = 3.0
+    shown = None
+    while not job.done():
+        await asyncio.wait({job}, timeout=interval)
+        text = _deploy_progress_text(dict(progress))
+        if not job.done() and text != shown and not cancel_event.is_set():
+            try:
+                await status.edit(content=text, view=view)
+                shown = text
+            except discord.HTTPException:
+                pass  # progress edits are best effort
+    try:
+        slug_used = job.result()
+        url = GitHubDeployer.compute_pages_url(owner, repo, pages_base, slug_used)
+        report = deployer.last_report
+        summary = (f"\nUploaded {report['uploaded']} of {report['files']} files"
+                   f" ({report['unchanged']} unchanged, {report['deleted']} deleted,"
+                   f" {report['bytes_saved'] // 1024} KB not re-sent).") if report else ""
+        content = f"Deployed to GitHub: {url}{summary}"
+    except DeployCancelled:
+        content = "Deployment cancelled."
+    except Exception as e:
+        content = f"GitHub deployment failed: {type(e).__name__}: {e}"
+    try:
+        await status.edit(content=content, view=None)
+    except discord.HTTPException:
+        await interaction.followup.send(content, ephemeral=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,43 @@
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from src.CompiledPdfCache import CompiledPdfCache
+
+class CompiledPdfCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.sut = CompiledPdfCache(root=os.path.join(self.tmpdir, "cache"), max_bytes=1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def testPutAndGet(self):
+        key = CompiledPdfCache.key("\\begin{document}$x$\\end{document}", "pdflatex")
+        self.assertIsNone(self.sut.get_pdf(key))
+        pdf = os.path.join(self.tmpdir, "expression_file_s.pdf")
+        with open(pdf, "wb") as f:
+            f.write(b"%PDF-1.5")
+        self.sut.put_pdf(key, pdf, [[10, 20, 72, 36]])
+        path, pages = self.sut.get_pdf(key)
+        self.assertTrue(path.endswith(key + ".pdf"))
+        self.assertEqual(pages, [[10, 20, 72, 36]])
+        self.assertEqual(self.sut.stats(), {"pdf_hits": 1, "pdf_misses": 1})
+
+    def testMissingFileNotCached(self):
+        self.assertIsNone(self.sut.put_pdf("k", os.path.join(self.tmpdir, "missing.pdf"), [[0, 0, 1, 1]]))
+        self.assertIsNone(self.sut.get_pdf("k"))
+
+    def testDisabled(self):
+        sut = CompiledPdfCache(root=os.path.join(self.tmpdir, "off"), max_bytes=0)
+        pdf = os.path.join(self.tmpdir, "a.pdf")
+        with open(pdf, "wb") as f:
+            f.write(b"%PDF-1.5")
+        self.assertIsNone(sut.put_pdf("k", pdf, [[0, 0, 1, 1]]))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "off")))
+
+if __name__ == '__main__':
+    unittest.main()
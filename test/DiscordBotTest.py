@@ -0,0 +1,220 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
+
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from src.RenderLanes import RenderLanes
+from src import discord_bot
+from src.discord_bot import bot
+
+class DiscordBotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rendered = []
+        self.converter = Mock()
+        self.converter.convertExpression = Mock(side_effect=self._render)
+        self.converter.convertExpressions = Mock(side_effect=lambda sources, *args, **kwargs: [self._render(s) for s in sources])
+        self.patches = [
+            patch.object(bot, "converter", self.converter),
+            patch.object(bot, "lanes", RenderLanes(workers=4)),
+            patch.object(bot, "rate_limiter", Mock(acquire=Mock(return_value=0), cost=Mock(return_value=1))),
+            patch.object(bot, "edit_debounce", 0),
+            patch.object(bot, "max_tracked_replies", 200),
+            patch.object(bot, "max_tracked_bytes", 1024 * 1024),
+            patch.object(bot, "_rendered_replies", discord_bot.OrderedDict()),
+            patch.object(bot, "_edit_tasks", {}),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+
+    def _render(self, source, *args, **kwargs):
+        self.rendered.append(source)
+        return io.BytesIO(("png:" + source).encode()), ("session", 1)
+
+    @staticmethod
+    def _message(content, message_id=1):
+        message = MagicMock()
+        message.id = message_id
+        message.content = content
+        message.author.bot = False
+        message.author.id = 7
+        message.guild = None
+        message.channel.typing = MagicMock(return_value=AsyncMock())
+        return message
+
+    def _track(self, content, message_id=1):
+        reply = Mock(edit=AsyncMock())
+        sources = bot._message_sources(content)
+        bot._remember_reply(message_id, reply, sources, {s: (("png:" + s).encode(), ("session", 1)) for s in sources})
+        return reply
+
+    async def _edit(self, before, after):
+        await bot.on_message_edit(self._message(before), self._message(after))
+        await asyncio.gather(*bot._edit_tasks.values())
+
+    def testEditWithUnchangedSourcesIsNoOp(self):
+        reply = self._track("$a$ and $b$")
+        asyncio.run(self._edit("$a$ and $b$", "$a$, then $b$"))
+        reply.edit.assert_not_called()
+        self.assertEqual(self.rendered, [])
+        self.assertEqual(bot._edit_tasks, {})
+
+    def testEditRerendersOnlyChangedFormulas(self):
+        reply = self._track("$a$ and $b$")
+        asyncio.run(self._edit("$a$ and $b$", "$a$ and $c$"))
+        self.assertEqual(self.rendered, ["$c$"])
+        files = reply.edit.call_args.kwargs["attachments"]
+        self.assertEqual([f.fp.read() for f in files], [b"png:$a$", b"png:$c$"])
+        self.assertEqual(bot._rendered_replies[1]["sources"], ["$a$", "$c$"])
+        self.assertEqual(bot._rendered_replies[1]["edits"], 1)
+
+    def testTrackedRepliesAreBounded(self):
+        bot.max_tracked_replies = 2
+        replies = [self._track("$x%d$" % i, message_id=i) for i in range(3)]
+        self.assertEqual(list(bot._rendered_replies), [1, 2])
+        # Edits of a message we no longer track are ignored
+        asyncio.run(bot.on_message_edit(self._message("$x0$", 0), self._message("$y$", 0)))
+        self.assertEqual(bot._edit_tasks, {})
+        replies[0].edit.assert_not_called()
+
+    def testTrackedRepliesAreBoundedByBytes(self):
+        bot.max_tracked_bytes = 21
+        # Each tracked formula keeps a 7-byte PNG ("png:$x$")
+        self._track("$a$", message_id=1)
+        self._track("$b$ and $c$", message_id=2)
+        self.assertEqual(list(bot._rendered_replies), [1, 2])
+        self._track("$d$", message_id=3)
+        self.assertEqual(list(bot._rendered_replies), [2, 3])
+        self.assertEqual(sum(e["bytes"] for e in bot._rendered_replies.values()), 21)
+        # A reply larger than the whole budget is not tracked at all
+        self._track("$e$ $f$ $g$ $h$", message_id=4)
+        self.assertEqual(list(bot._rendered_replies), [])
+
+    def testNewerEditWins(self):
+        reply = self._track("$a$")
+        started = threading.Event()
+        release = threading.Event()
+
+        def render(source, *args, **kwargs):
+            if source == "$old$":
+                started.set()
+                release.wait(5)
+            return self._render(source)
+
+        self.converter.convertExpression.side_effect = render
+
+        async def scenario():
+            await bot.on_message_edit(self._message("$a$"), self._message("$old$"))
+            older = bot._edit_tasks[1]
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+            # The older render is running when the newer edit arrives
+            await bot.on_message_edit(self._message("$old$"), self._message("$new$"))
+            newer = bot._edit_tasks[1]
+            await newer
+            release.set()
+            await asyncio.gather(older, return_exceptions=True)
+            await asyncio.sleep(0.05)
+
+        asyncio.run(scenario())
+        self.assertEqual(reply.edit.call_count, 1)
+        self.assertEqual([f.fp.read() for f in reply.edit.call_args.kwargs["attachments"]], [b"png:$new$"])
+        self.assertEqual(bot._rendered_replies[1]["sources"], ["$new$"])
+        self.assertEqual(bot._edit_tasks, {})
+
+    def testStaleRenderIsDropped(self):
+        reply = self._track("$a$")
+
+        async def scenario():
+            await bot.on_message_edit(self._message("$a$"), self._message("$b$"))
+            # Another task took over, but this one was not cancelled in time
+            task = bot._edit_tasks[1]
+            bot._edit_tasks[1] = asyncio.ensure_future(asyncio.sleep(0))
+            await task
+
+        asyncio.run(scenario())
+        reply.edit.assert_not_called()
+        self.assertEqual(bot._rendered_replies[1]["sources"], ["$a$"])
+
+    def testProgressiveReplyIsNotDeleted(self):
+        def progressive(source, user_id, session_id, on_preview, **kwargs):
+            on_preview(io.BytesIO(b"preview"))
+            return io.BytesIO(("png:" + source).encode()), ("session", 1)
+
+        self.converter.convertExpressionProgressive = Mock(side_effect=progressive)
+        message = self._message("$a$")
+        wait_msg, shown, final = Mock(id=99), Mock(id=99), Mock(id=99)
+        wait_msg.edit = AsyncMock(return_value=shown)
+        wait_msg.delete = AsyncMock()
+        # Message.edit returns a new Message object for the same message
+        shown.edit = AsyncMock(return_value=final)
+        shown.delete = AsyncMock()
+        message.reply = AsyncMock(return_value=wait_msg)
+        with patch.dict(os.environ, {"LATEXBOT_PROGRESSIVE": "true"}):
+            asyncio.run(bot._reply_with_render(message, ["$a$"]))
+        self.assertEqual(wait_msg.edit.call_args.kwargs["content"], discord_bot.PREVIEW_NOTE)
+        self.assertEqual([f.fp.read() for f in shown.edit.call_args.kwargs["attachments"]], [b"png:$a$"])
+        wait_msg.delete.assert_not_called()
+        shown.delete.assert_not_called()
+        self.assertIs(bot._rendered_replies[message.id]["reply"], final)
+
+    def _sync(self, commands, force=False, fail=False):
+        tree = Mock()
+        tree.get_commands = Mock(return_value=[Mock(to_dict=Mock(return_value=c)) for c in commands])
+        tree.sync = AsyncMock(side_effect=RuntimeError("503") if fail else None, return_value=commands)
+        # Bot.tree is a read-only property over this attribute
+        with patch.object(bot, "_BotBase__tree", tree), \
+                patch.object(discord_bot.InLatexDiscordBot, "application_id", 42):
+            lines = asyncio.run(bot.sync_commands(force=force))
+        return tree.sync, lines
+
+    def testSyncCommandsOnlyWhenChanged(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        state_path = os.path.join(tmpdir, "sync.json")
+        commands = [{"name": "latex", "type": 1, "description": "Render"}, {"name": "setdpi", "type": 1, "description": "DPI"}]
+        with patch.dict(os.environ, {"DISCORD_COMMAND_SYNC_STATE": state_path, "DISCORD_GUILD_ID": ""}):
+            # A failed sync leaves no state behind, so the next start tries again
+            sync, lines = self._sync(commands, fail=True)
+            self.assertEqual(sync.await_count, 1)
+            self.assertIn("Global sync failed", lines[0])
+            self.assertFalse(os.path.exists(state_path))
+
+            sync, lines = self._sync(commands)
+            self.assertEqual(sync.await_count, 1)
+            self.assertEqual(lines, ["Global commands synced: 2"])
+            with open(state_path) as f:
+                digest = json.load(f)["global"]
+
+            # Command order does not matter
+            sync, lines = self._sync(list(reversed(commands)))
+            sync.assert_not_awaited()
+            self.assertEqual(lines, ["Global commands unchanged; sync skipped"])
+
+            sync, _ = self._sync(commands, force=True)
+            self.assertEqual(sync.await_count, 1)
+
+            changed = [dict(commands[0], description="Render LaTeX"), commands[1]]
+            sync, _ = self._sync(changed)
+            self.assertEqual(sync.await_count, 1)
+            with open(state_path) as f:
+                self.assertNotEqual(json.load(f)["global"], digest)
+
+            # A failure after a good sync keeps the last good hash
+            sync, _ = self._sync(commands, fail=True)
+            with open(state_path) as f:
+                self.assertNotEqual(json.load(f)["global"], digest)
+            sync, _ = self._sync(commands)
+            self.assertEqual(sync.await_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from src.FigureStore import FigureStore
+
+class FigureStoreTest(unittest.TestCase):
+
+    A = "document-" + "a" * 32 + ".svg"
+    B = "document-" + "b" * 32 + ".svg"
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.sut = FigureStore(root=os.path.join(self.tmpdir, "store"), max_bytes=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _workdir(self, name, figures):
+        workdir = os.path.join(self.tmpdir, name)
+        os.makedirs(workdir)
+        for fig in figures:
+            with open(os.path.join(workdir, fig), "w", encoding="utf-8") as f:
+                f.write("<svg>" + fig + "</svg>")
+        return workdir
+
+    def testSeedAndHarvest(self):
+        first = self._workdir("w1", [self.A, "plain.svg"])
+        self.sut.harvest(first, self.sut.seed(first, "k"), self.A, "k")
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmpdir, "store"))), [self.A])
+
+        second = self._workdir("w2", [])
+        seeded = self.sut.seed(second, "k")
+        self.assertEqual(seeded, {self.A})
+        # This run referenced only a new figure: the seeded one is not packaged
+        with open(os.path.join(second, self.B), "w", encoding="utf-8") as f:
+            f.write("<svg/>")
+        self.sut.harvest(second, seeded, "<img src='" + self.B + "'>", "k")
+        self.assertEqual(os.listdir(second), [self.B])
+        self.assertEqual(self.sut.stats(), {"figure_hits": 0, "figures_added": 2})
+
+        third = self._workdir("w3", [])
+        self.sut.harvest(third, self.sut.seed(third, "k"), self.A + self.B, "k")
+        self.assertEqual(sorted(os.listdir(third)), [self.A, self.B])
+        self.assertEqual(self.sut.stats()["figure_hits"], 2)
+
+    def testSeedsOnlyFiguresOfTheSameKey(self):
+        sut = FigureStore(root=os.path.join(self.tmpdir, "store"), max_bytes=10000, max_seed=2)
+        names = ["%032x.svg" % i for i in range(3)]
+        for i, name in enumerate(names):
+            workdir = self._workdir("run%d" % i, [name])
+            sut.harvest(workdir, sut.seed(workdir, "k"), name, "k")
+        # Another preamble never used these figures: nothing is linked
+        self.assertEqual(sut.seed(self._workdir("other", []), "other"), set())
+        # At most max_seed figures, the most recently used ones
+        self.assertEqual(sut.seed(self._workdir("same", []), "k"), set(names[1:]))
+        self.assertEqual(len(os.listdir(os.path.join(self.tmpdir, "store"))), 3)
+
+    def testEviction(self):
+        workdir = self._workdir("w", [])
+        for i in range(5):
+            name = "%032x.svg" % i
+            with open(os.path.join(workdir, name), "wb") as f:
+                f.write(b"x" * 300)
+            os.utime(os.path.join(workdir, name), (i, i))
+        self.sut.harvest(workdir, set(), "", "k")
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmpdir, "store"))), ["%032x.svg" % i for i in (2, 3, 4)])
+
+if __name__ == '__main__':
+    unittest.main()
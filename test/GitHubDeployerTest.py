@@ -0,0 +1,207 @@
+import unittest
+
+import base64
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.GitHubDeployer import DeployCancelled, GitHubDeployer
+
+class FakeGitHub:
+    """In-memory stand-in for the parts of the Git Data API the deployer uses."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.requests = []
+        self.connections = set()
+        root = self._store_tree({})
+        self.refs = {"heads/gh-pages": self._store({"tree": {"sha": root}, "parents": []})}
+
+    def _store(self, obj):
+        sha = hashlib.sha1(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()
+        self.objects[sha] = obj
+        return sha
+
+    def _store_tree(self, files):
+        # files: {path: blob sha} -> nested tree objects
+        children, entries = {}, []
+        for path, sha in sorted(files.items()):
+            head, _, rest = path.partition("/")
+            if rest:
+                children.setdefault(head, {})[rest] = sha
+            else:
+                entries.append({"path": head, "mode": "100644", "type": "blob", "sha": sha})
+        for name, sub in sorted(children.items()):
+            entries.append({"path": name, "mode": "040000", "type": "tree", "sha": self._store_tree(sub)})
+        return self._store({"tree": entries})
+
+    def files(self, tree_sha, prefix=""):
+        result = {}
+        for entry in self.objects[tree_sha]["tree"]:
+            path = prefix + entry["path"]
+            if entry["type"] == "tree":
+                result.update(self.files(entry["sha"], path + "/"))
+            else:
+                result[path] = entry["sha"]
+        return result
+
+    def head_files(self):
+        commit = self.objects[self.refs["heads/gh-pages"]]
+        return {p: base64.b64decode(self.objects[s]["content"]) for p, s in self.files(commit["tree"]["sha"]).items()}
+
+    def handle(self, method, path, body):
+        with self.lock:
+            self.requests.append((method, path))
+            m = re.match(r"/repos/o/r/git/(\w+)(?:/(.*))?$", path.split("?")[0])
+            kind, rest = m.group(1), m.group(2)
+            if kind == "ref" and method == "GET":
+                sha = self.refs.get(rest)
+                return (200, {"object": {"sha": sha}}) if sha else (404, {"message": "Not Found"})
+            if kind == "refs" and method == "PATCH":
+                self.refs[rest] = body["sha"]
+                return 200, {"object": {"sha": body["sha"]}}
+            if kind == "blobs" and method == "POST":
+                content = base64.b64decode(body["content"])
+                sha = hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+                self.objects[sha] = {"content": body["content"]}
+                return 201, {"sha": sha}
+            if kind == "trees" and method == "POST":
+                files = self.files(body["base_tree"]) if body.get("base_tree") else {}
+                for entry in body["tree"]:
+                    if entry["sha"] is None:
+                        files.pop(entry["path"], None)
+                    else:
+                        files[entry["path"]] = entry["sha"]
+                return 201, {"sha": self._store_tree(files)}
+            if kind == "trees" and method == "GET":
+                if rest not in self.objects:
+                    return 404, {"message": "Not Found"}
+                if "recursive" in path:
+                    return 200, {"tree": [{"path": p, "type": "blob", "sha": s} for p, s in self.files(rest).items()], "truncated": False}
+                return 200, self.objects[rest]
+            if kind == "commits" and method == "POST":
+                return 201, {"sha": self._store({"tree": {"sha": body["tree"]}, "parents": body["parents"]})}
+            if kind == "commits" and method == "GET":
+                return 200, self.objects[rest]
+            return 404, {"message": "Not Found"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _dispatch(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        self.server.fake.connections.add(self.client_address)
+        status, payload = self.server.fake.handle(self.command, self.path, body)
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PATCH = _dispatch
+
+    def log_message(self, *args):
+        pass
+
+
+class GitHubDeployerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeGitHub()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.fake = self.fake
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.site = tempfile.mkdtemp()
+        self.sut = GitHubDeployer("token", "o", "r", dir_prefix="sites", mode="gitdata",
+                                  api_url=f"http://127.0.0.1:{self.server.server_port}", workers=4)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.site, ignore_errors=True)
+
+    def _write(self, rel, data):
+        path = os.path.join(self.site, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def testDeploySingleCommit(self):
+        for i in range(20):
+            self._write(f"page{i}.html", b"<p>%d</p>" % i)
+        self._write("img/big.svg", b"x" * (2 * 1024 * 1024))
+        self.assertEqual(self.sut.deploy_dir(self.site, dest_slug="demo"), "demo")
+        files = self.fake.head_files()
+        self.assertEqual(len(files), 21)
+        self.assertEqual(files["sites/demo/page3.html"], b"<p>3</p>")
+        self.assertEqual(len(files["sites/demo/img/big.svg"]), 2 * 1024 * 1024)
+        methods = [m for m, p in self.fake.requests if "/git/blobs" not in p]
+        self.assertEqual(methods.count("POST"), 2)  # one tree, one commit
+        self.assertEqual(methods.count("PATCH"), 1)
+        # Keep-alive: far fewer connections than requests
+        self.assertLessEqual(len(self.fake.connections), 5)
+
+    def testDeltaDeploy(self):
+        self._write("index.html", b"<p>v1</p>")
+        self._write("fig.svg", b"<svg/>" * 1000)
+        self._write("old.css", b"p{}")
+        self.sut.deploy_dir(self.site, dest_slug="demo")
+        self.assertEqual(self.sut.last_report["uploaded"], 3)
+
+        # Nothing changed: no blobs and no commit
+        commits = len([p for m, p in self.fake.requests if p.endswith("/git/commits")])
+        self.sut.deploy_dir(self.site, dest_slug="demo")
+        self.assertEqual(self.sut.last_report["uploaded"], 0)
+        self.assertEqual(self.sut.last_report["bytes_saved"], 6000 + 12)
+        self.assertEqual(len([p for m, p in self.fake.requests if p.endswith("/git/commits")]), commits)
+
+        self._write("index.html", b"<p>v2</p>")
+        os.remove(os.path.join(self.site, "old.css"))
+        self.fake.requests.clear()
+        mirror = GitHubDeployer("token", "o", "r", dir_prefix="sites", mode="gitdata", api_url=self.sut._api_url, mirror_deletes=True)
+        mirror.deploy_dir(self.site, dest_slug="demo")
+        report = mirror.last_report
+        self.assertEqual((report["uploaded"], report["unchanged"], report["deleted"]), (1, 1, 1))
+        self.assertEqual(report["requests"], len(self.fake.requests))
+        self.assertEqual(len([p for m, p in self.fake.requests if p.endswith("/git/blobs")]), 1)
+        self.assertEqual(self.fake.head_files(), {"sites/demo/index.html": b"<p>v2</p>", "sites/demo/fig.svg": b"<svg/>" * 1000})
+
+    def testProgressAndCancel(self):
+        for i in range(30):
+            self._write(f"page{i}.html", b"<p>%d</p>" % i)
+        cancel = threading.Event()
+        seen = []
+
+        def progress(report):
+            seen.append(report["uploaded"])
+            if report["uploaded"] >= 5:
+                cancel.set()
+
+        with self.assertRaises(DeployCancelled):
+            self.sut.deploy_dir(self.site, dest_slug="demo", progress=progress, cancel_event=cancel)
+        self.assertEqual(seen[:5], [1, 2, 3, 4, 5])
+        # Nothing was committed
+        self.assertEqual(self.fake.head_files(), {})
+        self.assertNotIn("PATCH", [m for m, p in self.fake.requests])
+
+    def testGitBlobSha(self):
+        # `git hash-object` of "hello\n"
+        self.assertEqual(GitHubDeployer.git_blob_sha(b"hello\n"), "ce013625030ba8dba906f756967f9e9ca394464a")
+
+    def testMissingBranch(self):
+        self.fake.refs.clear()
+        self._write("index.html", b"x")
+        with self.assertRaises(RuntimeError):
+            self.sut.deploy_dir(self.site, dest_slug="demo")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+import unittest
+
+import asyncio
+import gzip
+import os
+import shutil
+import tempfile
+import zipfile
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from src.HtmlHost import HtmlHost, _ZipSite
+
+class HtmlHostTest(unittest.TestCase):
+
+    PAGE = b"<html><body>" + b"<p>Hello</p>" * 100 + b"</body></html>"
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.sut = self._host()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _host(self):
+        return HtmlHost(base_url="http://preview.test", registry_path=os.path.join(self.tmpdir, "html_previews.json"))
+
+    def _zip(self, name="site.zip"):
+        path = os.path.join(self.tmpdir, name)
+        with zipfile.ZipFile(path, "w") as zf:
+            zf.writestr("index.html", self.PAGE, compress_type=zipfile.ZIP_DEFLATED)
+            zf.writestr("sub/index.html", b"<p>sub</p>", compress_type=zipfile.ZIP_DEFLATED)
+            zf.writestr("figure.png", b"\x89PNG" + bytes(range(256)), compress_type=zipfile.ZIP_STORED)
+        return path
+
+    def _get(self, url, tail, headers=None):
+        token = url.rstrip("/").rsplit("/", 1)[1]
+        request = make_mocked_request("GET", f"/site/{token}/{tail}", headers=headers or {}, match_info={"token": token, "tail": tail})
+
+        async def serve():
+            return await self.sut._serve(request, tail or "index.html")
+        return asyncio.run(serve())
+
+    def testZipMemberLookup(self):
+        site = _ZipSite(self._zip())
+        self.assertEqual(site.resolve(""), "index.html")
+        self.assertEqual(site.resolve("index.html"), "index.html")
+        self.assertEqual(site.resolve("sub"), "sub/index.html")
+        self.assertEqual(site.resolve("sub/"), "sub/index.html")
+        self.assertEqual(site.resolve("sub/./index.html"), "sub/index.html")
+        self.assertIsNone(site.resolve("missing.html"))
+
+    def testZipRejectsTraversal(self):
+        path = self._zip()
+        with zipfile.ZipFile(path, "a") as zf:
+            zf.writestr("../evil.html", b"evil")
+        site = _ZipSite(path)
+        for tail in ("..", "../evil.html", "sub/../../evil.html", "/index.html", "/etc/passwd", "C:/index.html", "..\\evil.html"):
+            self.assertIsNone(site.resolve(tail), tail)
+
+    def testZipStoredAndDeflatedMembers(self):
+        site = _ZipSite(self._zip())
+        self.assertEqual(site.read("index.html"), self.PAGE)
+        self.assertEqual(site.read("figure.png"), b"\x89PNG" + bytes(range(256)))
+        # The archive's own deflate stream becomes a valid gzip body
+        self.assertEqual(gzip.decompress(site.read_gzip("index.html")), self.PAGE)
+        self.assertIsNone(site.read_gzip("figure.png"))
+
+    def testServeZip(self):
+        url = self.sut.register_zip(self._zip(), user_id=1)
+        self.assertTrue(url.startswith("http://preview.test/site/"))
+        response = self._get(url, "")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body, self.PAGE)
+        self.assertEqual(response.content_type, "text/html")
+        self.assertEqual(self._get(url, "figure.png").content_type, "image/png")
+        self.assertEqual(self._get(url, "sub/").body, b"<p>sub</p>")
+        for tail in ("missing.html", "../site.zip"):
+            with self.assertRaises(web.HTTPNotFound):
+                self._get(url, tail)
+
+    def _token(self, url):
+        return url.rstrip("/").rsplit("/", 1)[1]
+
+    def testTtlExpiry(self):
+        path = self._zip()
+        token = self._token(self.sut.register_zip(path, user_id=1, ttl=60))
+        now = self.sut._meta[token]["created"]
+        self.assertEqual(self.sut.sweep(now=now + 30), 0)
+        self.assertEqual(self.sut.sweep(now=now + 61), 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.sut.stats(), {"previews": 0, "bytes": 0, "evicted_ttl": 1, "evicted_quota": 0, "evicted_user_limit": 0})
+        with self.assertRaises(web.HTTPGone):
+            self.sut._get_valid_dir(token)
+        with self.assertRaises(web.HTTPNotFound):
+            self.sut._get_valid_dir("0" * 32)
+        # Tombstones are persisted with the registry, so the link stays 410 after a restart
+        with self.assertRaises(web.HTTPGone):
+            self._host()._get_valid_dir(token)
+
+    def testQuotaEvictsLeastRecentlyAccessed(self):
+        tokens = [self._token(self.sut.register_zip(self._zip(f"site{i}.zip"))) for i in range(3)]
+        size = self.sut._meta[tokens[0]]["size"]
+        for i, token in enumerate(tokens):
+            self.sut._meta[token]["last_access"] = 1000 + i
+        # The oldest site was opened most recently
+        self.sut._get_valid_dir(tokens[0])
+        self.sut._max_bytes = 2 * size
+        self.assertEqual(self.sut.sweep(), 1)
+        self.assertEqual(sorted(self.sut.list_previews()), sorted([tokens[0], tokens[2]]))
+        self.assertEqual(self.sut.stats()["bytes"], 2 * size)
+        self.assertEqual(self.sut.stats()["evicted_quota"], 1)
+        with self.assertRaises(web.HTTPGone):
+            self.sut._get_valid_dir(tokens[1])
+
+    def testPerUserCap(self):
+        self.sut._max_per_user = 2
+        first = self._token(self.sut.register_zip(self._zip("a.zip"), user_id=1))
+        self.sut._meta[first]["last_access"] -= 10
+        self.sut.register_zip(self._zip("b.zip"), user_id=1)
+        self.sut.register_zip(self._zip("c.zip"), user_id=2)
+        self.sut.register_zip(self._zip("d.zip"), user_id=1)
+        self.assertNotIn(first, self.sut.list_previews())
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "a.zip")))
+        self.assertEqual(self.sut.stats()["previews"], 3)
+        self.assertEqual(self.sut.stats()["evicted_user_limit"], 1)
+
+    def _site(self):
+        site = os.path.join(self.tmpdir, "site")
+        os.makedirs(site)
+        with open(os.path.join(site, "index.html"), "wb") as f:
+            f.write(self.PAGE)
+        with open(os.path.join(site, "fig-" + "ab" * 16 + ".svg"), "wb") as f:
+            f.write(b"<svg>" + b"<path/>" * 100 + b"</svg>")
+        return site
+
+    def testDirectoryPrecompressedOffTheLoop(self):
+        site = self._site()
+
+        async def scenario():
+            url = self.sut.register_dir(site)
+            token = self._token(url)
+            # Registration returned before the siblings were written
+            self.assertIn(token, self.sut._pending_assets)
+            self.assertNotIn(token, self.sut._assets)
+            request = make_mocked_request("GET", f"/site/{token}/", headers={"Accept-Encoding": "gzip, deflate"},
+                                          match_info={"token": token})
+            response = await self.sut._serve(request, "index.html")
+            self.assertIn(token, self.sut._assets)
+            return response
+
+        response = asyncio.run(scenario())
+        self.assertTrue(os.path.exists(os.path.join(site, "index.html.gz")))
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.body), self.PAGE)
+        # Registered outside a loop (scripts, tests): precompressed right away
+        host = self._host()
+        other = self._token(host.register_dir(site))
+        self.assertIn(other, host._assets)
+        self.assertNotIn(other, host._pending_assets)
+
+    def testDirectoryCacheHeaders(self):
+        url = self.sut.register_dir(self._site())
+        plain = self._get(url, "index.html")
+        self.assertEqual(plain.body, self.PAGE)
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(plain.headers["Cache-Control"], "no-cache")
+        self.assertEqual(plain.headers["Vary"], "Accept-Encoding")
+        packed = self._get(url, "index.html", {"Accept-Encoding": "br;q=0.5, gzip"})
+        self.assertEqual(packed.headers["Content-Encoding"], "gzip")
+        # Each encoding has its own strong ETag
+        self.assertEqual(packed.headers["ETag"], plain.headers["ETag"][:-1] + '-gzip"')
+        self.assertNotIn("Content-Encoding", self._get(url, "index.html", {"Accept-Encoding": "gzip;q=0"}).headers)
+        for etag in (plain.headers["ETag"], "W/" + plain.headers["ETag"], '"other", ' + plain.headers["ETag"], "*"):
+            self.assertEqual(self._get(url, "index.html", {"If-None-Match": etag}).status, 304)
+        self.assertEqual(self._get(url, "index.html", {"If-None-Match": packed.headers["ETag"]}).status, 200)
+        not_modified = self._get(url, "index.html", {"If-None-Match": packed.headers["ETag"], "Accept-Encoding": "gzip"})
+        self.assertEqual(not_modified.status, 304)
+        self.assertNotIn("Content-Encoding", not_modified.headers)
+        # Content-hashed dvisvgm figures never change under their name
+        figure = self._get(url, "fig-" + "ab" * 16 + ".svg")
+        self.assertEqual(figure.headers["Cache-Control"], "public, max-age=31536000, immutable")
+
+    def testZipCacheHeaders(self):
+        url = self.sut.register_zip(self._zip())
+        packed = self._get(url, "index.html", {"Accept-Encoding": "gzip"})
+        self.assertEqual(packed.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(packed.body), self.PAGE)
+        self.assertEqual(self._get(url, "index.html", {"If-None-Match": packed.headers["ETag"], "Accept-Encoding": "gzip"}).status, 304)
+        # Stored members are never gzip-encoded
+        self.assertNotIn("Content-Encoding", self._get(url, "figure.png", {"Accept-Encoding": "gzip"}).headers)
+
+    def testRebuildSkipsSiteBeingRegistered(self):
+        # No registry file yet: the first registration rebuilds it from build/html_*
+        earlier = self._zip("html_old.zip")
+        with open(os.path.join(self.tmpdir, "html_old.token"), "w") as f:
+            f.write("a" * 32)
+        token = self._token(self.sut.register_zip(self._zip("html_new.zip"), user_id=7))
+        self.assertEqual(self.sut.stats()["previews"], 2)
+        self.assertEqual(self.sut.list_previews(), {"a" * 32: os.path.abspath(earlier), token: os.path.join(self.tmpdir, "html_new.zip")})
+        self.assertEqual(self.sut._meta[token]["user_id"], 7)
+        # A restarted host loads the same two entries
+        self.assertEqual(self._host().list_previews(), self.sut.list_previews())
+
+    def testStartLoadsRegistry(self):
+        self._zip("html_old.zip")
+
+        async def scenario():
+            self.sut._port = 0
+            self.sut._host = "127.0.0.1"
+            await self.sut.start()
+            try:
+                self.assertEqual(self.sut.stats()["previews"], 1)
+            finally:
+                await self.sut.stop()
+
+        asyncio.run(scenario())
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, "html_previews.json")))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+import io
+import os
+import shutil
+import tempfile
+
+from src.HtmlResultCache import HtmlResultCache
+
+class HtmlResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.sut = HtmlResultCache(root=self.tmpdir, max_bytes=250)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def testKey(self):
+        self.assertEqual(HtmlResultCache.key("doc", "html5", []), HtmlResultCache.key("doc", "html5", []))
+        self.assertNotEqual(HtmlResultCache.key("ab", "c"), HtmlResultCache.key("a", "bc"))
+        self.assertNotEqual(HtmlResultCache.key("doc", "html5", []), HtmlResultCache.key("doc", "html5", ["-m", "draft"]))
+
+    def testPutAndGet(self):
+        self.assertIsNone(self.sut.get("k1"))
+        stream = io.BytesIO(b"x" * 100)
+        path = self.sut.put("k1", stream, fmt="html5")
+        self.assertEqual(stream.tell(), 0)
+        self.assertEqual(self.sut.get("k1"), path)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"x" * 100)
+        self.assertEqual(self.sut.stats(), {"html_hits": 1, "html_misses": 1})
+
+    def testEvictsLeastRecentlyUsed(self):
+        for key in ("a", "b"):
+            self.sut.put(key, io.BytesIO(b"x" * 100))
+        self.sut.get("b")
+        old = os.path.getmtime(os.path.join(self.tmpdir, "b.json")) - 100
+        os.utime(os.path.join(self.tmpdir, "b.json"), (old, old))
+        self.sut.get("a")
+        self.sut.put("c", io.BytesIO(b"x" * 100), ext="epub")
+        self.assertIsNone(self.sut.get("b"))
+        self.assertIsNotNone(self.sut.get("a"))
+        self.assertTrue(self.sut.get("c").endswith("c.epub"))
+
+    def testHitDoesNotTouchArchive(self):
+        path = self.sut.put("k", io.BytesIO(b"zip"))
+        # The archive may be hard-linked as a preview whose mtime means something else
+        os.utime(path, (1000, 1000))
+        self.assertEqual(self.sut.get("k"), path)
+        self.assertEqual(os.path.getmtime(path), 1000)
+
+    def testMaterialize(self):
+        path = self.sut.put("k", io.BytesIO(b"zip"))
+        dest = os.path.join(self.tmpdir, "preview.zip")
+        HtmlResultCache.materialize(path, dest)
+        os.remove(path)
+        with open(dest, "rb") as f:
+            self.assertEqual(f.read(), b"zip")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,23 @@
 import unittest
 from unittest.mock import Mock
 
+import glob
+import time
+import threading
+import io
 import os
+import shutil
+import tempfile
+import zipfile
 from datetime import datetime as dt
 from subprocess import check_output, CalledProcessError, STDOUT
 from unittest.mock import patch
 
 from src.LatexConverter import LatexConverter
+from src.HtmlResultCache import HtmlResultCache
+from src.FigureStore import FigureStore
+from src.CompiledPdfCache import CompiledPdfCache
+from src.ThemeInjector import ThemeInjector
 from src.PreambleManager import PreambleManager
 from src.ResourceManager import ResourceManager
 from src.UserOptionsManager import UserOptionsManager
@@ -17,6 +28,13 @@ class LatexConverterTest(unittest.TestCase):
         userOptionsManager = Mock()
         userOptionsManager.getDpiOption = Mock(return_value = 720)
         self.sut = LatexConverter(PreambleManager(ResourceManager()), userOptionsManager)
+        self.cachedir = tempfile.mkdtemp()
+        self.sut._htmlCache = HtmlResultCache(root=self.cachedir)
+        self.sut._figureStore = FigureStore(root=os.path.join(self.cachedir, "svg"))
+        self.sut._pdfCache = CompiledPdfCache(root=os.path.join(self.cachedir, "pdf"))
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir, ignore_errors=True)
 
     def testExtractBoundingBox(self):
         self.sut.logger.debug("Extracting bbox")
@@ -94,6 +112,192 @@ class LatexConverterTest(unittest.TestCase):
             correctBinaryData = f.read()
         self.assertAlmostEqual(len(pdfBinaryData), len(correctBinaryData), delta=50)
 
+    def testConvertExpressionsBatched(self):
+        with patch.object(self.sut, '_compile') as compile_, \
+                patch.object(self.sut, '_page_bounds', return_value=[[0, 0, 72, 36], [0, 0, 0, 0]]), \
+                patch.object(self.sut, '_render_page', side_effect=lambda dpi, sid, bbox, pdf, full, page, keep: "page%d" % page):
+            results = self.sut.convertExpressions(["$a$", "$ $"], 115, "batch")
+        self.assertEqual(compile_.call_count, 1)
+        self.assertEqual(results[0], "page1")
+        self.assertIsInstance(results[1], ValueError)
+
+    def testConvertExpressionsFallback(self):
+        with patch.object(self.sut, '_convert_pages', side_effect=ValueError("! Undefined control sequence.")), \
+                patch.object(self.sut, '_convert_single', side_effect=["img0", ValueError("bad"), "img2"]) as single:
+            results = self.sut.convertExpressions(["$a$", r"$\bad$", "$c$"], 115, "batch")
+        self.assertEqual(results[0], "img0")
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[2], "img2")
+        self.assertEqual(single.call_args_list[2].args[2], "batch_2")
+
+    def testRenderBatch(self):
+        with patch.object(self.sut, '_compile'), \
+                patch.object(self.sut, '_page_bounds', return_value=[[0, 0, 72, 36], [0, 0, 72, 36]]), \
+                patch.object(self.sut, '_render_page', side_effect=lambda dpi, sid, bbox, pdf, full, page, keep: (page, pdf)):
+            results = self.sut._render_batch([("$a$", 115, True, False), ("$b$", 115, False, False)], "mb")
+        self.assertEqual(results, [(1, True), (2, False)])
+
+    def testBatchIsolatesExpressions(self):
+        redefining = r"\renewcommand{\alpha}{\beta}\setcounter{equation}{5}$\alpha$"
+        with patch.object(self.sut, '_compile_pages', return_value=[[0, 0, 72, 36]] * 2) as compile_pages, \
+                patch.object(self.sut, '_render_page', side_effect=lambda dpi, sid, bbox, pdf, full, page, keep: page):
+            self.assertEqual(self.sut.convertExpressions([redefining, r"\begin{equation}\alpha\end{equation}"], 115, "iso"), [1, 2])
+        body = compile_pages.call_args.args[0].split("\\begin{document}", 1)[1]
+        slots = body.split("\\clearpage")
+        self.assertEqual(len(slots), 2)
+        # The redefinition ends with its own group; the next expression restarts the counters
+        self.assertIn(redefining + "\n\\par\\endgroup", slots[0])
+        self.assertTrue(slots[1].strip().startswith("\\begingroup"))
+        self.assertLess(slots[1].index("\\setcounter{equation}{0}"), slots[1].index("\\begin{equation}"))
+
+    def testBatchPageMismatchFallsBack(self):
+        # Two pages for three expressions: one spilled over a page break, another ended the document
+        with patch.object(self.sut, '_compile_pages', return_value=[[0, 0, 72, 36]] * 2), \
+                patch.object(self.sut, '_convert_single', side_effect=["img0", "img1", "img2"]) as single:
+            results = self.sut._render_batch([("$a$", 115, False, False), ("$b$", 115, False, False), ("$c$", 115, False, False)], "mm")
+        self.assertEqual(results, ["img0", "img1", "img2"])
+        self.assertEqual(single.call_count, 3)
+
+    def testMicrobatchKeyedByUser(self):
+        self.sut._batcher = Mock()
+        self.sut._batcher.submit = Mock(return_value="img")
+        self.sut.convertExpression("$a$", 1, "u1")
+        self.sut.convertExpression("$a$", 2, "u2")
+        keys = [call.args[0] for call in self.sut._batcher.submit.call_args_list]
+        self.assertEqual(len(keys), 2)
+        self.assertNotEqual(keys[0], keys[1])
+
+    def testConvertExpressionProgressive(self):
+        previews = []
+        with patch.object(self.sut, '_compile') as compile_, \
+                patch.object(self.sut, '_page_bounds', return_value=[[0, 0, 72, 36]]), \
+                patch.object(self.sut, '_render_page', side_effect=lambda dpi, sid, bbox, pdf, full, keepPdf=False: (dpi, pdf)):
+            result = self.sut.convertExpressionProgressive("$a$", 115, "prog", previews.append, previewDpi=100, returnPdf=True)
+            # Already at or below the preview DPI: no preview
+            self.sut.convertExpressionProgressive("$a$", 115, "prog", previews.append, previewDpi=720)
+        self.assertEqual(compile_.call_count, 2)
+        self.assertEqual(previews, [(100, False)])
+        self.assertEqual(result, (720, True))
+
+    def testRetainedPdf(self):
+        self.sut.RETAINED_PDF_DIR = os.path.join(self.cachedir, "pdfs")
+        os.makedirs("build", exist_ok=True)
+        with open("build/expression_file_keep.pdf", "wb") as f:
+            f.write(b"%PDF-1.5 batch")
+
+        def crop(sessionId, page):
+            with open("build/expression_file_cropped_%s.pdf" % sessionId, "wb") as f:
+                f.write(b"page%d" % page)
+
+        os.utime("build/expression_file_keep.pdf", (1000, 1000))
+        handle = self.sut._retain_pdf("keep", 2, False)
+        # A copy: the build PDF may be a link into the compiled PDF cache, whose mtime is its LRU time
+        self.assertEqual(os.path.getmtime("build/expression_file_keep.pdf"), 1000)
+        self.sut._cleanup("keep")
+        with patch.object(self.sut, 'cropPdf', side_effect=crop):
+            self.assertEqual(self.sut.retainedPdf(handle).read(), b"page2")
+        self.assertEqual(glob.glob("build/*_keep_pdf2.*"), [])
+
+        with open("build/expression_file_doc.pdf", "wb") as f:
+            f.write(b"%PDF-1.5 doc")
+        handle = self.sut._retain_pdf("doc", 1, True)
+        self.sut._cleanup("doc")
+        # Full documents come back uncropped
+        self.assertEqual(self.sut.retainedPdf(handle).read(), b"%PDF-1.5 doc")
+        with patch.dict(os.environ, {"LATEXBOT_PDF_RETAIN_SECONDS": "0"}):
+            with self.assertRaises(ValueError):
+                self.sut.retainedPdf(handle)
+        self.assertEqual(os.listdir(self.sut.RETAINED_PDF_DIR), [])
+
+    def testCompiledPdfReused(self):
+        os.makedirs("build", exist_ok=True)
+        def compile_(fileString, sessionId):
+            with open("build/expression_file_%s.pdf" % sessionId, "wb") as f:
+                f.write(b"%PDF-1.5 " + fileString.encode())
+
+        def render(dpi, sessionId, bbox, returnPdf, full, page=1, keepPdf=False):
+            with open("build/expression_file_%s.pdf" % sessionId, "rb") as f:
+                return dpi, f.read()
+
+        with patch.object(self.sut, '_compile', side_effect=compile_) as compile, \
+                patch.object(self.sut, '_page_bounds', return_value=[[0, 0, 72, 36]]) as bounds, \
+                patch.object(self.sut, '_render_page', side_effect=render):
+            first = self.sut.convertExpression("$a$", 115, "pdf1")
+            self.sut._userOptionsManager.getDpiOption.return_value = 300
+            second = self.sut.convertExpression("$a$", 115, "pdf2")
+            self.sut.convertExpression("$b$", 115, "pdf3")
+        # Only the new source went through TeX and the bbox pass
+        self.assertEqual(compile.call_count, 2)
+        self.assertEqual(bounds.call_count, 2)
+        self.assertEqual(first[0], 720)
+        self.assertEqual(second, (300, first[1]))
+        self.assertEqual(self.sut.cacheStats()["pdf_hits"], 1)
+        self.assertEqual(glob.glob("build/*_pdf2.*"), [])
+
+    def testConvertPages(self):
+        os.makedirs("build", exist_ok=True)
+        running = []
+        peak = []
+
+        def compile_(fileString, sessionId):
+            with open("build/expression_file_%s.pdf" % sessionId, "wb") as f:
+                f.write(b"%PDF-1.5")
+
+        def png(dpi, sessionId, bbox, page=1, imageId=None):
+            running.append(page)
+            peak.append(len(running))
+            time.sleep(0.05)
+            with open("build/expression_%s.png" % imageId, "wb") as f:
+                f.write(b"png%d" % page)
+            running.remove(page)
+
+        bounds = [[0, 0, 72, 36], [0, 0, 0, 0]] + [[0, 0, 72, 36]] * 12
+        with patch.dict(os.environ, {"LATEXBOT_PAGE_WORKERS": "4"}), \
+                patch.object(self.sut, '_compile', side_effect=compile_), \
+                patch.object(self.sut, '_page_bounds', return_value=bounds), \
+                patch.object(self.sut, 'convertPdfToPng', side_effect=png):
+            pages = self.sut.convertPages(r"\documentclass{article}", 115, "pages")
+            self.assertEqual([page for page, _ in pages], list(range(1, 11)))
+            self.assertEqual(pages[0][1].read(), b"png1")
+            self.assertIsInstance(pages[1][1], ValueError)
+            self.assertEqual(pages[9][1].read(), b"png10")
+            self.assertEqual(max(peak), 4)
+            # A range past the end is clipped; a start past the end is an error
+            self.assertEqual([page for page, _ in self.sut.convertPages(r"\documentclass{article}", 115, "pages", 13, 20)], [13, 14])
+            with self.assertRaises(ValueError):
+                self.sut.convertPages(r"\documentclass{article}", 115, "pages", 15)
+        self.assertEqual(glob.glob("build/*_pages.*"), [])
+
+    def testIdenticalRendersShareOneCompile(self):
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def render(expression, userId, sessionId, returnPdf, keepPdf):
+            started.set()
+            release.wait(5)
+            return io.BytesIO(b"png"), io.BytesIO(b"pdf")
+
+        with patch.object(self.sut, '_convert_single', side_effect=render) as single:
+            threads = [threading.Thread(target=lambda i=i: results.append(self.sut.convertExpression("$x$", 115, "s%d" % i, True)))
+                       for i in range(3)]
+            threads[0].start()
+            started.wait(5)
+            for t in threads[1:]:
+                t.start()
+            time.sleep(0.1)
+            release.set()
+            for t in threads:
+                t.join(5)
+            self.assertEqual(single.call_count, 1)
+            self.assertEqual(self.sut.cacheStats()["inflight_shared"], 2)
+            # Every caller gets its own streams
+            self.assertEqual(len({id(image) for image, _ in results}), 3)
+            self.assertEqual([image.read() + pdf.read() for image, pdf in results], [b"pngpdf"] * 3)
+            # Once finished, the next request renders again
+            self.sut.convertExpression("$x$", 115, "again", True)
+            self.assertEqual(single.call_count, 2)
+
     def testConvertToHtml_mocked(self):
         # Mock out external converter call and create a dummy HTML
         with patch.object(self.sut, '_run_tex_to_html', return_value=None):
@@ -124,7 +328,95 @@ class LatexConverterTest(unittest.TestCase):
                     shutil.rmtree(workdir, ignore_errors=True)
                 except Exception:
                     pass
-       
+
+    def testConvertToHtmlCached(self):
+        def fake_run(tex_path, workdir, **kwargs):
+            with open(os.path.join(workdir, "document.html"), "w", encoding="utf-8") as f:
+                f.write("<html><body><p>cached</p></body></html>")
+        with patch.object(self.sut, '_run_tex_to_html', side_effect=fake_run) as run:
+            first = self.sut.convertToHtml("$y$", 115, "cache1").read()
+            preview = os.path.join(self.cachedir, "preview.zip")
+            second = self.sut.convertToHtml("$y$", 115, "cache2", preview_path=preview).read()
+            self.assertEqual(run.call_count, 1)
+            self.assertEqual(first, second)
+            with open(preview, "rb") as f:
+                self.assertEqual(f.read(), first)
+            self.sut.convertToHtml("$y$", 115, "cache3", html_format="xhtml")
+            self.assertEqual(run.call_count, 2)
+        self.assertEqual(self.sut.cacheStats()["html_hits"], 1)
+        self.assertEqual(self.sut.cacheStats()["html_misses"], 2)
+        self.assertFalse(os.path.exists(os.path.join("build", "html_cache2")))
+
+    def testHtmlCacheKeyFollowsThemeCss(self):
+        css = os.path.join(self.cachedir, "theme.css")
+        with open(css, "w") as f:
+            f.write("body{color:red}")
+        with patch.dict(os.environ, {"LATEXBOT_HTML_THEME": "dark", "LATEXBOT_HTML_THEME_CSS": css}), \
+                patch.dict(ThemeInjector._css_cache, clear=True):
+            before = self.sut._html_theme_fingerprint()
+            with open(css, "w") as f:
+                f.write("body{color:blue}")
+            # A restart reads the file again
+            ThemeInjector._css_cache.clear()
+            self.assertNotEqual(self.sut._html_theme_fingerprint(), before)
+        with patch.dict(os.environ, {"LATEXBOT_HTML_THEME": "system"}):
+            self.assertIsNone(self.sut._html_theme_fingerprint())
+
+    def testConvertToHtmlIncremental(self):
+        def fake_run(tex_path, workdir, **kwargs):
+            with open(os.path.join(workdir, "document.html"), "w", encoding="utf-8") as f:
+                f.write("<html><body><img src='fig-new.svg'></body></html>")
+            with open(os.path.join(workdir, "fig-new.svg"), "w", encoding="utf-8") as f:
+                f.write("<svg/>")
+        workdir = os.path.join("build", "htmlwork_117")
+        with patch.dict(os.environ, {"LATEXBOT_HTML_INCREMENTAL": "true"}), \
+                patch.object(self.sut, '_run_tex_to_html', side_effect=fake_run) as run:
+            try:
+                self.sut.convertToHtml("$a$", 117, "inc1")
+                self.assertFalse(run.call_args.kwargs["draft"])
+                with open(os.path.join(workdir, "old.svg"), "w", encoding="utf-8") as f:
+                    f.write("<svg/>")
+                os.utime(os.path.join(workdir, "old.svg"), (0, 0))
+                self.sut.convertToHtml("$b$", 117, "inc2")
+                self.assertTrue(run.call_args.kwargs["draft"])
+                self.assertFalse(os.path.exists(os.path.join(workdir, "old.svg")))
+                self.assertTrue(os.path.exists(os.path.join(workdir, "fig-new.svg")))
+                # A different preamble invalidates the auxiliary files
+                self.sut.convertToHtml("\\documentclass{article}\\begin{document}b\\end{document}", 117, "inc3")
+                self.assertFalse(run.call_args.kwargs["draft"])
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    def testIncrementalHtmlPackagesOnlyThisRun(self):
+        def fake_run(tex_path, workdir, draft=False, **kwargs):
+            with open(os.path.join(workdir, "document.html"), "w", encoding="utf-8") as f:
+                f.write("<html>%s</html>" % draft)
+            with open(os.path.join(workdir, "document.aux"), "w", encoding="utf-8") as f:
+                f.write("\\relax")
+            if not draft:
+                # A split page the draft run does not produce again
+                with open(os.path.join(workdir, "documentch1.html"), "w", encoding="utf-8") as f:
+                    f.write("<html>chapter</html>")
+        workdir = os.path.join("build", "htmlwork_118")
+        with patch.dict(os.environ, {"LATEXBOT_HTML_INCREMENTAL": "true"}), \
+                patch.object(self.sut, '_run_tex_to_html', side_effect=fake_run) as run:
+            try:
+                with zipfile.ZipFile(self.sut.convertToHtml("$a$", 118, "inc1")) as zf:
+                    self.assertEqual(sorted(zf.namelist()), ["documentch1.html", "index.html"])
+                with zipfile.ZipFile(self.sut.convertToHtml("$b$", 118, "inc2")) as zf:
+                    self.assertEqual(zf.namelist(), ["index.html"])
+                    self.assertEqual(zf.read("index.html"), b"<html>True</html>")
+                # The auxiliaries stay for the next draft run
+                self.assertTrue(os.path.exists(os.path.join(workdir, "document.aux")))
+                # Draft results depend on the previous run, so they are not cached; clean ones are
+                self.sut.convertToHtml("$b$", 118, "inc3")
+                self.assertEqual(run.call_count, 3)
+                self.sut.convertToHtml("$a$", 118, "inc4")
+                self.assertEqual(run.call_count, 3)
+                self.assertEqual(self.sut.cacheStats()["html_hits"], 1)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+
     #def testPrivacySettings(self):
     #    self.sut.logger.debug("Started pdflatex")
     #    self.sut.pdflatex("resources/test/privacy.tex")
@@ -0,0 +1,25 @@
+import unittest
+
+from src.LatexSegmenter import LatexSegmenter
+
+class LatexSegmenterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = LatexSegmenter
+
+    def testInlineAndDisplay(self):
+        self.assertEqual(self.sut.extract(r"compare $a^2$ with $b^2$ and $\int f$"), ["$a^2$", "$b^2$", r"$\int f$"])
+        self.assertEqual(self.sut.extract(r"\(x\) then \[\sum_i i\] and $$y$$"), [r"\(x\)", r"\[\sum_i i\]", "$$y$$"])
+
+    def testEscapesAndUnterminated(self):
+        self.assertEqual(self.sut.extract(r"costs \$5, not $x$"), ["$x$"])
+        self.assertEqual(self.sut.extract(r"$a \$ b$ and \frac{1}{2}"), [r"$a \$ b$"])
+        self.assertEqual(self.sut.extract("$a$ and $b"), ["$a$"])
+        self.assertEqual(self.sut.extract("$$ $$ nothing"), [])
+
+    def testFences(self):
+        text = "see\n```latex\n$a$ and $b$\n```\nthen $c$ ```python\n$no$\n```"
+        self.assertEqual(self.sut.extract(text), ["$a$ and $b$", "$c$"])
+
+if __name__ == '__main__':
+    unittest.main()
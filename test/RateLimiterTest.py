@@ -0,0 +1,45 @@
+import unittest
+
+from src.RateLimiter import RateLimiter
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.sut = RateLimiter({"user": (2, 60), "guild": (3, 60), "global": None}, clock=lambda: self.now)
+
+    def testBurstThenRefill(self):
+        self.assertEqual(self.sut.acquire(1), 0)
+        self.assertEqual(self.sut.acquire(1), 0)
+        # Empty bucket; one token a second
+        self.assertAlmostEqual(self.sut.acquire(1), 1.0)
+        self.assertEqual(self.sut.acquire(2), 0)
+        self.now += 1
+        self.assertEqual(self.sut.acquire(1), 0)
+
+    def testGuildLimitAndAtomicity(self):
+        self.assertEqual(self.sut.acquire(1, guild_id=7), 0)
+        self.assertEqual(self.sut.acquire(2, guild_id=7), 0)
+        self.assertEqual(self.sut.acquire(3, guild_id=7), 0)
+        # Guild is empty: user 4 is refused and keeps its own tokens
+        self.assertGreater(self.sut.acquire(4, guild_id=7), 0)
+        self.assertEqual(self.sut.acquire(4), 0)
+        self.assertEqual(self.sut.acquire(4), 0)
+
+    def testCost(self):
+        self.assertEqual(self.sut.cost("$x$"), 1)
+        self.assertEqual(self.sut.cost(r"\documentclass{article}"), self.sut.document_cost)
+        self.assertEqual(self.sut.cost(html=True), self.sut.html_cost)
+        # Heavier than the burst: allowed once the bucket is full
+        self.assertEqual(self.sut.acquire(1, cost=5), 0)
+        self.assertAlmostEqual(self.sut.acquire(1, cost=5), 2.0)
+
+    def testParseLimit(self):
+        self.assertEqual(RateLimiter.parse_limit("10/20"), (10, 20))
+        self.assertIsNone(RateLimiter.parse_limit("off"))
+        self.assertIsNone(RateLimiter.parse_limit(""))
+        with self.assertRaises(ValueError):
+            RateLimiter.parse_limit("lots")
+
+if __name__ == '__main__':
+    unittest.main()
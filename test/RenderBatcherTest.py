@@ -0,0 +1,55 @@
+import unittest
+
+import threading
+import time
+
+from src.RenderBatcher import RenderBatcher
+
+class RenderBatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.sut = RenderBatcher(self._render, max_window=0.2, max_batch=3)
+
+    def _render(self, items, sessionId):
+        self.batches.append([item for item in items])
+        if items[0] == "slow":
+            self.release.wait(5)
+        return [ValueError(item) if item.startswith("bad") else item.upper() for item in items]
+
+    def _submit_async(self, key, item, results):
+        def run():
+            try:
+                results[item] = self.sut.submit(key, item, item)
+            except ValueError as err:
+                results[item] = err
+        t = threading.Thread(target=run)
+        t.start()
+        return t
+
+    def testIdleRunsImmediately(self):
+        start = time.monotonic()
+        self.assertEqual(self.sut.submit("k", "a", "s"), "A")
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(self.batches, [["a"]])
+
+    def testBatchesUnderLoad(self):
+        results = {}
+        threads = [self._submit_async("k", "slow", results)]
+        time.sleep(0.05)
+        # A compile is in flight: these share a batch per key
+        threads += [self._submit_async("k", item, results) for item in ("a", "bad", "b")]
+        threads.append(self._submit_async("other", "c", results))
+        self.release.set()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(results["a"], "A")
+        self.assertEqual(results["b"], "B")
+        self.assertEqual(results["c"], "C")
+        self.assertIsInstance(results["bad"], ValueError)
+        self.assertEqual(sorted(sorted(b) for b in self.batches), [["a", "b", "bad"], ["c"], ["slow"]])
+        self.assertEqual(self.sut.stats(), {"batches": 3, "batched_renders": 5})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+
+import io
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.RenderClient import RenderClient
+from src.RenderDaemon import RenderDaemon
+
+class FakeConverter:
+    """Just enough of LatexConverter to exercise the protocol."""
+
+    def __init__(self):
+        self.seen = []
+
+    def convertExpression(self, expression, userId, sessionId, returnPdf=False, keepPdf=False):
+        self.seen.append(expression)
+        if expression == "slow":
+            time.sleep(0.5)
+        if expression == "bad":
+            raise ValueError("! Undefined control sequence.")
+        image = io.BytesIO(("png:%s:%s" % (expression, userId)).encode())
+        if keepPdf:
+            return image, (sessionId, 1)
+        return (image, io.BytesIO(b"%PDF " + expression.encode())) if returnPdf else image
+
+    def convertExpressions(self, expressions, userId, sessionId, returnPdf=False, keepPdf=False):
+        results = []
+        for e in expressions:
+            try:
+                results.append(self.convertExpression(e, userId, sessionId, returnPdf, keepPdf))
+            except ValueError as err:
+                results.append(err)
+        return results
+
+    def convertExpressionProgressive(self, expression, userId, sessionId, onPreview, previewDpi=None, returnPdf=False, keepPdf=False):
+        onPreview(io.BytesIO(b"preview"))
+        return self.convertExpression(expression, userId, sessionId, returnPdf, keepPdf)
+
+    def convertPages(self, expression, userId, sessionId, firstPage=1, lastPage=None, keepPdf=False):
+        return [(page, (io.BytesIO(b"page%d" % page), (sessionId, page))) for page in range(firstPage, (lastPage or 3) + 1)]
+
+    def retainedPdf(self, handle):
+        sessionId, page = handle
+        return io.BytesIO(("pdf:%s:%d" % (sessionId, page)).encode())
+
+    def convertToHtml(self, expression, userId, sessionId, html_format=None, make4ht_args=None, preview_path=None):
+        assert preview_path is None
+        return io.BytesIO(b"PK" + os.urandom(3 * 1024 * 1024))
+
+    def resolveHtmlFormat(self, html_format=None):
+        return html_format or "html5"
+
+    def cacheStats(self):
+        return {"html_hits": 1}
+
+
+class RenderDaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.converter = FakeConverter()
+        self.daemon = RenderDaemon(self.converter, host="127.0.0.1", port=0, token="secret")
+        threading.Thread(target=self.daemon.serve_forever, daemon=True).start()
+        self.sut = RenderClient(self.daemon.address, token="secret")
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def testConvertExpression(self):
+        image, pdf = self.sut.convertExpression("$x$", 7, "s", returnPdf=True)
+        self.assertEqual(image.read(), b"png:$x$:7")
+        self.assertEqual(pdf.getvalue(), b"%PDF $x$")
+        with self.assertRaises(ValueError) as ctx:
+            self.sut.convertExpression("bad", 7, "s")
+        self.assertIn("Undefined control sequence", str(ctx.exception))
+
+    def testBatchAndHandles(self):
+        results = self.sut.convertExpressions(["$a$", "bad"], 7, "s", keepPdf=True)
+        image, handle = results[0]
+        self.assertEqual(image.getvalue(), b"png:$a$:7")
+        self.assertEqual(handle, ("s", 1))
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(self.sut.retainedPdf(handle).read(), b"pdf:s:1")
+
+    def testConvertPages(self):
+        pages = self.sut.convertPages(r"\documentclass{article}", 7, "s", 2, keepPdf=True)
+        self.assertEqual([(page, image.read(), handle) for page, (image, handle) in pages],
+                         [(2, b"page2", ("s", 2)), (3, b"page3", ("s", 3))])
+
+    def testProgressive(self):
+        previews = []
+        image = self.sut.convertExpressionProgressive("$x$", 7, "s", lambda stream: previews.append(stream.read()))
+        self.assertEqual(previews, [b"preview"])
+        self.assertEqual(image.read(), b"png:$x$:7")
+
+    def testHtmlPreviewPlacedLocally(self):
+        preview = os.path.join(self.tmp, "html_s.zip")
+        stream = self.sut.convertToHtml("x", 7, "s", preview_path=preview)
+        data = stream.read()
+        self.assertEqual(len(data), 3 * 1024 * 1024 + 2)
+        with open(preview, "rb") as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(self.sut.resolveHtmlFormat(None), "html5")
+        self.assertEqual(self.sut.cacheStats(), {"html_hits": 1})
+
+    def testConcurrentClients(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            images = list(pool.map(lambda i: self.sut.convertExpression("$%d$" % i, i, "s").read(), range(32)))
+        self.assertEqual(images, [("png:$%d$:%d" % (i, i)).encode() for i in range(32)])
+
+    def testStaleConnectionIsRetried(self):
+        self.sut.cacheStats()
+        # The daemon closed the kept-alive connection, e.g. because it was restarted
+        stale, peer = socket.socketpair()
+        peer.close()
+        self.sut._local.sock = stale
+        self.assertEqual(self.sut.convertExpression("$x$", 7, "s").read(), b"png:$x$:7")
+        self.assertEqual(stale.fileno(), -1)
+        self.assertEqual(self.converter.seen, ["$x$"])
+
+    def testReadTimeoutIsNotRetried(self):
+        client = RenderClient(self.daemon.address, token="secret", timeout=0.1)
+        client.cacheStats()
+        sock = client._local.sock
+        with self.assertRaises(socket.timeout):
+            client.convertExpression("slow", 7, "s")
+        # Sent once on the kept-alive socket, which is closed so a late answer is never read
+        self.assertEqual(self.converter.seen, ["slow"])
+        self.assertEqual(sock.fileno(), -1)
+        self.assertIsNone(client._local.sock)
+
+    def testToken(self):
+        with self.assertRaises(RuntimeError):
+            RenderClient(self.daemon.address, token="wrong").cacheStats()
+
+if __name__ == '__main__':
+    unittest.main()
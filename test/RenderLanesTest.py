@@ -0,0 +1,61 @@
+import unittest
+
+import asyncio
+import threading
+
+from src.RenderLanes import RenderLanes
+
+class RenderLanesTest(unittest.TestCase):
+
+    def testLaneFor(self):
+        self.assertEqual(RenderLanes.lane_for("$x$"), "interactive")
+        self.assertEqual(RenderLanes.lane_for(r"\documentclass{article}"), "document")
+        self.assertEqual(RenderLanes.lane_for(r"\begin{tikzpicture}\end{tikzpicture}"), "document")
+        self.assertEqual(RenderLanes.lane_for("$x$", html=True), "html")
+
+    def testHeavyLanesLeaveRoomForInteractive(self):
+        sut = RenderLanes(workers=3, caps={"html": 2})
+        release = threading.Event()
+
+        async def scenario():
+            heavy = [asyncio.ensure_future(sut.run("html", release.wait, 5)) for _ in range(4)]
+            await asyncio.sleep(0.05)
+            # Two conversions run, two wait; the reserved worker is free for math
+            self.assertEqual(sut.stats()["html"], {"running": 2, "queued": 2, "cap": 2})
+            self.assertEqual(await asyncio.wait_for(sut.run("interactive", lambda: "png"), 1), "png")
+            release.set()
+            await asyncio.gather(*heavy)
+
+        asyncio.run(scenario())
+
+    def testPriorityAndErrors(self):
+        sut = RenderLanes(workers=1, reserved=0)
+        release = threading.Event()
+        order = []
+
+        def job(name):
+            order.append(name)
+            if name == "bad":
+                raise ValueError(name)
+            return name
+
+        async def scenario():
+            blocker = asyncio.ensure_future(sut.run("interactive", release.wait, 5))
+            await asyncio.sleep(0.05)
+            html = asyncio.ensure_future(sut.run("html", job, "html"))
+            cancelled = asyncio.ensure_future(sut.run("document", job, "cancelled"))
+            bad = asyncio.ensure_future(sut.run("interactive", job, "bad"))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            release.set()
+            await blocker
+            self.assertEqual(await html, "html")
+            with self.assertRaises(ValueError):
+                await bad
+
+        asyncio.run(scenario())
+        # The interactive job overtook the queued conversion; the cancelled one never ran
+        self.assertEqual(order, ["bad", "html"])
+
+if __name__ == '__main__':
+    unittest.main()
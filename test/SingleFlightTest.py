@@ -0,0 +1,76 @@
+import unittest
+
+import threading
+import time
+
+from src.SingleFlight import SingleFlight
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = SingleFlight()
+
+    def _concurrently(self, key, fn, callers=4):
+        started = threading.Event()
+        results = []
+
+        def leader():
+            started.set()
+            return fn()
+
+        def call(work):
+            try:
+                results.append(self.sut.do(key, work, lambda r: list(r)))
+            except ValueError as err:
+                results.append(err)
+
+        threads = [threading.Thread(target=call, args=(leader if i == 0 else fn,)) for i in range(callers)]
+        threads[0].start()
+        started.wait(5)
+        for t in threads[1:]:
+            t.start()
+        return threads, results
+
+    def testSharesResult(self):
+        release = threading.Event()
+        calls = []
+
+        def work():
+            calls.append(1)
+            release.wait(5)
+            return [1, 2]
+
+        threads, results = self._concurrently("k", work)
+        time.sleep(0.1)
+        release.set()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [[1, 2]] * 4)
+        self.assertEqual(len({id(r) for r in results}), 4)
+        self.assertEqual(self.sut.shared, 3)
+        # Nothing is remembered afterwards
+        self.assertEqual(self.sut.do("k", lambda: [3]), [3])
+
+    def testSharesError(self):
+        release = threading.Event()
+
+        def work():
+            release.wait(5)
+            raise ValueError("! Undefined control sequence.")
+
+        threads, results = self._concurrently("k", work, callers=3)
+        time.sleep(0.1)
+        release.set()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+
+    def testDifferentKeysRunSeparately(self):
+        self.assertEqual(self.sut.do("a", lambda: 1), 1)
+        self.assertEqual(self.sut.do("b", lambda: 2), 2)
+        self.assertEqual(self.sut.shared, 0)
+
+if __name__ == '__main__':
+    unittest.main()
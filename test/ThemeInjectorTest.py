@@ -0,0 +1,51 @@
+import unittest
+from unittest.mock import patch
+
+import os
+import shutil
+import tempfile
+
+from src.ThemeInjector import ThemeInjector
+
+class ThemeInjectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = ThemeInjector("dark", "body{}")
+
+    def testApply(self):
+        html = b"<html><HEAD><title>t</title></HEAD><body id='x'><p>ok</p></body></html>"
+        result = self.sut.apply(html)
+        self.assertEqual(result.count(self.sut.style_tag), 1)
+        self.assertIn(self.sut.style_tag + b"</HEAD>", result)
+        self.assertIn(b"<body id='x' class=\"inlatexbot-dark\">", result)
+
+    def testSplitMarkers(self):
+        html = b"<html><head><meta charset='utf-8'></head><body>" + b"text " * 100 + b"</body></html>"
+        whole = self.sut.apply(html)
+        for size in (1, 3, 7, 64):
+            chunks = [html[i:i + size] for i in range(0, len(html), size)]
+            self.assertEqual(b"".join(self.sut.transform_chunks(chunks)), whole)
+
+    def testKeepsExistingClass(self):
+        result = self.sut.apply(b"<body class='a'>x</body>")
+        self.assertTrue(result.startswith(self.sut.style_tag + b"<body class='a'>"))
+        self.assertEqual(self.sut.apply(b"plain"), b"plain" + self.sut.style_tag)
+
+    def testFromEnv(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            css_path = os.path.join(tmpdir, "custom.css")
+            with open(css_path, "w", encoding="utf-8") as f:
+                f.write("p{color:red}")
+            with patch.dict(os.environ, {"LATEXBOT_HTML_THEME": "system"}):
+                self.assertIsNone(ThemeInjector.from_env())
+            with patch.dict(os.environ, {"LATEXBOT_HTML_THEME": "light", "LATEXBOT_HTML_THEME_CSS": css_path}):
+                self.assertIn(b"p{color:red}", ThemeInjector.from_env().style_tag)
+                os.remove(css_path)
+                # Loaded once: later conversions don't touch the file again
+                self.assertIn(b"p{color:red}", ThemeInjector.from_env().style_tag)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from unittest.mock import Mock
+
+import json
+import os
+import tempfile
+
+from src.TraceReplay import TraceReplay
+
+class TraceReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def _write(self, name, text):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def testLoadBotLog(self):
+        path = self._write("inlatexbot.log",
+                           "11:59:58.000 [DEBUG] Received inline query: $x^2$, id: 1, from user: 115\n"
+                           "11:59:59.500 [DEBUG] Generated image for $x^2$\n"
+                           "12:00:01.250 [DEBUG] Received message: \\[a\n+b\\], id: 7, from: 116\n")
+        records = TraceReplay.load(path)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]["expr"], "$x^2$")
+        self.assertFalse(records[0]["pdf"])
+        self.assertEqual(records[1]["expr"], "\\[a\n+b\\]")
+        self.assertEqual(records[1]["user"], 116)
+        self.assertTrue(records[1]["pdf"])
+        # 12-hour clock wraps from 11:59 to 12:00 without going backwards
+        self.assertAlmostEqual(records[1]["t"] - records[0]["t"], 3.25)
+
+    def testLoadRequestLog(self):
+        lines = [{"t": 5.0, "kind": "html", "user": 1, "expr": "b", "fmt": "html5", "args": []},
+                 {"t": 2.0, "kind": "expr", "user": 1, "expr": "a", "pdf": True}]
+        path = self._write("requests.jsonl", "\n".join(json.dumps(l) for l in lines) + "\n{\"t\": 9")
+        records = TraceReplay.load(path)
+        self.assertEqual([r["expr"] for r in records], ["a", "b"])
+
+    def testReplayReport(self):
+        converter = Mock()
+        converter.convertExpression = Mock(side_effect=[Mock(), ValueError("boom"), Mock()])
+        converter.cacheStats = Mock(side_effect=[{"hits": 1}, {"hits": 3}])
+        records = [{"t": 0.0, "kind": "expr", "user": 1, "expr": "$x$"},
+                   {"t": 1.0, "kind": "expr", "user": 1, "expr": "$y$"},
+                   {"t": 2.0, "kind": "expr", "user": 1, "expr": "$x$", "pdf": True}]
+        report = TraceReplay(converter, speedup=0, workers=1).replay(records)
+        self.assertEqual(report["requests"], 3)
+        self.assertEqual(report["errors"], 1)
+        self.assertAlmostEqual(report["repeat_ratio"], 1 / 3, places=3)
+        self.assertEqual(report["cache"], {"hits": 2})
+        converter.convertExpression.assert_called_with("$x$", 1, "replay_2", returnPdf=True)
+
+if __name__ == '__main__':
+    unittest.main()
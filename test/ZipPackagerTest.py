@@ -0,0 +1,70 @@
+import unittest
+
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+
+from src.ThemeInjector import ThemeInjector
+from src.ZipPackager import ZipPackager
+
+class ZipPackagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.sut = ZipPackager(spool_threshold=1024 * 1024, parallel_threshold=1024, workers=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _write(self, rel, data):
+        path = os.path.join(self.tmpdir, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def testPackage(self):
+        self._write("index.html", b"<p>" + b"hello " * 2000 + b"</p>")
+        self._write("small.css", b"p{}")
+        self._write("img/figure.png", os.urandom(4096))
+        self._write("fig-0123456789abcdef0123456789abcdef.svg", b"<svg/>" * 100)
+        stream = self.sut.package(self.tmpdir)
+        with zipfile.ZipFile(stream) as zf:
+            self.assertIsNone(zf.testzip())
+            infos = {i.filename: i for i in zf.infolist()}
+            self.assertEqual(sorted(infos), ["fig-0123456789abcdef0123456789abcdef.svg", "img/figure.png", "index.html", "small.css"])
+            self.assertEqual(infos["index.html"].compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(infos["img/figure.png"].compress_type, zipfile.ZIP_STORED)
+            # Deflating three bytes would grow them, so the member is stored
+            self.assertEqual(infos["small.css"].compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zf.read("index.html"), b"<p>" + b"hello " * 2000 + b"</p>")
+
+    def testTransform(self):
+        self._write("index.html", b"<html><head></head><body>" + b"x" * 5000 + b"</body></html>")
+        self._write("style.css", b"p{}" * 100)
+        theme = ThemeInjector("dark", "body{}")
+        stream = ZipPackager(parallel_threshold=1024, workers=2, transform=theme).package(self.tmpdir)
+        with zipfile.ZipFile(stream) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertIn(theme.style_tag, zf.read("index.html"))
+            self.assertEqual(zf.read("style.css"), b"p{}" * 100)
+
+    def testSpoolsLargeArchives(self):
+        payload = os.urandom(64 * 1024)
+        self._write("a.png", payload)
+        self._write("b.png", payload)
+        stream = ZipPackager(spool_threshold=32 * 1024).package(self.tmpdir)
+        self.assertNotIsInstance(stream, io.BytesIO)
+        with zipfile.ZipFile(stream) as zf:
+            self.assertEqual(zf.read("b.png"), payload)
+        stream.close()
+        self.assertIsInstance(self.sut.package(self.tmpdir), io.BytesIO)
+
+    def testPassthrough(self):
+        self._write("document.odt", b"PK" + b"\x00" * 10)
+        stream = self.sut.passthrough(os.path.join(self.tmpdir, "document.odt"))
+        self.assertEqual(stream.read(), b"PK" + b"\x00" * 10)
+
+if __name__ == '__main__':
+    unittest.main()